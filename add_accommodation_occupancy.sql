@@ -0,0 +1,18 @@
+-- Occupazione giornaliera degli alloggi (vedi bookings/occupancy.py).
+-- Per ogni alloggio e per ogni stato (booked, pending, blocked) un contatore a
+-- 16 bit little-endian per giorno, a partire da `origin` per `days` giorni.
+-- Le righe vengono create e aggiornate dall'applicazione; dopo aver creato la
+-- tabella eseguire `python manage.py rebuild_occupancy` e impostare
+-- OCCUPANCY_ENABLED=True.
+CREATE TABLE accommodation_occupancy (
+    accommodation_id INT NOT NULL,
+    origin DATE NOT NULL,
+    days INT NOT NULL,
+    booked BLOB NOT NULL,
+    pending BLOB NOT NULL,
+    blocked BLOB NOT NULL,
+    updated_at DATETIME(6) NOT NULL,
+    PRIMARY KEY (accommodation_id),
+    CONSTRAINT fk_occupancy_accommodation FOREIGN KEY (accommodation_id)
+        REFERENCES accommodations (id) ON DELETE CASCADE
+) ENGINE=InnoDB;
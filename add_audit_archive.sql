@@ -0,0 +1,37 @@
+-- Indice per l'ordinamento della lista audit e per l'archiviazione per data
+CREATE INDEX idx_audit_created ON booking_audit (created_at);
+
+-- Archivio dei log di audit (vedi `python manage.py archive_booking_audit`).
+-- Partizionato per mese su created_at: le partizioni vecchie si possono
+-- esportare o eliminare con ALTER TABLE ... DROP PARTITION senza toccare le altre.
+-- MySQL non ammette chiavi esterne sulle tabelle partizionate e richiede che la
+-- colonna di partizionamento faccia parte della chiave primaria.
+CREATE TABLE booking_audit_archive (
+    id BIGINT NOT NULL,
+    booking_id BIGINT NULL,
+    action VARCHAR(64) NOT NULL,
+    actor_user_id BIGINT NULL,
+    data_json JSON NULL,
+    created_at DATETIME(6) NOT NULL,
+    PRIMARY KEY (id, created_at),
+    KEY idx_audit_arch_booking (booking_id, created_at),
+    KEY idx_audit_arch_actor (actor_user_id),
+    KEY idx_audit_arch_created (created_at)
+) ENGINE=InnoDB ROW_FORMAT=COMPRESSED
+PARTITION BY RANGE COLUMNS (created_at) (
+    PARTITION p2024_01 VALUES LESS THAN ('2024-02-01'),
+    PARTITION p2024_02 VALUES LESS THAN ('2024-03-01'),
+    PARTITION p2024_03 VALUES LESS THAN ('2024-04-01'),
+    PARTITION p2024_04 VALUES LESS THAN ('2024-05-01'),
+    PARTITION p2024_05 VALUES LESS THAN ('2024-06-01'),
+    PARTITION p2024_06 VALUES LESS THAN ('2024-07-01'),
+    PARTITION pmax VALUES LESS THAN (MAXVALUE)
+);
+
+-- Le partizioni dei mesi successivi vengono aggiunte da archive_booking_audit:
+-- prima di spostare le righe divide pmax fino al mese successivo a quello
+-- archiviato. A mano (o per anticipare più mesi) l'operazione è, ad esempio:
+-- ALTER TABLE booking_audit_archive REORGANIZE PARTITION pmax INTO (
+--     PARTITION p2024_07 VALUES LESS THAN ('2024-08-01'),
+--     PARTITION pmax VALUES LESS THAN (MAXVALUE)
+-- );
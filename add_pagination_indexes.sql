@@ -0,0 +1,3 @@
+-- Indici per la paginazione a cursore su -created_at (lista prenotazioni e "le mie prenotazioni")
+CREATE INDEX idx_bookings_created ON bookings (created_at);
+CREATE INDEX idx_bookings_user_created ON bookings (user_id, created_at);
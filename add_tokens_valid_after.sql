@@ -0,0 +1,3 @@
+-- Revoca dei token JWT al cambio password (vedi bookings/authentication.py):
+-- i token emessi prima di questo istante vengono rifiutati
+ALTER TABLE users ADD COLUMN tokens_valid_after DATETIME(6) NULL AFTER last_login;
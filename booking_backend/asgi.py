@@ -9,8 +9,13 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 
 import os
 
+from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'booking_backend.settings')
+# Async views on, WhiteNoise off (see settings.py)
+os.environ.setdefault('DJANGO_ASGI', '1')
 
-application = get_asgi_application()
+# Static files (admin, browsable API) without a sync middleware in front of every
+# request; behind a reverse proxy or CDN serve STATIC_ROOT from there instead
+application = ASGIStaticFilesHandler(get_asgi_application())
@@ -0,0 +1,6 @@
+"""
+MySQL backend with connection metrics and an optional bounded connection pool.
+
+Set ENGINE to 'booking_backend.mysql_pool' and configure the pool through the
+database's POOL dict (see settings.py and pool.py).
+"""
@@ -0,0 +1,87 @@
+import threading
+from functools import partial
+
+from django.db.backends.mysql.base import Database, DatabaseWrapper as MySQLDatabaseWrapper
+
+from bookings import metrics
+
+from .pool import ConnectionPool, PoolTimeout
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, options):
+    """The process-wide pool of a database alias, None when POOL['SIZE'] is 0"""
+    if not options.get('SIZE'):
+        return None
+    with _pools_lock:
+        if alias not in _pools:
+            _pools[alias] = ConnectionPool(
+                size=options['SIZE'],
+                timeout=options.get('TIMEOUT', 10),
+                recycle=options.get('RECYCLE', 1800),
+                ping_after=options.get('PING_AFTER', 10),
+            )
+        return _pools[alias]
+
+
+class DatabaseWrapper(MySQLDatabaseWrapper):
+    """
+    MySQL wrapper that records how connections are obtained (`db.connection.*`
+    metrics) and, with a POOL size, checks them out of a bounded pool instead
+    of opening and closing one per thread.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = get_pool(self.alias, self.settings_dict.get('POOL') or {})
+        self._reuse_pending = False
+
+    def get_new_connection(self, conn_params):
+        if self.pool is None:
+            with metrics.timer('db.connection.open'):
+                connection = super().get_new_connection(conn_params)
+            metrics.incr('db.connection.opened')
+            return connection
+        try:
+            return self.pool.acquire(partial(super().get_new_connection, conn_params), _ping)
+        except PoolTimeout as e:
+            raise Database.OperationalError(str(e)) from e
+
+    def connect(self):
+        self._reuse_pending = False
+        super().connect()
+
+    def ensure_connection(self):
+        # First use in a request of a connection kept from a previous one (CONN_MAX_AGE)
+        if self._reuse_pending and self.connection is not None:
+            self._reuse_pending = False
+            metrics.incr('db.connection.reused')
+        super().ensure_connection()
+
+    def close_if_unusable_or_obsolete(self):
+        # Its own get_autocommit() call is not a use
+        self._reuse_pending = False
+        if self.pool is not None and self.connection is not None and not self.in_atomic_block:
+            # Back to the pool at every request boundary whatever CONN_MAX_AGE says: a thread
+            # keeping its connection between requests leaves the others waiting (PoolTimeout)
+            self.close()
+            return
+        super().close_if_unusable_or_obsolete()
+        self._reuse_pending = self.connection is not None
+
+    def _close(self):
+        if self.pool is None or self.connection is None:
+            return super()._close()
+        # A connection with an open transaction or after errors is not handed to another thread
+        discard = self.in_atomic_block or self.errors_occurred or self.autocommit != self.settings_dict['AUTOCOMMIT']
+        self.pool.release(self.connection, discard=discard)
+
+
+def _ping(connection):
+    try:
+        connection.ping()
+    except Database.Error:
+        return False
+    return True
@@ -0,0 +1,114 @@
+"""
+A bounded, thread-safe pool of DB-API connections, shared by the threads of a
+worker process (e.g. waitress).
+
+At most `size` connections are checked out or idle at any time; a thread that
+finds none free waits up to `timeout` seconds. Idle connections older than
+`recycle` seconds are closed instead of reused, and those idle for more than
+`ping_after` seconds are pinged first (dropped if the server went away).
+Connections are never shared across a fork: a child process starts an empty
+pool.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+from bookings import metrics
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class _Entry:
+    __slots__ = ('connection', 'created_at', 'returned_at')
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.created_at = time.monotonic()
+        self.returned_at = self.created_at
+
+
+class ConnectionPool:
+    def __init__(self, size, timeout=10, recycle=1800, ping_after=10):
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._idle = deque()
+        # id(connection) -> _Entry of the checked out connections
+        self._in_use = {}
+
+    def acquire(self, connect, ping):
+        """A connection from the pool, or a new one from connect(); ping(connection) must return False if broken"""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+        with metrics.timer('db.pool.wait'):
+            if not self._slots.acquire(timeout=self.timeout):
+                metrics.incr('db.pool.timeouts')
+                raise PoolTimeout(f'No database connection free within {self.timeout}s (pool size {self.size})')
+        try:
+            entry = self._reuse(ping)
+            if entry is None:
+                with metrics.timer('db.connection.open'):
+                    entry = _Entry(connect())
+                metrics.incr('db.connection.opened')
+            else:
+                metrics.incr('db.connection.pool_reused')
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._in_use[id(entry.connection)] = entry
+        return entry.connection
+
+    def _reuse(self, ping):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                entry = self._idle.pop()
+            now = time.monotonic()
+            if now - entry.created_at >= self.recycle:
+                metrics.incr('db.pool.recycled')
+            elif now - entry.returned_at < self.ping_after or ping(entry.connection):
+                return entry
+            else:
+                metrics.incr('db.pool.broken')
+            _close_quietly(entry.connection)
+
+    def release(self, connection, discard=False):
+        """Give a connection back; discarded connections are closed, freeing their slot"""
+        with self._lock:
+            entry = self._in_use.pop(id(connection), None)
+            if entry is None:
+                # Checked out before a fork, or already released
+                _close_quietly(connection)
+                return
+            if not discard:
+                entry.returned_at = time.monotonic()
+                self._idle.append(entry)
+        if discard:
+            _close_quietly(connection)
+        self._slots.release()
+
+    def close_idle(self):
+        with self._lock:
+            idle, self._idle = self._idle, deque()
+        for entry in idle:
+            _close_quietly(entry.connection)
+
+
+def _close_quietly(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
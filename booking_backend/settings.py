@@ -51,6 +51,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'bookings.middleware.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -81,6 +82,7 @@ WSGI_APPLICATION = 'booking_backend.wsgi.application'
 import os
 from dotenv import load_dotenv
 import base64
+import copy
 from pathlib import Path as _Path
 from django.core.exceptions import ImproperlyConfigured
 from typing import Any, cast
@@ -104,14 +106,30 @@ if _db_require_tls and _db_ca_b64 and not _db_ca_path:
     except Exception as _e:
         raise ImproperlyConfigured(f"Failed to write DB SSL CA file: {_e}")
 
+# Connection reuse: CONN_MAX_AGE keeps each thread's connection open between
+# requests (0 = close at the end of every request, 'None' = no limit) and
+# CONN_HEALTH_CHECKS pings it before reuse. With DB_POOL_SIZE > 0 the threads of
+# a worker (e.g. waitress) share at most DB_POOL_SIZE connections instead
+# (see booking_backend/mysql_pool) and each request returns its connection to the
+# pool when it ends, whatever DB_CONN_MAX_AGE says.
+_db_conn_max_age = os.getenv('DB_CONN_MAX_AGE', '60')
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
+        'ENGINE': 'booking_backend.mysql_pool',
         'NAME': os.getenv('DB_NAME', 'booking_db'),
         'USER': os.getenv('DB_USER', 'root'),
         'PASSWORD': os.getenv('DB_PASSWORD', ''),
         'HOST': os.getenv('DB_HOST', 'localhost'),
         'PORT': os.getenv('DB_PORT', '3306'),
+        'CONN_MAX_AGE': None if _db_conn_max_age.lower() == 'none' else int(_db_conn_max_age),
+        'CONN_HEALTH_CHECKS': os.getenv('DB_CONN_HEALTH_CHECKS', 'True').lower() in ('1', 'true', 'yes'),
+        'POOL': {
+            'SIZE': int(os.getenv('DB_POOL_SIZE', '0')),
+            'TIMEOUT': float(os.getenv('DB_POOL_TIMEOUT', '10')),
+            'RECYCLE': int(os.getenv('DB_POOL_RECYCLE', '1800')),
+            'PING_AFTER': int(os.getenv('DB_POOL_PING_AFTER', '10')),
+        },
         'OPTIONS': {
             'init_command': "SET sql_mode='STRICT_TRANS_TABLES'",
         }
@@ -130,6 +148,30 @@ if _db_require_tls:
     DATABASES['default'].setdefault('OPTIONS', {})
     DATABASES['default']['OPTIONS']['ssl'] = cast(Any, {'ca': _db_ca_path})
 
+# Read replicas (see bookings/db_router.py): DB_REPLICA_HOSTS is a comma-separated
+# list of host[:port] sharing the primary's settings (DB_REPLICA_USER /
+# DB_REPLICA_PASSWORD override the credentials). To try the routing locally,
+# list the primary's own host. After a write, the same client reads from the
+# primary for DB_REPLICA_PIN_SECONDS (use a shared CACHE_BACKEND with several
+# workers).
+DATABASE_REPLICAS = []
+for _host in filter(None, (_h.strip() for _h in os.getenv('DB_REPLICA_HOSTS', '').split(','))):
+    _alias = f'replica{len(DATABASE_REPLICAS) + 1}'
+    _replica_host, _, _replica_port = _host.partition(':')
+    DATABASES[_alias] = {
+        **copy.deepcopy(DATABASES['default']),
+        'HOST': _replica_host,
+        'PORT': _replica_port or DATABASES['default']['PORT'],
+        'USER': os.getenv('DB_REPLICA_USER', DATABASES['default']['USER']),
+        'PASSWORD': os.getenv('DB_REPLICA_PASSWORD', DATABASES['default']['PASSWORD']),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(_alias)
+
+DATABASE_ROUTERS = ['bookings.db_router.ReplicaRouter']
+DATABASE_REPLICA_PIN_SECONDS = int(os.getenv('DB_REPLICA_PIN_SECONDS', '10'))
+DATABASE_REPLICA_PIN_CACHE = 'default'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -168,6 +210,16 @@ USE_TZ = True
 STATIC_URL = 'static/'
 
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+
+# Under ASGI (booking_backend/asgi.py sets DJANGO_ASGI=1) the availability and
+# statistics endpoints are served by async views (bookings/async_views.py).
+# WhiteNoise only runs synchronously and would put every request back on a
+# thread, so there static files are served by the ASGI application instead.
+RUNNING_ASGI = os.getenv('DJANGO_ASGI') == '1'
+ASYNC_VIEWS_ENABLED = os.getenv('ASYNC_VIEWS_ENABLED', str(RUNNING_ASGI)).lower() in ('1', 'true', 'yes')
+if RUNNING_ASGI:
+    MIDDLEWARE.remove('whitenoise.middleware.WhiteNoiseMiddleware')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -177,9 +229,12 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = 'bookings.User'
 
 # REST Framework settings
+# 'production' serves the API as JSON only, 'development' also as browsable HTML
+API_PROFILE = os.getenv('API_PROFILE', 'development')
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'bookings.authentication.StatelessJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
@@ -191,9 +246,16 @@ REST_FRAMEWORK = {
         'rest_framework.filters.SearchFilter',
         'rest_framework.filters.OrderingFilter',
     ),
+    # orjson-backed, same output as DRF's JSON renderer/parser (bookings/renderers.py);
+    # the 'production' API_PROFILE drops the browsable API
     'DEFAULT_RENDERER_CLASSES': (
-        'rest_framework.renderers.JSONRenderer',
-        'rest_framework.renderers.BrowsableAPIRenderer',
+        'bookings.renderers.FastJSONRenderer',
+        *(() if API_PROFILE == 'production' else ('rest_framework.renderers.BrowsableAPIRenderer',)),
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'bookings.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ),
     'EXCEPTION_HANDLER': 'rest_framework.views.exception_handler',
     'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.coreapi.AutoSchema',
@@ -224,8 +286,18 @@ SIMPLE_JWT = {
     'TOKEN_TYPE_CLAIM': 'token_type',
 
     'JTI_CLAIM': 'jti',
+
+    'TOKEN_OBTAIN_SERIALIZER': 'bookings.authentication.BookingTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'bookings.authentication.BookingTokenRefreshSerializer',
 }
 
+# Stateless JWT: requests are authenticated from the token claims (role, is_staff)
+# without loading the user; deactivations, revocations and permission changes are
+# seen within JWT_USER_STATE_TTL seconds (see bookings/authentication.py)
+JWT_STATELESS_AUTH = os.getenv('JWT_STATELESS_AUTH', 'False').lower() in ('1', 'true', 'yes')
+JWT_USER_STATE_TTL = int(os.getenv('JWT_USER_STATE_TTL', '60'))
+JWT_STATE_CACHE = 'default'
+
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True  # Per sviluppo - permetti tutte le origini
 
@@ -260,3 +332,66 @@ CORS_ALLOW_METHODS = [
     'POST',
     'PUT',
 ]
+
+# In-memory availability index (see bookings/interval_index.py). Per process: another
+# worker's writes are only seen after AVAILABILITY_INDEX_TTL, so keep it off with several
+# worker processes
+AVAILABILITY_INDEX_ENABLED = os.getenv('AVAILABILITY_INDEX_ENABLED', 'False').lower() in ('1', 'true', 'yes')
+# Seconds after which an accommodation is reloaded, so writes made by other processes are picked up
+AVAILABILITY_INDEX_TTL = int(os.getenv('AVAILABILITY_INDEX_TTL', '60'))
+
+# Per-day occupancy bitmaps (see bookings/occupancy.py). Needs the table of
+# add_accommodation_occupancy.sql, filled with `python manage.py rebuild_occupancy`
+OCCUPANCY_ENABLED = os.getenv('OCCUPANCY_ENABLED', 'False').lower() in ('1', 'true', 'yes')
+# Rolling window: days kept before and after today
+OCCUPANCY_PAST_DAYS = int(os.getenv('OCCUPANCY_PAST_DAYS', '30'))
+OCCUPANCY_HORIZON_DAYS = int(os.getenv('OCCUPANCY_HORIZON_DAYS', '730'))
+# Seconds a process reuses its copy of the stored bitmaps (writes of other processes show up after it)
+OCCUPANCY_TTL = int(os.getenv('OCCUPANCY_TTL', '60'))
+
+# Seconds a process reuses its compiled BlockedWeekday rules (see bookings/weekday_rules.py);
+# changes made by other processes show up after it
+WEEKDAY_RULES_TTL = int(os.getenv('WEEKDAY_RULES_TTL', '60'))
+
+# List endpoints serialize values() rows instead of model instances, with the same
+# output as their ModelSerializers (see bookings/fast_serializers.py)
+FAST_LIST_SERIALIZERS = os.getenv('FAST_LIST_SERIALIZERS', 'True').lower() in ('1', 'true', 'yes')
+
+# Tests create the tables of the unmanaged models directly (see bookings/test_runner.py)
+TEST_RUNNER = 'bookings.test_runner.UnmanagedModelTestRunner'
+
+# Cache (per-process memory by default; point CACHE_BACKEND/CACHE_LOCATION to Redis or
+# Memcached to share it between worker processes)
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+# Read-through cache of the accommodation endpoints, invalidated per accommodation on
+# every write (see bookings/response_cache.py). With the per-process default cache each
+# worker only sees its own writes until ACCOMMODATION_CACHE_TTL expires: use a shared
+# CACHE_BACKEND when running several workers. When disabled the calendar and iCalendar
+# feeds are rebuilt on every request.
+ACCOMMODATION_CACHE_ENABLED = os.getenv('ACCOMMODATION_CACHE_ENABLED', 'False').lower() in ('1', 'true', 'yes')
+ACCOMMODATION_CACHE_TTL = int(os.getenv('ACCOMMODATION_CACHE_TTL', '300'))
+ACCOMMODATION_CACHE_ALIAS = 'default'
+
+# iCalendar feed window (days before and after today, see bookings/ical.py)
+ICAL_PAST_DAYS = int(os.getenv('ICAL_PAST_DAYS', '30'))
+ICAL_HORIZON_DAYS = int(os.getenv('ICAL_HORIZON_DAYS', '365'))
+
+# Booking audit trail (see bookings/audit.py): 'deferred' writes the entries after commit
+# from a background thread, in batches; 'sync' writes them in the request transaction
+BOOKING_AUDIT_MODE = os.getenv('BOOKING_AUDIT_MODE', 'deferred')
+BOOKING_AUDIT_BATCH_SIZE = int(os.getenv('BOOKING_AUDIT_BATCH_SIZE', '100'))
+BOOKING_AUDIT_FLUSH_INTERVAL = float(os.getenv('BOOKING_AUDIT_FLUSH_INTERVAL', '1.0'))
+BOOKING_AUDIT_QUEUE_SIZE = int(os.getenv('BOOKING_AUDIT_QUEUE_SIZE', '10000'))
+# Age after which `manage.py archive_booking_audit` moves audit rows to booking_audit_archive
+BOOKING_AUDIT_ARCHIVE_AFTER_DAYS = int(os.getenv('BOOKING_AUDIT_ARCHIVE_AFTER_DAYS', '180'))
+
+# Booking statistics: 'aggregate' (one query per status breakdown) or 'counters'
+# (cache counters kept up to date by the booking write paths, see bookings/statistics.py)
+BOOKING_STATISTICS_MODE = os.getenv('BOOKING_STATISTICS_MODE', 'aggregate')
+BOOKING_STATISTICS_CACHE = 'default'
@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from .models import (
     User, Role, Accommodation, Booking, BookingGuest,
-    BlockedPeriod, BlockedWeekday, BookingAudit
+    BlockedPeriod, BlockedWeekday, BookingAudit, BookingAuditArchive
 )
 
 
@@ -83,3 +83,16 @@ class BookingAuditAdmin(admin.ModelAdmin):
     def has_change_permission(self, request, obj=None):
         return False
 
+
+
+@admin.register(BookingAuditArchive)
+class BookingAuditArchiveAdmin(admin.ModelAdmin):
+    list_display = ['id', 'booking', 'action', 'actor_user', 'created_at']
+    list_filter = ['action', 'created_at']
+    search_fields = ['booking__id', 'actor_user__email']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,150 @@
+"""
+Archival of old booking audit rows.
+
+`archive_audit` moves the rows of `booking_audit` older than a cutoff into
+`booking_audit_archive` (monthly partitions, see add_audit_archive.sql) in
+batches, each batch copied and deleted in its own transaction, so the hot
+table only holds recent entries and its per-booking / per-actor lookups stay
+small. Ids are preserved. On MySQL each run first splits the catch-all
+`pmax` partition so that the months it is about to write (and the next one)
+have their own partition; otherwise every row after the last month created
+by the SQL script would pile up in `pmax`.
+
+Reads stay transparent: `paginated_audit_response` pages through the hot
+table first and, after its last page, links to the archive (`?archived=1`),
+which holds only older entries; `get_audit_entry` falls back to the archive
+for single entries.
+"""
+import re
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.http import Http404
+from django.utils import timezone
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from . import metrics
+from .fast_serializers import paginate_rows, row_serializer_for
+from .models import BookingAudit, BookingAuditArchive
+from .pagination import CreatedAtCursorPagination
+
+ARCHIVED_PARAM = 'archived'
+ARCHIVE_FIELDS = ['id', 'booking_id', 'action', 'actor_user_id', 'data_json', 'created_at']
+CATCH_ALL_PARTITION = 'pmax'
+
+_MONTH_PARTITION = re.compile(r'^p(\d{4})_(\d{2})$')
+
+
+def default_cutoff():
+    return timezone.now() - timedelta(days=getattr(settings, 'BOOKING_AUDIT_ARCHIVE_AFTER_DAYS', 180))
+
+
+def _next_month(year, month):
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def partitions_to_add(existing, cutoff, ahead=1):
+    """
+    The (name, upper bound) of the monthly partitions missing after the last
+    of `existing` up to the month of `cutoff` plus `ahead` months. Bounds are
+    UTC dates, as created_at is stored in UTC.
+    """
+    cutoff = cutoff.astimezone(dt_timezone.utc)
+    last = (cutoff.year, cutoff.month)
+    for _ in range(ahead):
+        last = _next_month(*last)
+    months = sorted((int(match[1]), int(match[2])) for match in map(_MONTH_PARTITION.match, existing) if match)
+    month = _next_month(*months[-1]) if months else (cutoff.year, cutoff.month)
+    missing = []
+    while month <= last:
+        bound = _next_month(*month)
+        missing.append((f'p{month[0]}_{month[1]:02d}', f'{bound[0]}-{bound[1]:02d}-01'))
+        month = bound
+    return missing
+
+
+def ensure_partitions(cutoff):
+    """Split pmax into the monthly partitions missing up to `cutoff` (MySQL only); returns their names"""
+    connection = connections[router.db_for_write(BookingAuditArchive)]
+    if connection.vendor != 'mysql':
+        return []
+    table = BookingAuditArchive._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT partition_name FROM information_schema.partitions '
+            'WHERE table_schema = DATABASE() AND table_name = %s AND partition_name IS NOT NULL',
+            [table]
+        )
+        existing = [row[0] for row in cursor.fetchall()]
+        if CATCH_ALL_PARTITION not in existing:
+            return []
+        missing = partitions_to_add(existing, cutoff)
+        if missing:
+            partitions = ', '.join(f"PARTITION {name} VALUES LESS THAN ('{bound}')" for name, bound in missing)
+            cursor.execute(
+                f'ALTER TABLE {connection.ops.quote_name(table)} REORGANIZE PARTITION {CATCH_ALL_PARTITION} '
+                f'INTO ({partitions}, PARTITION {CATCH_ALL_PARTITION} VALUES LESS THAN (MAXVALUE))'
+            )
+            metrics.incr('audit.archive_partitions_added', len(missing))
+    return [name for name, _ in missing]
+
+
+def archive_audit(cutoff=None, batch_size=1000, limit=None):
+    """Move the audit rows created before `cutoff`; returns how many were moved"""
+    cutoff = cutoff or default_cutoff()
+    ensure_partitions(cutoff)
+    moved = 0
+    while limit is None or moved < limit:
+        size = batch_size if limit is None else min(batch_size, limit - moved)
+        with transaction.atomic(), metrics.timer('audit.archive_batch'):
+            rows = list(
+                BookingAudit.objects.filter(created_at__lt=cutoff).order_by('created_at', 'id')
+                .values(*ARCHIVE_FIELDS)[:size]
+            )
+            if not rows:
+                break
+            # ignore_conflicts: rows copied by an interrupted run are not copied twice
+            BookingAuditArchive.objects.bulk_create(
+                [BookingAuditArchive(**row) for row in rows], ignore_conflicts=True
+            )
+            BookingAudit.objects.filter(id__in=[row['id'] for row in rows]).delete()
+        moved += len(rows)
+        metrics.incr('audit.archived', len(rows))
+    return moved
+
+
+def paginated_audit_response(view, serializer_class, **filters):
+    """
+    Cursor-paginate the audit entries matching `filters`: the hot table first,
+    then (`?archived=1`) the archive. Archived entries are older than the hot
+    ones, so the pages keep the -created_at order across the two tables.
+    """
+    request = view.request
+    archived = request.query_params.get(ARCHIVED_PARAM) == '1'
+    model = BookingAuditArchive if archived else BookingAudit
+    queryset = model.objects.filter(**filters).select_related('actor_user')
+
+    paginator = CreatedAtCursorPagination()
+    row_serializer = row_serializer_for(serializer_class)
+    if row_serializer is not None:
+        data, _ = paginate_rows(paginator, row_serializer, queryset, request, view)
+    else:
+        page = paginator.paginate_queryset(queryset, request, view=view)
+        data = serializer_class(page, many=True, context=view.get_serializer_context()).data
+    response = paginator.get_paginated_response(data)
+
+    if not archived and response.data['next'] is None and BookingAuditArchive.objects.filter(**filters).exists():
+        url = remove_query_param(request.build_absolute_uri(), paginator.cursor_query_param)
+        response.data['next'] = replace_query_param(url, ARCHIVED_PARAM, '1')
+    return response
+
+
+def get_audit_entry(pk, **filters):
+    """A single entry from the hot table, or from the archive once it has been moved"""
+    for model in (BookingAudit, BookingAuditArchive):
+        try:
+            return model.objects.select_related('actor_user').get(pk=pk, **filters)
+        except (model.DoesNotExist, ValueError):
+            continue
+    raise Http404
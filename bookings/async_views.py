@@ -0,0 +1,133 @@
+"""
+Async versions of the public availability and statistics endpoints, routed
+instead of the DRF views when ASYNC_VIEWS_ENABLED is on (the default under
+booking_backend/asgi.py).
+
+They return the same JSON as the DRF views and share their response cache
+entries. Independent queries are awaited together with asyncio.gather, and a
+warm availability index or a cache hit answers without any thread hop. The
+DRF features these public endpoints do not need (browsable API, format
+negotiation, authentication) are left out.
+"""
+import asyncio
+import json
+
+from django.http import HttpResponse, HttpResponseBase
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST, require_safe
+
+from . import statistics
+from .availability import alookup_conflicts
+from .models import Accommodation
+from .renderers import FastJSONRenderer
+from .response_cache import response_cache, ALL_ACCOMMODATIONS
+from .serializers import (
+    AccommodationSerializer, AvailabilityCheckSerializer, BookingSerializer, BlockedPeriodSerializer,
+    BlockedWeekdaySerializer
+)
+from .views import parse_range
+
+
+def _json(data, status=200):
+    return HttpResponse(FastJSONRenderer().render(data), status=status, content_type='application/json')
+
+
+def _request_data(request):
+    if request.content_type == 'application/json':
+        try:
+            return json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+    return request.POST
+
+
+@csrf_exempt
+@require_POST
+async def check_availability(request):
+    """Check availability for a booking"""
+    data = _request_data(request)
+    if data is None:
+        return _json({'detail': 'JSON parse error'}, status=400)
+    serializer = AvailabilityCheckSerializer(data=data)
+    if not serializer.is_valid():
+        return _json(serializer.errors, status=400)
+
+    accommodation_id = serializer.validated_data['accommodation_id']
+    check_in = serializer.validated_data['check_in']
+    check_out = serializer.validated_data['check_out']
+
+    async def compute():
+        accommodation, conflicts = await asyncio.gather(
+            Accommodation.objects.filter(id=accommodation_id).afirst(),
+            alookup_conflicts(accommodation_id, check_in, check_out),
+        )
+        if accommodation is None:
+            return _json({'error': 'Accommodation not found'}, status=404)
+        return {
+            'available': conflicts.available,
+            'accommodation': AccommodationSerializer(accommodation).data,
+            'check_in': check_in,
+            'check_out': check_out,
+            'conflicting_bookings_count': conflicts.bookings_count,
+            'blocked_periods_count': conflicts.blocked_periods_count,
+            'blocked_weekdays_count': conflicts.blocked_weekdays_count
+        }
+
+    return await _cached(
+        accommodation_id, 'check_availability', (request.build_absolute_uri(), check_in, check_out), compute
+    )
+
+
+@require_safe
+async def accommodation_availability(request, slug):
+    """Check availability for a specific accommodation"""
+    async def compute():
+        accommodation = await Accommodation.objects.filter(slug=slug).afirst()
+        if accommodation is None:
+            return _json({'detail': 'No Accommodation matches the given query.'}, status=404)
+        check_in, check_out, error = parse_range(request.GET)
+        if error:
+            return _json({'error': error}, status=400)
+
+        conflicts = await alookup_conflicts(accommodation.id, check_in, check_out)
+        bookings, blocked_periods, blocked_weekdays = await asyncio.gather(
+            _all(conflicts.booking_queryset().select_related('accommodation', 'user').prefetch_related('guests')),
+            _all(conflicts.blocked_period_queryset().select_related('accommodation', 'created_by')),
+            _all(conflicts.blocked_weekday_queryset().select_related('accommodation', 'created_by').order_by('id')),
+        )
+        return {
+            'available': conflicts.available,
+            'accommodation': AccommodationSerializer(accommodation).data,
+            'conflicting_bookings': BookingSerializer(bookings, many=True).data,
+            'blocked_periods': BlockedPeriodSerializer(blocked_periods, many=True).data,
+            'blocked_weekdays': BlockedWeekdaySerializer(blocked_weekdays, many=True).data
+        }
+
+    if not response_cache.enabled:
+        return await _cached(None, 'availability', (), compute)
+    accommodation_id = await response_cache.aget_or_set(
+        ALL_ACCOMMODATIONS, 'slug', (slug,),
+        lambda: Accommodation.objects.filter(slug=slug).values_list('id', flat=True).afirst()
+    )
+    if accommodation_id is None:
+        return await _cached(None, 'availability', (), compute)
+    return await _cached(accommodation_id, 'availability', (request.build_absolute_uri(),), compute)
+
+
+@require_safe
+async def booking_statistics(request):
+    """Get booking statistics"""
+    return _json(await statistics.aget_statistics())
+
+
+async def _all(queryset):
+    return [obj async for obj in queryset]
+
+
+async def _cached(scope, view, parts, compute):
+    """Serve compute()'s data from the response cache (scope None: uncached); error responses pass through"""
+    if scope is None:
+        result = await compute()
+    else:
+        result = await response_cache.aget_or_set(scope, view, parts, compute)
+    return result if isinstance(result, HttpResponseBase) else _json(result)
@@ -0,0 +1,161 @@
+"""
+Booking audit trail writer.
+
+`record` / `record_many` take the audit entries of a booking event. In the
+default `deferred` mode they are queued once the surrounding transaction
+commits (rolled back events are never audited) and a background thread writes
+them with bulk_create, in batches of BOOKING_AUDIT_BATCH_SIZE entries or every
+BOOKING_AUDIT_FLUSH_INTERVAL seconds, whichever comes first. The queue is
+drained when the process exits; if it is full the entries are written by the
+caller instead. In `sync` mode the entries are written immediately, inside the
+caller's transaction, as before. The background thread gives its database
+connection back after every batch, as a request does.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from . import metrics
+from .models import BookingAudit
+
+logger = logging.getLogger(__name__)
+
+MODE_DEFERRED = 'deferred'
+MODE_SYNC = 'sync'
+
+
+class _Flush:
+    """Queue marker: write what is pending, then signal the waiting caller"""
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class AuditWriter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+
+    @property
+    def mode(self):
+        return getattr(settings, 'BOOKING_AUDIT_MODE', MODE_DEFERRED)
+
+    @property
+    def batch_size(self):
+        return getattr(settings, 'BOOKING_AUDIT_BATCH_SIZE', 100)
+
+    @property
+    def flush_interval(self):
+        return getattr(settings, 'BOOKING_AUDIT_FLUSH_INTERVAL', 1.0)
+
+    def record(self, booking_id, action, actor_user_id=None, data=None):
+        """Audit one booking event"""
+        self.record_many([BookingAudit(
+            booking_id=booking_id,
+            action=action,
+            actor_user_id=actor_user_id,
+            data_json=data,
+            created_at=timezone.now(),
+        )])
+
+    def record_many(self, entries):
+        """Audit several events (unsaved BookingAudit instances) at once"""
+        entries = list(entries)
+        if not entries:
+            return
+        if self.mode == MODE_SYNC:
+            self._write(entries)
+        else:
+            transaction.on_commit(lambda: self._enqueue(entries))
+
+    def flush(self, timeout=None):
+        """Block until every entry queued so far is written; returns False on timeout"""
+        with self._lock:
+            running = self._thread is not None and self._thread.is_alive() and self._pid == os.getpid()
+        if not running:
+            return True
+        marker = _Flush()
+        self._queue.put(marker)
+        return marker.done.wait(timeout)
+
+    def _enqueue(self, entries):
+        self._start()
+        for entry in entries:
+            try:
+                self._queue.put_nowait(entry)
+            except queue.Full:
+                # Back-pressure: the writer is behind, write in the caller rather than drop
+                metrics.incr('audit.queue_full')
+                self._write([entry])
+            else:
+                metrics.incr('audit.queued')
+
+    def _start(self):
+        with self._lock:
+            # A forked worker inherits the parent's objects but not its thread
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            if self._pid is None:
+                atexit.register(self.flush, 10)
+            self._pid = os.getpid()
+            self._queue = queue.Queue(maxsize=getattr(settings, 'BOOKING_AUDIT_QUEUE_SIZE', 10000))
+            self._thread = threading.Thread(target=self._run, name='booking-audit-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        pending = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, _Flush):
+                self._write(pending)
+                pending, deadline = [], None
+                item.done.set()
+                continue
+            if item is not None:
+                pending.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            if pending and (len(pending) >= self.batch_size or time.monotonic() >= deadline):
+                self._write(pending)
+                pending, deadline = [], None
+
+    def _write(self, entries):
+        if not entries:
+            return
+        in_background = threading.current_thread() is self._thread
+        if in_background:
+            close_old_connections()
+        try:
+            with metrics.timer('audit.write'):
+                BookingAudit.objects.bulk_create(entries, batch_size=self.batch_size)
+            metrics.incr('audit.written', len(entries))
+        except Exception:
+            if not in_background:
+                raise
+            metrics.incr('audit.write_errors', len(entries))
+            logger.exception('Could not write %d booking audit entries', len(entries))
+        finally:
+            if in_background:
+                # Like a request boundary: a pooled connection goes back to the pool
+                # instead of holding a slot while the thread waits for the next batch
+                close_old_connections()
+
+
+audit_writer = AuditWriter()
+record = audit_writer.record
+record_many = audit_writer.record_many
@@ -0,0 +1,184 @@
+"""
+JWT authentication without the per-request user query.
+
+Tokens issued at login and refresh carry the user's `role` and `is_staff`.
+With JWT_STATELESS_AUTH on, requests get a `ClaimsUser` built from those
+claims instead of the `User` row (and its lazily loaded role). What the claims
+cannot tell is checked against a small per-user state cached for
+JWT_USER_STATE_TTL seconds (one query per user and TTL, not per request):
+
+- deactivated or deleted users are rejected;
+- tokens issued before `revoke_tokens()` (called when the password changes)
+  are rejected; the revocation time is stored on the user row
+  (`tokens_valid_after`), so the cache can only delay it by the TTL, never
+  lose it;
+- tokens whose role / is_staff no longer match are rejected, so that
+  permission changes apply within the TTL; the refresh endpoint issues an
+  access token with the current claims.
+
+Saving a user drops its cached state once the transaction commits. With
+several workers use a shared CACHE_BACKEND, otherwise a worker sees another
+worker's changes only after the TTL. Tokens without the claims (issued before
+this mode) and the stateful mode load the user from the DB as usual.
+"""
+import time
+from datetime import datetime, timezone as dt_timezone
+from functools import cached_property
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import metrics
+from .db_router import primary
+from .models import User
+
+ROLE_CLAIM = 'role'
+STAFF_CLAIM = 'is_staff'
+# Issue time with sub-second precision: `iat` has whole seconds only, which cannot
+# order a token against a revocation made in the same second
+ISSUED_CLAIM = 'issued_at'
+
+
+def _cache():
+    return caches[getattr(settings, 'JWT_STATE_CACHE', 'default')]
+
+
+def _state_key(user_id):
+    return f'jwt:user:{user_id}'
+
+
+def add_user_claims(token, user):
+    token[ROLE_CLAIM] = user.role.name
+    token[STAFF_CLAIM] = user.is_staff
+    token[ISSUED_CLAIM] = time.time()
+    return token
+
+
+def user_state(user_id):
+    """
+    (is_active, is_staff, role name, tokens_valid_after) of a user, None if it
+    does not exist; cached for JWT_USER_STATE_TTL
+    """
+    cache = _cache()
+    key = _state_key(user_id)
+    state = cache.get(key)
+    if state is None:
+        metrics.incr('auth.state.miss')
+        with primary():
+            row = User.objects.filter(id=user_id).values_list(
+                'is_active', 'is_staff', 'role__name', 'tokens_valid_after'
+            ).first()
+        # Deleted users are cached too, as an empty tuple
+        state = tuple(row) if row else ()
+        cache.set(key, state, getattr(settings, 'JWT_USER_STATE_TTL', 60))
+    else:
+        metrics.incr('auth.state.hit')
+    return state or None
+
+
+def forget_user_state(user_id):
+    """Drop the cached state of a user once the transaction commits"""
+    transaction.on_commit(lambda: _cache().delete(_state_key(user_id)))
+
+
+def revoke_tokens(user_id):
+    """Reject every token of the user issued until now; returns the stored revocation time"""
+    valid_after = datetime.fromtimestamp(time.time(), tz=dt_timezone.utc)
+    User.objects.filter(id=user_id).update(tokens_valid_after=valid_after)
+    forget_user_state(user_id)
+    return valid_after
+
+
+def check_not_revoked(token, valid_after):
+    """Reject a token issued before `valid_after` (the user's tokens_valid_after)"""
+    if valid_after is None:
+        return
+    revoked_at = valid_after.timestamp()
+    issued_at = token.get(ISSUED_CLAIM)
+    # Tokens without the claim only have whole seconds: one issued in the second of the revocation is rejected
+    revoked = issued_at < revoked_at if issued_at is not None else token.get('iat', 0) <= int(revoked_at)
+    if revoked:
+        raise AuthenticationFailed(_('Token has been revoked'), code='token_revoked')
+
+
+class ClaimsRole:
+    """Stands in for Role where only the name is read (permissions, filters)"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+
+class ClaimsUser(TokenUser):
+    """Authenticated user backed by the token claims; use `id` rather than the instance in queries"""
+
+    @cached_property
+    def role(self):
+        return ClaimsRole(self.token[ROLE_CLAIM])
+
+    @cached_property
+    def is_staff(self):
+        return bool(self.token[STAFF_CLAIM])
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that returns a ClaimsUser when JWT_STATELESS_AUTH is on"""
+
+    def get_user(self, validated_token):
+        stateless = getattr(settings, 'JWT_STATELESS_AUTH', False)
+        if not stateless or ROLE_CLAIM not in validated_token or STAFF_CLAIM not in validated_token:
+            return super().get_user(validated_token)
+
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        state = user_state(user_id)
+        if state is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        is_active, is_staff, role_name, valid_after = state
+        if not is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        check_not_revoked(validated_token, valid_after)
+        if (is_staff, role_name) != (bool(validated_token[STAFF_CLAIM]), validated_token[ROLE_CLAIM]):
+            raise AuthenticationFailed(_('User permissions changed, refresh the token'), code='token_outdated')
+        return ClaimsUser(validated_token)
+
+
+class BookingTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        return add_user_claims(super().get_token(user), user)
+
+
+class BookingTokenRefreshSerializer(TokenRefreshSerializer):
+    """Issues the access token with the user's current claims"""
+
+    def validate(self, attrs):
+        refresh = RefreshToken(attrs['refresh'])
+        user_id = refresh.payload.get(api_settings.USER_ID_CLAIM)
+        user = User.objects.select_related('role').filter(id=user_id).first()
+        if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+        check_not_revoked(refresh, user.tokens_valid_after)
+
+        data = {'access': str(add_user_claims(refresh.access_token, user))}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            add_user_claims(refresh, user)
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            data['refresh'] = str(refresh)
+        return data
+
@@ -0,0 +1,194 @@
+"""
+Conflict checks shared by the booking serializers and the availability views.
+
+Writers serialize per accommodation with `lock_accommodations`, which takes a
+row lock on the `accommodations` rows; bookings for different accommodations
+never wait for each other.
+
+`find_conflicts` / `find_conflicts_many` answer "which active bookings,
+blocked periods and blocked weekday rules overlap these ranges?" with a single
+UNION ALL query, however many ranges are asked for. `lookup_conflicts` is the
+read path used by the public availability endpoints: weekday rules come from
+their compiled in-memory copy (bookings/weekday_rules.py), ranges that the
+occupancy bitmaps show as free need no further check (bookings/occupancy.py)
+and the others are answered from the in-memory interval index when that is
+enabled and by `find_conflicts` otherwise.
+"""
+from asgiref.sync import sync_to_async
+from django.db.models import CharField, DateTimeField, IntegerField, Value
+
+from . import metrics
+from .models import Accommodation, Booking, BlockedPeriod, BlockedWeekday
+from .interval_index import availability_index, ACTIVE_BOOKING_STATUSES
+from .occupancy import occupancy_store
+from .weekday_rules import overlap_filter, weekday_rules
+
+
+class Conflicts:
+    """
+    Bookings and blocked periods overlapping one range, as (id, start, end)
+    tuples, and the ids of the blocked weekday rules falling in it.
+    """
+
+    __slots__ = ('bookings', 'blocked_periods', 'blocked_weekdays')
+
+    def __init__(self, bookings=None, blocked_periods=None, blocked_weekdays=None):
+        self.bookings = bookings if bookings is not None else []
+        self.blocked_periods = blocked_periods if blocked_periods is not None else []
+        self.blocked_weekdays = blocked_weekdays if blocked_weekdays is not None else []
+
+    @property
+    def available(self):
+        return not self.bookings and not self.blocked_periods and not self.blocked_weekdays
+
+    @property
+    def bookings_count(self):
+        return len(self.bookings)
+
+    @property
+    def blocked_periods_count(self):
+        return len(self.blocked_periods)
+
+    @property
+    def blocked_weekdays_count(self):
+        return len(self.blocked_weekdays)
+
+    @property
+    def booking_ids(self):
+        return [row[0] for row in self.bookings]
+
+    @property
+    def blocked_period_ids(self):
+        return [row[0] for row in self.blocked_periods]
+
+    def booking_queryset(self):
+        """Return the conflicting bookings as a queryset (no query if there are none)"""
+        if not self.bookings:
+            return Booking.objects.none()
+        return Booking.objects.filter(id__in=self.booking_ids)
+
+    def blocked_period_queryset(self):
+        """Return the conflicting blocked periods as a queryset (no query if there are none)"""
+        if not self.blocked_periods:
+            return BlockedPeriod.objects.none()
+        return BlockedPeriod.objects.filter(id__in=self.blocked_period_ids)
+
+    def blocked_weekday_queryset(self):
+        """Return the blocking weekday rules as a queryset (no query if there are none)"""
+        if not self.blocked_weekdays:
+            return BlockedWeekday.objects.none()
+        return BlockedWeekday.objects.filter(id__in=self.blocked_weekdays)
+
+
+def _tagged(queryset, kind, index, start_field, end_field):
+    return queryset.annotate(
+        kind=Value(kind, output_field=CharField()),
+        range_index=Value(index, output_field=IntegerField()),
+    ).values_list('kind', 'range_index', 'id', start_field, end_field)
+
+
+def find_conflicts_many(ranges):
+    """
+    Check many ranges in one DB round trip.
+
+    `ranges` is an iterable of (accommodation_id, check_in, check_out) or
+    (accommodation_id, check_in, check_out, exclude_booking_id) tuples. Returns
+    one Conflicts per range, in the same order.
+    """
+    ranges = list(ranges)
+    if not ranges:
+        return []
+
+    subqueries = []
+    for index, item in enumerate(ranges):
+        accommodation_id, check_in, check_out = item[:3]
+        exclude_booking_id = item[3] if len(item) > 3 else None
+
+        bookings = Booking.objects.filter(
+            accommodation_id=accommodation_id,
+            status__in=ACTIVE_BOOKING_STATUSES,
+            check_in__lt=check_out,
+            check_out__gt=check_in
+        )
+        if exclude_booking_id is not None:
+            bookings = bookings.exclude(id=exclude_booking_id)
+        blocked_periods = BlockedPeriod.objects.filter(
+            accommodation_id=accommodation_id,
+            start_date__lt=check_out,
+            end_date__gt=check_in
+        )
+        # Rules have no datetimes of their own: only their ids are returned
+        blocked_weekdays = BlockedWeekday.objects.filter(
+            overlap_filter(check_in, check_out), accommodation_id=accommodation_id
+        ).annotate(
+            no_start=Value(None, output_field=DateTimeField()),
+            no_end=Value(None, output_field=DateTimeField()),
+        )
+
+        subqueries.append(_tagged(bookings, 'booking', index, 'check_in', 'check_out'))
+        subqueries.append(_tagged(blocked_periods, 'blocked', index, 'start_date', 'end_date'))
+        subqueries.append(_tagged(blocked_weekdays, 'weekday', index, 'no_start', 'no_end'))
+
+    results = [Conflicts() for _ in ranges]
+    for kind, index, row_id, start, end in subqueries[0].union(*subqueries[1:], all=True):
+        if kind == 'weekday':
+            results[index].blocked_weekdays.append(row_id)
+        elif kind == 'booking':
+            results[index].bookings.append((row_id, start, end))
+        else:
+            results[index].blocked_periods.append((row_id, start, end))
+
+    for result in results:
+        result.bookings.sort(key=lambda row: row[1])
+        result.blocked_periods.sort(key=lambda row: row[1])
+        result.blocked_weekdays.sort()
+    return results
+
+
+def find_conflicts(accommodation_id, check_in, check_out, exclude_booking_id=None):
+    """Return the Conflicts for one range, read from the DB in one query"""
+    return find_conflicts_many([(accommodation_id, check_in, check_out, exclude_booking_id)])[0]
+
+
+def lookup_conflicts(accommodation_id, check_in, check_out):
+    """Read-path conflict check: occupancy bitmaps, then the in-memory index when enabled, DB otherwise"""
+    blocked_weekdays = weekday_rules.conflicts(accommodation_id, check_in, check_out)
+    if occupancy_store.is_free(accommodation_id, check_in, check_out):
+        return Conflicts(blocked_weekdays=blocked_weekdays)
+    if availability_index.enabled:
+        bookings, blocked_periods = availability_index.conflicts(accommodation_id, check_in, check_out)
+        return Conflicts(bookings, blocked_periods, blocked_weekdays)
+    return find_conflicts(accommodation_id, check_in, check_out)
+
+
+async def alookup_conflicts(accommodation_id, check_in, check_out):
+    """lookup_conflicts() for async views: warm rules with warm bitmaps or index answer in the event loop"""
+    rules = weekday_rules.loaded(accommodation_id)
+    if rules is not None:
+        blocked_weekdays = rules.conflicts(check_in, check_out)
+        if occupancy_store.is_free(accommodation_id, check_in, check_out, loaded_only=True):
+            return Conflicts(blocked_weekdays=blocked_weekdays)
+        if availability_index.enabled:
+            found = availability_index.loaded_conflicts(accommodation_id, check_in, check_out)
+            if found is not None:
+                return Conflicts(*found, blocked_weekdays)
+    return await sync_to_async(lookup_conflicts)(accommodation_id, check_in, check_out)
+
+
+def lock_accommodations(accommodation_ids):
+    """
+    Lock the given accommodation rows (SELECT ... FOR UPDATE) until the end of
+    the current transaction. Must be called inside transaction.atomic.
+
+    Rows are locked in id order so that writers touching several
+    accommodations cannot deadlock each other. Call it before any other read
+    in the transaction: with InnoDB's REPEATABLE READ the snapshot is taken by
+    the first plain read, so reads made after the lock see every booking
+    committed by the previous holder.
+    """
+    ids = sorted(set(accommodation_ids))
+    with metrics.timer('bookings.lock_wait'):
+        locked = list(
+            Accommodation.objects.select_for_update().filter(id__in=ids).order_by('id').values_list('id', flat=True)
+        )
+    return locked
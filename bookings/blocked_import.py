@@ -0,0 +1,312 @@
+"""
+Bulk import of blocked periods, used by BlockedPeriodViewSet.import_periods
+and the import_blocked_periods command.
+
+The periods come as CSV (columns accommodation, start_date, end_date,
+reason), JSON (a list of objects with the same keys) or iCalendar (one
+VEVENT per period, for the accommodation given with the request). Dates
+without a time mean local midnight.
+
+For each accommodation the imported periods (and, in merge mode, the
+existing ones) are sorted and the overlapping or adjacent ones merged in a
+single pass. The result is compared with the existing rows: rows that are
+already there stay, the others are deleted and the missing periods inserted
+with bulk_create. Everything happens in one transaction under the
+accommodation lock, including the rebuild of the occupancy counts (once per
+accommodation, not per deleted row). In replace mode the import is the complete list of
+blocked periods of its accommodations, so the other existing rows are
+deleted.
+"""
+import csv
+import io
+import json
+import re
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .availability import lock_accommodations
+from .models import Accommodation, BlockedPeriod
+from .serializers import BlockedPeriodImportItemSerializer
+from .signals import mark_accommodations_changed, set_based_write
+
+FORMAT_CSV = 'csv'
+FORMAT_JSON = 'json'
+FORMAT_ICAL = 'ical'
+FORMATS = (FORMAT_CSV, FORMAT_JSON, FORMAT_ICAL)
+FORMAT_EXTENSIONS = {'.csv': FORMAT_CSV, '.json': FORMAT_JSON, '.ics': FORMAT_ICAL, '.ical': FORMAT_ICAL}
+MODE_MERGE = 'merge'
+MODE_REPLACE = 'replace'
+MODES = (MODE_MERGE, MODE_REPLACE)
+MAX_ITEMS = 5000
+
+_DURATION = re.compile(r'^([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$')
+
+
+def guess_format(filename):
+    """The format matching a file name's extension, None if unknown"""
+    for extension, import_format in FORMAT_EXTENSIONS.items():
+        if filename.lower().endswith(extension):
+            return import_format
+    return None
+
+
+def _content_error(message):
+    return ValidationError({'content': [message]})
+
+
+def parse_csv(text):
+    reader = csv.DictReader(io.StringIO(text))
+    missing = {'start_date', 'end_date'} - set(reader.fieldnames or ())
+    if missing:
+        raise _content_error(f"Missing CSV columns: {', '.join(sorted(missing))}")
+    return [
+        {key: value.strip() for key, value in row.items() if key and value is not None and value.strip()}
+        for row in reader
+    ]
+
+
+def parse_json(content):
+    if isinstance(content, str):
+        try:
+            content = json.loads(content)
+        except ValueError:
+            raise _content_error('Invalid JSON')
+    if isinstance(content, dict):
+        content = content.get('blocked_periods')
+    if not isinstance(content, list):
+        raise _content_error('Expected a list of blocked periods')
+    return content
+
+
+def _unfold(text):
+    lines = []
+    for line in text.splitlines():
+        if line[:1] in (' ', '\t') and lines:
+            lines[-1] += line[1:]
+        elif line:
+            lines.append(line)
+    return lines
+
+
+def _unescape(text):
+    return re.sub(r'\\(.)', lambda match: '\n' if match.group(1) in 'nN' else match.group(1), text)
+
+
+def _ical_datetime(value, params):
+    """DATE (local midnight), UTC, TZID or floating (local) DATE-TIME; the raw value if it cannot be read"""
+    try:
+        if params.get('VALUE') == 'DATE' or len(value) == 8:
+            return timezone.make_aware(datetime.combine(datetime.strptime(value, '%Y%m%d').date(), time.min))
+        if value.endswith('Z'):
+            return datetime.strptime(value[:-1], '%Y%m%dT%H%M%S').replace(tzinfo=dt_timezone.utc)
+        naive = datetime.strptime(value, '%Y%m%dT%H%M%S')
+    except ValueError:
+        return value
+    try:
+        tz = ZoneInfo(params['TZID']) if 'TZID' in params else None
+    except (ZoneInfoNotFoundError, ValueError):
+        tz = None
+    return timezone.make_aware(naive, tz)
+
+
+def _ical_duration(value):
+    match = _DURATION.match(value)
+    if match is None:
+        return None
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    duration = timedelta(weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0),
+                         minutes=int(minutes or 0), seconds=int(seconds or 0))
+    return -duration if sign == '-' else duration
+
+
+def _ical_period(properties):
+    start = properties.get('DTSTART')
+    if start is None:
+        return {}
+    item = {'start_date': _ical_datetime(*start)}
+    if 'SUMMARY' in properties:
+        item['reason'] = _unescape(properties['SUMMARY'][0])[:255]
+    if 'DTEND' in properties:
+        item['end_date'] = _ical_datetime(*properties['DTEND'])
+    elif isinstance(item['start_date'], datetime):
+        if 'DURATION' in properties:
+            duration = _ical_duration(properties['DURATION'][0])
+            item['end_date'] = item['start_date'] + duration if duration is not None else properties['DURATION'][0]
+        elif start[1].get('VALUE') == 'DATE' or len(start[0]) == 8:
+            # An all-day event without end lasts one day (RFC 5545, 3.6.1)
+            item['end_date'] = item['start_date'] + timedelta(days=1)
+    return item
+
+
+def parse_ical(text):
+    lines = _unfold(text)
+    if not lines or lines[0].strip().upper() != 'BEGIN:VCALENDAR':
+        raise _content_error('Not an iCalendar file')
+    items = []
+    properties = None
+    for line in lines:
+        name_params, _, value = line.partition(':')
+        name, *params = name_params.split(';')
+        name = name.upper()
+        if name == 'BEGIN' and value.strip().upper() == 'VEVENT':
+            properties = {}
+        elif name == 'END' and value.strip().upper() == 'VEVENT' and properties is not None:
+            if properties.get('STATUS', ('',))[0].upper() != 'CANCELLED':
+                items.append(_ical_period(properties))
+            properties = None
+        elif properties is not None:
+            properties[name] = (value.strip(), {
+                key.upper(): param_value.strip('"')
+                for key, _, param_value in (param.partition('=') for param in params)
+            })
+    return items
+
+
+def parse(content, import_format):
+    """The raw items of `content` in the given format"""
+    if not isinstance(content, str) and not (import_format == FORMAT_JSON and isinstance(content, list)):
+        raise _content_error('Expected text' if import_format != FORMAT_JSON else 'Expected text or a list')
+    if import_format == FORMAT_CSV:
+        return parse_csv(content)
+    if import_format == FORMAT_ICAL:
+        return parse_ical(content)
+    return parse_json(content)
+
+
+def merge_intervals(intervals):
+    """
+    Merge overlapping or adjacent (start, end, reason) intervals: one sort and
+    one pass. A merged interval keeps the first reason found in start order.
+    """
+    merged = []
+    for start, end, reason in sorted(intervals, key=lambda interval: (interval[0], interval[1])):
+        if merged and start <= merged[-1][1]:
+            last = merged[-1]
+            last[1] = max(last[1], end)
+            last[2] = last[2] or reason
+        else:
+            merged.append([start, end, reason])
+    return [tuple(interval) for interval in merged]
+
+
+def plan_changes(imported, existing, mode=MODE_MERGE):
+    """
+    The minimal changes turning `existing` (id, start, end, reason) rows into
+    the merged periods: returns (periods to insert, row ids to delete, merged count).
+    """
+    intervals = list(imported)
+    if mode == MODE_MERGE:
+        intervals += [(start, end, reason) for _, start, end, reason in existing]
+    target = merge_intervals(intervals)
+
+    rows_by_range = {}
+    for row_id, start, end, _ in existing:
+        rows_by_range.setdefault((start, end), []).append(row_id)
+    kept = set()
+    inserts = []
+    for start, end, reason in target:
+        rows = rows_by_range.get((start, end))
+        if rows:
+            # Further rows with the same range are duplicates and go away
+            kept.add(rows.pop(0))
+        else:
+            inserts.append((start, end, reason))
+    deletes = [row_id for row_id, _, _, _ in existing if row_id not in kept]
+    return inserts, deletes, len(target)
+
+
+def _validate_items(items, accommodation_id, errors):
+    """Field validation and the accommodation lookup (one query)"""
+    validated = {}
+    for index, item in enumerate(items):
+        serializer = BlockedPeriodImportItemSerializer(data=item)
+        if not serializer.is_valid():
+            errors[index] = serializer.errors
+            continue
+        data = serializer.validated_data
+        if data.get('accommodation', accommodation_id) is None:
+            errors[index] = {'accommodation': ['This field is required.']}
+            continue
+        validated[index] = data
+
+    accommodation_ids = {data.get('accommodation', accommodation_id) for data in validated.values()}
+    found = set(Accommodation.objects.filter(id__in=accommodation_ids).values_list('id', flat=True))
+    for index, data in list(validated.items()):
+        if data.get('accommodation', accommodation_id) not in found:
+            errors[index] = {'accommodation': ['Accommodation not found']}
+            del validated[index]
+    return validated
+
+
+def import_blocked_periods(items, accommodation_id=None, mode=MODE_MERGE, actor_id=None, dry_run=False):
+    """
+    Import the raw items (see `parse`). Nothing is written if any item is
+    invalid or with dry_run. Returns a summary with one entry per
+    accommodation and the item errors.
+    """
+    errors = {}
+    validated = _validate_items(items, accommodation_id, errors)
+    summary = {
+        'mode': mode,
+        'dry_run': dry_run,
+        'received': len(items),
+        'created': 0,
+        'deleted': 0,
+        'accommodations': [],
+        'errors': [{'index': index, 'errors': errors[index]} for index in sorted(errors)],
+    }
+    if errors or not validated:
+        return summary
+
+    imported = {}
+    for data in validated.values():
+        imported.setdefault(data.get('accommodation', accommodation_id), []).append(
+            (data['start_date'], data['end_date'], data.get('reason') or None)
+        )
+
+    with transaction.atomic():
+        # The lock is the first statement of the transaction (see lock_accommodations)
+        lock_accommodations(imported)
+        existing = {accommodation: [] for accommodation in imported}
+        for accommodation, *row in BlockedPeriod.objects.filter(accommodation_id__in=imported).values_list(
+            'accommodation_id', 'id', 'start_date', 'end_date', 'reason'
+        ):
+            existing[accommodation].append(row)
+
+        inserts = []
+        deletes = []
+        for accommodation in sorted(imported):
+            periods = imported[accommodation]
+            to_insert, to_delete, merged = plan_changes(periods, existing[accommodation], mode)
+            inserts += [
+                BlockedPeriod(accommodation_id=accommodation, start_date=start, end_date=end, reason=reason,
+                              created_by_id=actor_id)
+                for start, end, reason in to_insert
+            ]
+            deletes += to_delete
+            summary['accommodations'].append({
+                'accommodation': accommodation,
+                'received': len(periods),
+                'merged': merged,
+                'created': len(to_insert),
+                'deleted': len(to_delete),
+                'unchanged': merged - len(to_insert),
+            })
+
+        summary['created'] = len(inserts)
+        summary['deleted'] = len(deletes)
+        if dry_run or not (inserts or deletes):
+            return summary
+        if deletes:
+            with set_based_write():
+                BlockedPeriod.objects.filter(id__in=deletes).delete()
+        if inserts:
+            BlockedPeriod.objects.bulk_create(inserts)
+        mark_accommodations_changed(
+            entry['accommodation'] for entry in summary['accommodations'] if entry['created'] or entry['deleted']
+        )
+    return summary
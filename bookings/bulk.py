@@ -0,0 +1,193 @@
+"""
+Bulk booking creation used by BookingViewSet.bulk.
+
+Every item is validated against the DB and against the other items of the
+request with a fixed number of queries (accommodations, users, lock, one
+UNION conflict query), then bookings, guests and audit rows are written with
+bulk_create and the occupancy counts rebuilt once per accommodation. Backends
+that cannot return the new ids (MySQL) read them back with one more query.
+"""
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import audit
+from .availability import find_conflicts_many, lock_accommodations
+from .models import Accommodation, Booking, BookingAudit, BookingGuest, User
+from .serializers import BulkBookingItemSerializer
+from .signals import mark_accommodations_changed
+
+MODE_ATOMIC = 'atomic'
+MODE_BEST_EFFORT = 'best_effort'
+MODES = (MODE_ATOMIC, MODE_BEST_EFFORT)
+MAX_ITEMS = 500
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _error(message):
+    return {'non_field_errors': [message]}
+
+
+def _validate_items(items, errors):
+    """Field validation, no queries"""
+    validated = {}
+    for index, item in enumerate(items):
+        serializer = BulkBookingItemSerializer(data=item)
+        if serializer.is_valid():
+            validated[index] = serializer.validated_data
+        else:
+            errors[index] = serializer.errors
+    return validated
+
+
+def _resolve_relations(validated, errors):
+    """Load the referenced accommodations and users with one query each"""
+    accommodation_ids = {data['accommodation'] for data in validated.values()}
+    user_ids = {data['user'] for data in validated.values() if data.get('user') is not None}
+    accommodations = Accommodation.objects.in_bulk(accommodation_ids)
+    users = User.objects.in_bulk(user_ids) if user_ids else {}
+
+    for index, data in list(validated.items()):
+        if data['accommodation'] not in accommodations:
+            errors[index] = {'accommodation': ['Accommodation not found']}
+            del validated[index]
+        elif data.get('user') is not None and data['user'] not in users:
+            errors[index] = {'user': ['User not found']}
+            del validated[index]
+
+
+def _reject_overlaps_within_request(validated, errors):
+    """Items of the same request must not overlap each other; the first one wins"""
+    by_accommodation = {}
+    for index, data in validated.items():
+        by_accommodation.setdefault(data['accommodation'], []).append(index)
+
+    for indexes in by_accommodation.values():
+        indexes.sort(key=lambda i: (validated[i]['check_in'], i))
+        accepted_end = None
+        for index in indexes:
+            if accepted_end is not None and validated[index]['check_in'] < accepted_end:
+                errors[index] = _error("This period overlaps with another booking in the request")
+                continue
+            check_out = validated[index]['check_out']
+            accepted_end = check_out if accepted_end is None else max(accepted_end, check_out)
+
+    for index in list(validated):
+        if index in errors:
+            del validated[index]
+
+
+def _reject_conflicts(validated, errors):
+    """One UNION query for every remaining item"""
+    indexes = list(validated)
+    conflicts = find_conflicts_many(
+        (validated[i]['accommodation'], validated[i]['check_in'], validated[i]['check_out']) for i in indexes
+    )
+    for index, result in zip(indexes, conflicts):
+        if result.bookings:
+            errors[index] = _error("This period overlaps with an existing booking")
+        elif result.blocked_periods:
+            errors[index] = _error("This period is blocked for bookings")
+        elif result.blocked_weekdays:
+            errors[index] = _error("This period falls on a blocked weekday")
+        if index in errors:
+            del validated[index]
+
+
+def _create_bookings(bookings):
+    """bulk_create the bookings, filling in their primary keys; their accommodations must be locked"""
+    if connection.features.can_return_rows_from_bulk_insert:
+        Booking.objects.bulk_create(bookings)
+        return
+    # No ids from a multi-row INSERT on MySQL. Nobody else writes bookings of the
+    # locked accommodations, so their rows above the previous highest id are these,
+    # numbered in insert order (with gaps under interleaved auto-increment locking)
+    rows = Booking.objects.filter(accommodation_id__in={booking.accommodation_id for booking in bookings})
+    previous = rows.aggregate(last=Max('id'))['last'] or 0
+    Booking.objects.bulk_create(bookings)
+    ids = list(rows.filter(id__gt=previous).order_by('id').values_list('id', flat=True))
+    if len(ids) != len(bookings):
+        raise DatabaseError(f'Expected {len(bookings)} new bookings, found {len(ids)}')
+    for booking, row_id in zip(bookings, ids):
+        booking.pk = row_id
+
+
+def _insert(validated, actor_id):
+    indexes = sorted(validated)
+    bookings = []
+    for index in indexes:
+        data = validated[index]
+        bookings.append(Booking(
+            accommodation_id=data['accommodation'],
+            user_id=data.get('user'),
+            check_in=data['check_in'],
+            check_out=data['check_out'],
+            num_guests=data.get('num_guests', 1),
+            notes=data.get('notes'),
+        ))
+
+    _create_bookings(bookings)
+    mark_accommodations_changed(booking.accommodation_id for booking in bookings)
+
+    guests = [
+        BookingGuest(booking_id=booking.pk, **guest_data)
+        for index, booking in zip(indexes, bookings)
+        for guest_data in validated[index].get('guests_data', [])
+    ]
+    if guests:
+        BookingGuest.objects.bulk_create(guests)
+
+    now = timezone.now()
+    audit.record_many(
+        BookingAudit(
+            booking_id=booking.pk,
+            action='created',
+            actor_user_id=actor_id,
+            data_json={'status': booking.status, 'accommodation_id': booking.accommodation_id, 'bulk': True},
+            created_at=now,
+        )
+        for booking in bookings
+    )
+
+    return dict(zip(indexes, bookings))
+
+
+def create_bookings(items, actor_id=None, mode=MODE_ATOMIC):
+    """
+    Create many bookings at once.
+
+    Returns (created_count, results) where results has one entry per item, in
+    request order. In atomic mode nothing is written if any item fails.
+    """
+    errors = {}
+    created = {}
+    validated = _validate_items(items, errors)
+    if validated:
+        _resolve_relations(validated, errors)
+        _reject_overlaps_within_request(validated, errors)
+
+    if validated and not (errors and mode == MODE_ATOMIC):
+        try:
+            with transaction.atomic():
+                # The lock is the first statement of the transaction (see lock_accommodations)
+                lock_accommodations(data['accommodation'] for data in validated.values())
+                _reject_conflicts(validated, errors)
+                if errors and mode == MODE_ATOMIC:
+                    raise _Rollback()
+                if validated:
+                    created = _insert(validated, actor_id)
+        except _Rollback:
+            pass
+
+    results = []
+    for index in range(len(items)):
+        if index in created:
+            results.append({'index': index, 'status': 'created', 'id': created[index].pk})
+        elif index in errors:
+            results.append({'index': index, 'status': 'error', 'errors': errors[index]})
+        else:
+            results.append({'index': index, 'status': 'skipped'})
+    return len(created), results
@@ -0,0 +1,181 @@
+"""
+Conditional GET (ETag / Last-Modified) for the booking, accommodation and profile views.
+
+A representation's version is made of the `updated_at` of the rows it shows
+(including the related rows it embeds, e.g. a booking's guests, accommodation
+and user) plus the row counts, so that deletions change it too. Details
+compare against one aggregate query when the client sends a validator, and
+otherwise take the version from the object they load anyway.
+
+Lists are tagged with a hash of the rendered page instead: an aggregate over
+the whole filtered queryset would scan every row the cursor pagination
+avoids reading. A 304 for a list therefore costs the page queries, but no
+serialized body is sent.
+"""
+import hashlib
+from functools import partial
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+
+class VersionSpec:
+    """The updated_at columns and the counted relations that make up a representation's version"""
+
+    def __init__(self, timestamps, counts):
+        self.timestamps = timestamps
+        self.counts = counts
+
+
+BOOKING_VERSION = VersionSpec(
+    timestamps=['updated_at', 'guests__updated_at', 'accommodation__updated_at', 'user__updated_at'],
+    counts=['id', 'guests'],
+)
+ACCOMMODATION_VERSION = VersionSpec(timestamps=['updated_at'], counts=['id'])
+USER_VERSION = VersionSpec(timestamps=['updated_at'], counts=['id'])
+
+
+class Version:
+    __slots__ = ('timestamps', 'counts')
+
+    def __init__(self, timestamps, counts):
+        self.timestamps = timestamps
+        self.counts = counts
+
+    @property
+    def last_modified(self):
+        values = [value for value in self.timestamps if value is not None]
+        return max(values) if values else None
+
+    def etag(self, request):
+        # The media type is part of the tag: JSON and the browsable API share the URL
+        renderer = getattr(request, 'accepted_renderer', None)
+        key = repr((
+            [value.isoformat() if value is not None else None for value in self.timestamps],
+            self.counts,
+            renderer.format if renderer else None,
+        ))
+        return 'W/"%s"' % hashlib.md5(key.encode()).hexdigest()
+
+
+def queryset_version(queryset, spec):
+    """Read the version of a queryset with one aggregate query"""
+    aggregates = {f'max_{i}': Max(path) for i, path in enumerate(spec.timestamps)}
+    aggregates.update({f'count_{i}': Count(path, distinct=True) for i, path in enumerate(spec.counts)})
+    values = queryset.order_by().aggregate(**aggregates)
+    return Version(
+        [values[f'max_{i}'] for i in range(len(spec.timestamps))],
+        [values[f'count_{i}'] for i in range(len(spec.counts))],
+    )
+
+
+def _related_values(instance, path):
+    """Follow a `relation__field` path on a loaded instance (to-many relations use prefetched rows)"""
+    objects = [instance]
+    *relations, field = path.split('__')
+    for relation in relations:
+        related = []
+        for obj in objects:
+            value = getattr(obj, relation)
+            if value is None:
+                continue
+            if hasattr(value, 'all'):
+                related.extend(value.all())
+            else:
+                related.append(value)
+        objects = related
+    return [getattr(obj, field) for obj in objects]
+
+
+def instance_version(instance, spec):
+    """The version of a loaded object, equal to queryset_version() of a queryset holding only it"""
+    timestamps = []
+    for path in spec.timestamps:
+        values = [value for value in _related_values(instance, path) if value is not None]
+        timestamps.append(max(values) if values else None)
+    counts = [1 if path == 'id' else len(getattr(instance, path).all()) for path in spec.counts]
+    return Version(timestamps, counts)
+
+
+def has_validators(request):
+    return 'HTTP_IF_NONE_MATCH' in request.META or 'HTTP_IF_MODIFIED_SINCE' in request.META
+
+
+def not_modified(request, version):
+    """Return a 304/412 response if the client's validators still match, None otherwise"""
+    last_modified = version.last_modified
+    response = get_conditional_response(
+        request,
+        etag=version.etag(request),
+        last_modified=int(last_modified.timestamp()) if last_modified else None,
+    )
+    if response is not None:
+        set_validators(response, request, version)
+    return response
+
+
+def page_not_modified(request, response):
+    """Tag a rendered 200 response with the hash of its body; a 304 when If-None-Match matches it"""
+    if response.status_code != 200 or not hasattr(response, 'render'):
+        return response
+    response.render()
+    etag = '"%s"' % hashlib.md5(response.content).hexdigest()
+    conditional = get_conditional_response(request, etag=etag)
+    if conditional is not None:
+        conditional['ETag'] = etag
+        return conditional
+    response['ETag'] = etag
+    return response
+
+
+def set_validators(response, request, version):
+    if 200 <= response.status_code < 300 or response.status_code == 304:
+        response['ETag'] = version.etag(request)
+        if version.last_modified:
+            response['Last-Modified'] = http_date(version.last_modified.timestamp())
+    return response
+
+
+class ConditionalGetMixin:
+    """
+    ViewSet mixin: retrieve sends ETag / Last-Modified and answers
+    If-None-Match / If-Modified-Since with a 304 before serializing anything;
+    list sends the ETag of its rendered page and answers If-None-Match.
+    """
+    version_spec = None
+    # Details without validators take the version from the object they load
+    # (saving the aggregate query); set to False when retrieve may not load it
+    version_from_object = True
+
+    def get_version_spec(self):
+        return self.version_spec
+
+    def object_version(self):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset()).filter(
+            **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+        )
+        return queryset_version(queryset, self.get_version_spec())
+
+    def conditional_response(self, request, version, compute):
+        response = not_modified(request, version)
+        if response is None:
+            response = set_validators(compute(), request, version)
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if self.action == 'list':
+            response = page_not_modified(request, response)
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        if has_validators(request) or not self.version_from_object:
+            return self.conditional_response(
+                request, self.object_version(), partial(super().retrieve, request, *args, **kwargs)
+            )
+        instance = self.get_object()
+        response = Response(self.get_serializer(instance).data)
+        return set_validators(response, request, instance_version(instance, self.get_version_spec()))
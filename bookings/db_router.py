@@ -0,0 +1,98 @@
+"""
+Read-replica routing.
+
+Reads go to one of the DATABASE_REPLICAS only while `replica_reads_allowed`
+is set, which ReplicaRoutingMiddleware does for GET/HEAD/OPTIONS requests of
+clients that have not written recently. Everything else reads from the
+primary: writes and the requests that make them, transaction.atomic blocks,
+related rows of objects loaded from the primary, management commands and
+background threads (the flag defaults to off), and anything computed to be
+stored in a cache (see `primary()`), so that replica lag never outlives the
+request that saw it.
+"""
+import hashlib
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+
+replica_reads_allowed = ContextVar('replica_reads_allowed', default=False)
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', ())
+
+
+@contextmanager
+def primary():
+    """Read from the primary inside the block"""
+    token = replica_reads_allowed.set(False)
+    try:
+        yield
+    finally:
+        replica_reads_allowed.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        aliases = replicas()
+        if not aliases or not replica_reads_allowed.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        # Follow relations on the database the instance came from
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        return random.choice(aliases)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in replicas():
+            return False
+        return None
+
+
+# Read-your-writes: clients are pinned to the primary for a while after a write
+
+def _pin_cache():
+    return caches[getattr(settings, 'DATABASE_REPLICA_PIN_CACHE', 'default')]
+
+
+def client_key(request):
+    """The token, session or address identifying the client of a request"""
+    credential = (
+        request.META.get('HTTP_AUTHORIZATION')
+        or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        or request.META.get('REMOTE_ADDR', '')
+    )
+    return 'db_pin:' + hashlib.sha1(credential.encode()).hexdigest()
+
+
+def _pin_seconds():
+    return getattr(settings, 'DATABASE_REPLICA_PIN_SECONDS', 10)
+
+
+def pin_to_primary(request):
+    _pin_cache().set(client_key(request), True, _pin_seconds())
+
+
+def is_pinned(request):
+    return _pin_cache().get(client_key(request)) is not None
+
+
+async def apin_to_primary(request):
+    await _pin_cache().aset(client_key(request), True, _pin_seconds())
+
+
+async def ais_pinned(request):
+    return await _pin_cache().aget(client_key(request)) is not None
@@ -0,0 +1,124 @@
+"""
+Streaming exports of bookings with their guests (CSV and NDJSON).
+
+Rows are read in keyset chunks of bookings (id > last id) with `values()`,
+one chunk at a time, so memory stays constant whatever the size of the
+export, also on MySQL where the driver buffers whole result sets. CSV has one
+line per guest (bookings without guests get one line with empty guest
+columns); NDJSON has one JSON object per booking with its guests nested.
+"""
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.renderers import BaseRenderer
+
+from .models import Booking
+
+FORMAT_CSV = 'csv'
+FORMAT_NDJSON = 'ndjson'
+FORMATS = (FORMAT_CSV, FORMAT_NDJSON)
+EXPORT_CONTENT_TYPES = {
+    FORMAT_CSV: 'text/csv; charset=utf-8',
+    FORMAT_NDJSON: 'application/x-ndjson; charset=utf-8',
+}
+DEFAULT_CHUNK_SIZE = 500
+
+# Output key -> values() lookup
+BOOKING_FIELDS = {
+    'id': 'id',
+    'accommodation_id': 'accommodation_id',
+    'accommodation_title': 'accommodation__title',
+    'user_id': 'user_id',
+    'user_email': 'user__email',
+    **{field: field for field in (
+        'check_in', 'check_out', 'num_guests', 'status', 'notes', 'created_at', 'updated_at'
+    )},
+}
+GUEST_FIELDS = [
+    'id', 'full_name', 'email', 'phone', 'birth_date',
+    'document_type', 'document_number', 'notes',
+]
+CSV_HEADER = [
+    *('booking_id' if key == 'id' else key for key in BOOKING_FIELDS),
+    *(f'guest_{field}' for field in GUEST_FIELDS),
+]
+
+
+def iter_bookings(queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield (booking, guests) dicts for the bookings of `queryset`, in id order"""
+    queryset = queryset.order_by()
+    fields = [*BOOKING_FIELDS.values(), *(f'guests__{field}' for field in GUEST_FIELDS)]
+    last_id = 0
+    while True:
+        ids = list(queryset.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return
+        rows = Booking.objects.filter(id__in=ids).order_by('id', 'guests__id').values(*fields)
+        booking, guests = None, []
+        for row in rows.iterator(chunk_size=chunk_size):
+            if booking is None or booking['id'] != row['id']:
+                if booking is not None:
+                    yield booking, guests
+                booking = {key: row[lookup] for key, lookup in BOOKING_FIELDS.items()}
+                guests = []
+            if row['guests__id'] is not None:
+                guests.append({field: row[f'guests__{field}'] for field in GUEST_FIELDS})
+        if booking is not None:
+            yield booking, guests
+        last_id = ids[-1]
+
+
+class _Echo:
+    """File-like object whose write() returns the line, for csv.writer in a generator"""
+
+    def write(self, value):
+        return value
+
+
+_encoder = DjangoJSONEncoder()
+
+
+def _csv_value(value):
+    # Same date/time formatting as the NDJSON export
+    return _encoder.default(value) if hasattr(value, 'isoformat') else value
+
+
+def iter_csv(bookings):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_HEADER)
+    for booking, guests in bookings:
+        booking_values = [_csv_value(value) for value in booking.values()]
+        if not guests:
+            yield writer.writerow(booking_values + [''] * len(GUEST_FIELDS))
+        for guest in guests:
+            yield writer.writerow(booking_values + [_csv_value(guest[field]) for field in GUEST_FIELDS])
+
+
+def iter_ndjson(bookings):
+    for booking, guests in bookings:
+        yield json.dumps({**booking, 'guests': guests}, cls=DjangoJSONEncoder) + '\n'
+
+
+def iter_export(queryset, export_format, chunk_size=DEFAULT_CHUNK_SIZE):
+    """The export as an iterator of text chunks"""
+    bookings = iter_bookings(queryset, chunk_size)
+    return iter_csv(bookings) if export_format == FORMAT_CSV else iter_ndjson(bookings)
+
+
+class _ExportRenderer(BaseRenderer):
+    """Lets content negotiation (Accept / ?format=) pick the export format; errors are rendered as JSON"""
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, cls=DjangoJSONEncoder).encode()
+
+
+class CSVRenderer(_ExportRenderer):
+    media_type = 'text/csv'
+    format = FORMAT_CSV
+
+
+class NDJSONRenderer(_ExportRenderer):
+    media_type = 'application/x-ndjson'
+    format = FORMAT_NDJSON
@@ -0,0 +1,209 @@
+"""
+Read-only fast path of the hot list endpoints.
+
+A RowSerializer is compiled once from a ModelSerializer: every readable field
+becomes a values() lookup plus a mapper, and a nested many=True serializer of
+a reverse foreign key (a booking's guests) becomes one more values() query per
+page. Lists are then built from plain dict rows, without model instances or
+per-row field objects, and equal the ModelSerializer's data, so they render
+to the same bytes.
+
+Fields whose representation is the database value itself are copied as they
+are; dates and times go through the DRF field's to_representation, except
+aware datetimes in ISO 8601, formatted the same way with the timezone looked
+up once per list instead of once per value. Only the serializers registered in ROW_SERIALIZERS
+take the fast path, and FAST_LIST_SERIALIZERS = False turns it off.
+"""
+from datetime import datetime
+from functools import cached_property, lru_cache, partial
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import ISO_8601, serializers
+from rest_framework.fields import empty
+from rest_framework.settings import api_settings
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.response import Response
+
+from .serializers import AccommodationSerializer, BookingSerializer, BlockedPeriodSerializer, BookingAuditSerializer
+
+# Fields whose representation is the value values() returns
+PASSTHROUGH_FIELDS = (serializers.CharField, serializers.IntegerField, serializers.BooleanField)
+
+
+def _datetime_mapper(field):
+    """DateTimeField.to_representation with the timezone and format resolved once per list"""
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+    if output_format is None or output_format.lower() != ISO_8601 or field_timezone is None:
+        return field.to_representation
+
+    def to_representation(value):
+        if not isinstance(value, datetime) or value.tzinfo is None:
+            return field.to_representation(value)
+        value = value.astimezone(field_timezone).isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+    return to_representation
+
+
+def _mapper(field):
+    """
+    None when the value is copied as it is, otherwise a function returning the
+    mapper, called once per list (the current timezone may change per request)
+    """
+    if isinstance(field, PASSTHROUGH_FIELDS):
+        return None
+    if isinstance(field, PrimaryKeyRelatedField) and field.pk_field is None:
+        return None
+    if isinstance(field, serializers.ChoiceField) and all(
+        key == value for key, value in field.choice_strings_to_values.items()
+    ):
+        return None
+    if isinstance(field, serializers.JSONField) and not field.binary:
+        return None
+    if isinstance(field, serializers.DateTimeField):
+        return partial(_datetime_mapper, field)
+    if isinstance(field, (serializers.DateField, serializers.TimeField)):
+        return lambda: field.to_representation
+    raise ImproperlyConfigured(f'{type(field).__name__} `{field.field_name}` has no row mapper')
+
+
+class RowSerializer:
+    """Serialize values() rows exactly like `serializer_class(instances, many=True).data`"""
+
+    def __init__(self, serializer_class, fields=None):
+        self.serializer_class = serializer_class
+        # Sparse fieldset, for serializers taking a `fields` argument (SparseFieldsMixin)
+        self.fields = fields
+
+    @cached_property
+    def _compiled(self):
+        serializer = self.serializer_class() if self.fields is None else self.serializer_class(fields=self.fields)
+        opts = serializer.Meta.model._meta
+        fields, nested = [], []
+        for field in serializer._readable_fields:
+            if isinstance(field, serializers.ListSerializer):
+                relation = opts.get_field(field.source)
+                if not relation.one_to_many:
+                    raise ImproperlyConfigured(f'`{field.field_name}` is not a reverse foreign key')
+                nested.append((field.field_name, relation.field.attname, RowSerializer(type(field.child))))
+                fields.append((field.field_name, None, None, (None, None)))
+                continue
+            if isinstance(field, serializers.BaseSerializer) or field.source == '*':
+                raise ImproperlyConfigured(f'`{field.field_name}` cannot be read from values() rows')
+
+            *relations, name = field.source_attrs
+            if relations:
+                # `accommodation.title`: a join, and the key is left out (DRF's SkipField)
+                # or None when the relation is null
+                if field.default is not empty or field.required:
+                    raise ImproperlyConfigured(f'`{field.field_name}` needs a model instance')
+                lookup = '__'.join(field.source_attrs)
+                guard = opts.get_field(relations[0]).attname
+                missing = None if field.allow_null else empty
+            else:
+                lookup = opts.get_field(name).attname if isinstance(field, PrimaryKeyRelatedField) else name
+                guard = missing = None
+            fields.append((field.field_name, lookup, _mapper(field), (guard, missing)))
+
+        lookups = {'pk'} | {lookup for _, lookup, _, _ in fields if lookup}
+        lookups |= {guard for _, lookup, _, (guard, _) in fields if lookup and guard}
+        return fields, nested, sorted(lookups)
+
+    def values(self, queryset, *extra):
+        """The queryset as the rows to_representation() reads, plus the `extra` lookups"""
+        lookups = self._compiled[2]
+        return queryset.prefetch_related(None).values(*lookups, *(name for name in extra if name not in lookups))
+
+    def to_representation(self, rows):
+        compiled, nested, _ = self._compiled
+        fields = [(key, lookup, bind and bind(), guard) for key, lookup, bind, guard in compiled]
+        rows = list(rows)
+        children = {name: child.children_of(rows, fk) for name, fk, child in nested}
+        data = []
+        for row in rows:
+            item = {}
+            for key, lookup, mapper, (guard, missing) in fields:
+                if lookup is None:
+                    item[key] = children[key].get(row['pk'], [])
+                    continue
+                if guard is not None and row[guard] is None:
+                    if missing is not empty:
+                        item[key] = missing
+                    continue
+                value = row[lookup]
+                item[key] = value if mapper is None or value is None else mapper(value)
+            data.append(item)
+        return data
+
+    def children_of(self, parent_rows, fk):
+        """The serialized rows pointing to `parent_rows` through `fk`, grouped by parent pk"""
+        ids = [row['pk'] for row in parent_rows]
+        if not ids:
+            return {}
+        rows = self.values(self.serializer_class.Meta.model.objects.filter(**{f'{fk}__in': ids}), fk)
+        rows = list(rows)
+        grouped = {}
+        for row, item in zip(rows, self.to_representation(rows)):
+            grouped.setdefault(row[fk], []).append(item)
+        return grouped
+
+
+ROW_SERIALIZERS = {
+    serializer_class: RowSerializer(serializer_class)
+    for serializer_class in (AccommodationSerializer, BookingSerializer, BlockedPeriodSerializer, BookingAuditSerializer)
+}
+
+
+def row_serializer_for(serializer_class, fields=None):
+    """
+    The RowSerializer of `serializer_class` (restricted to `fields`, a tuple),
+    None when it has none or the fast path is off
+    """
+    if not getattr(settings, 'FAST_LIST_SERIALIZERS', True) or serializer_class not in ROW_SERIALIZERS:
+        return None
+    if fields is None:
+        return ROW_SERIALIZERS[serializer_class]
+    return _sparse_row_serializer(serializer_class, fields)
+
+
+@lru_cache(maxsize=128)
+def _sparse_row_serializer(serializer_class, fields):
+    return RowSerializer(serializer_class, fields)
+
+
+def paginate_rows(paginator, row_serializer, queryset, request, view):
+    """
+    Serialize the page of `queryset` read as values() rows; returns (data, paginated),
+    where data holds the whole queryset when there is no paginator or page size.
+    """
+    # Cursor pagination reads its position from the ordering fields of the last row, and
+    # ?ordering= (OrderingFilter) can replace the paginator's default ordering
+    if hasattr(paginator, 'get_ordering'):
+        ordering = paginator.get_ordering(request, queryset, view)
+    else:
+        ordering = getattr(paginator, 'ordering', None) or ()
+    if isinstance(ordering, str):
+        ordering = (ordering,)
+    rows = row_serializer.values(queryset, *(field.lstrip('-') for field in ordering))
+    page = paginator.paginate_queryset(rows, request, view=view) if paginator is not None else None
+    if page is None:
+        return row_serializer.to_representation(rows), False
+    return row_serializer.to_representation(page), True
+
+
+class FastListMixin:
+    """ViewSet mixin: list() serializes values() rows when its serializer class has a RowSerializer"""
+
+    def get_row_serializer(self):
+        return row_serializer_for(self.get_serializer_class())
+
+    def list(self, request, *args, **kwargs):
+        row_serializer = self.get_row_serializer()
+        if row_serializer is None:
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        data, paginated = paginate_rows(self.paginator, row_serializer, queryset, request, self)
+        if paginated:
+            return self.get_paginated_response(data)
+        return Response(data)
@@ -0,0 +1,33 @@
+"""Booking list filters shared by BookingViewSet and the exports"""
+
+
+def filter_bookings(queryset, params, user=None):
+    """
+    Apply the status / accommodation / start_date / end_date filters of
+    `params` (query params or any mapping). With a `user`, non-admins only
+    get their own bookings.
+    """
+    # Filter by user if not admin
+    if user is not None and not user.is_staff and hasattr(user, 'role'):
+        if user.role.name != 'admin':
+            queryset = queryset.filter(user_id=user.id)
+
+    # Filter by status
+    booking_status = params.get('status')
+    if booking_status:
+        queryset = queryset.filter(status=booking_status)
+
+    # Filter by accommodation
+    accommodation_id = params.get('accommodation')
+    if accommodation_id:
+        queryset = queryset.filter(accommodation_id=accommodation_id)
+
+    # Filter by date range
+    start_date = params.get('start_date')
+    end_date = params.get('end_date')
+    if start_date:
+        queryset = queryset.filter(check_in__gte=start_date)
+    if end_date:
+        queryset = queryset.filter(check_out__lte=end_date)
+
+    return queryset
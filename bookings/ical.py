@@ -0,0 +1,177 @@
+"""
+iCalendar (RFC 5545) feed of an accommodation's occupancy, for OTA calendar sync.
+
+Confirmed and pending bookings become all-day events from the check-in day to
+the check-out day (exclusive, so the check-out day stays bookable), blocked
+periods cover every local day they touch, and blocked weekdays are expanded
+into one event per occurrence (all-day, or timed when the rule has times)
+over the feed window, since not every OTA understands RRULE. Only events from
+ICAL_PAST_DAYS ago up to ICAL_HORIZON_DAYS ahead are included.
+
+With ACCOMMODATION_CACHE_ENABLED the feed is built once per accommodation
+generation (see response_cache) and day, so repeated polling is served from
+the cache with a precomputed ETag; without it every request rebuilds the feed
+(a 304 then only saves the transfer). Events carry no guest data.
+"""
+import hashlib
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.renderers import BaseRenderer
+
+from .interval_index import ACTIVE_BOOKING_STATUSES
+from .models import Accommodation, Booking, BlockedPeriod, BlockedWeekday
+from .response_cache import response_cache
+
+PRODID = '-//Booking Backend//Availability Feed//IT'
+CONTENT_TYPE = 'text/calendar; charset=utf-8'
+
+
+def _past_days():
+    return getattr(settings, 'ICAL_PAST_DAYS', 30)
+
+
+def _horizon_days():
+    return getattr(settings, 'ICAL_HORIZON_DAYS', 365)
+
+
+def _escape(text):
+    return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def _fold(line):
+    """Split content lines longer than 75 octets (RFC 5545, 3.1)"""
+    encoded = line.encode()
+    if len(encoded) <= 75:
+        return line
+    parts = []
+    while encoded:
+        size = 75 if not parts else 74
+        # Do not cut a multi-byte character in half
+        while size < len(encoded) and (encoded[size] & 0xC0) == 0x80:
+            size -= 1
+        parts.append(encoded[:size].decode())
+        encoded = encoded[size:]
+    return '\r\n '.join(parts)
+
+
+def _date(value):
+    return value.strftime('%Y%m%d')
+
+
+def _utc(value):
+    return value.astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def _local_days(start, end, include_end_day):
+    """First local day and exclusive last local day of [start, end)"""
+    first = timezone.localtime(start).date()
+    local_end = timezone.localtime(end)
+    last = local_end.date()
+    if include_end_day and local_end.time() != time.min:
+        last += timedelta(days=1)
+    return first, max(last, first + timedelta(days=1))
+
+
+def _event(uid, stamp, summary, start_line, end_line, status=None):
+    lines = ['BEGIN:VEVENT', f'UID:{uid}', f'DTSTAMP:{_utc(stamp)}', start_line, end_line,
+             f'SUMMARY:{_escape(summary)}', 'TRANSP:OPAQUE']
+    if status:
+        lines.append(f'STATUS:{status}')
+    lines.append('END:VEVENT')
+    return lines
+
+
+def _all_day(uid, stamp, summary, first, last, status=None):
+    return _event(
+        uid, stamp, summary, f'DTSTART;VALUE=DATE:{_date(first)}', f'DTEND;VALUE=DATE:{_date(last)}', status
+    )
+
+
+def iter_event_lines(accommodation_id, today, domain):
+    window_start = today - timedelta(days=_past_days())
+    window_end = today + timedelta(days=_horizon_days())
+    range_start = timezone.make_aware(datetime.combine(window_start, time.min))
+    range_end = timezone.make_aware(datetime.combine(window_end, time.min))
+
+    bookings = Booking.objects.filter(
+        accommodation_id=accommodation_id,
+        status__in=ACTIVE_BOOKING_STATUSES,
+        check_in__lt=range_end,
+        check_out__gt=range_start
+    ).order_by('check_in', 'id').values_list('id', 'check_in', 'check_out', 'status', 'updated_at')
+    for booking_id, check_in, check_out, booking_status, updated_at in bookings.iterator():
+        first, last = _local_days(check_in, check_out, include_end_day=False)
+        yield from _all_day(
+            f'booking-{booking_id}@{domain}', updated_at, 'Reserved', first, last,
+            'CONFIRMED' if booking_status == 'confirmed' else 'TENTATIVE'
+        )
+
+    blocked_periods = BlockedPeriod.objects.filter(
+        accommodation_id=accommodation_id,
+        start_date__lt=range_end,
+        end_date__gt=range_start
+    ).order_by('start_date', 'id').values_list('id', 'start_date', 'end_date', 'created_at')
+    for period_id, start_date, end_date, created_at in blocked_periods.iterator():
+        first, last = _local_days(start_date, end_date, include_end_day=True)
+        yield from _all_day(f'blocked-{period_id}@{domain}', created_at, 'Not available', first, last)
+
+    weekdays = BlockedWeekday.objects.filter(accommodation_id=accommodation_id).order_by('id').values_list(
+        'id', 'weekday', 'start_time', 'end_time', 'created_at'
+    )
+    for rule_id, weekday, start_time, end_time, created_at in weekdays:
+        day = window_start + timedelta(days=(weekday - window_start.weekday()) % 7)
+        while day < window_end:
+            uid = f'weekday-{rule_id}-{_date(day)}@{domain}'
+            if start_time is None and end_time is None:
+                yield from _all_day(uid, created_at, 'Not available', day, day + timedelta(days=1))
+            else:
+                # Without end time (or ending before it starts) the block lasts until midnight
+                start = timezone.make_aware(datetime.combine(day, start_time or time.min))
+                if end_time is None or end_time <= (start_time or time.min):
+                    end = timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+                else:
+                    end = timezone.make_aware(datetime.combine(day, end_time))
+                yield from _event(
+                    uid, created_at, 'Not available', f'DTSTART:{_utc(start)}', f'DTEND:{_utc(end)}'
+                )
+            day += timedelta(days=7)
+
+
+def build_feed(accommodation_id, domain, today):
+    title = Accommodation.objects.values_list('title', flat=True).get(id=accommodation_id)
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        f'PRODID:{PRODID}',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f'X-WR-CALNAME:{_escape(title)}',
+        *iter_event_lines(accommodation_id, today, domain),
+        'END:VCALENDAR',
+    ]
+    return ''.join(_fold(line) + '\r\n' for line in lines)
+
+
+def cached_feed(accommodation_id, domain):
+    """(etag, body) of the feed; with the response cache on, rebuilt only when the data or the day changes"""
+    today = timezone.localdate()
+
+    def compute():
+        body = build_feed(accommodation_id, domain, today)
+        return '"%s"' % hashlib.sha1(body.encode()).hexdigest(), body
+
+    return response_cache.get_or_set(accommodation_id, 'ical', (domain, today), compute)
+
+
+class ICalendarRenderer(BaseRenderer):
+    """Lets OTAs asking for text/calendar through content negotiation; errors are rendered as plain text"""
+    media_type = 'text/calendar'
+    format = 'ics'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            return ' '.join(str(value) for value in data.values()).encode()
+        return str(data).encode()
@@ -0,0 +1,249 @@
+"""
+In-process interval index for availability checks.
+
+For each accommodation we keep the active bookings and the blocked periods as
+two sorted interval lists. Each list stores the start points in order plus a
+running maximum of the end points, so "does anything overlap [start, end)?"
+is a single bisect followed by one comparison.
+"""
+import bisect
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from .db_router import primary
+from .models import Booking, BlockedPeriod
+
+ACTIVE_BOOKING_STATUSES = ('pending', 'confirmed')
+
+
+def _aware(value):
+    if timezone.is_naive(value):
+        return timezone.make_aware(value)
+    return value
+
+
+class IntervalSet:
+    """Intervals of a single accommodation, sorted by start."""
+
+    __slots__ = ('starts', 'ends', 'keys', 'max_ends')
+
+    def __init__(self, items=()):
+        items = sorted(items, key=lambda item: (item[0], item[1], item[2]))
+        self.starts = [item[0] for item in items]
+        self.ends = [item[1] for item in items]
+        self.keys = [item[2] for item in items]
+        self.max_ends = []
+        self._refresh_max_ends(0)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _refresh_max_ends(self, position):
+        del self.max_ends[position:]
+        current = self.max_ends[-1] if self.max_ends else None
+        for end in self.ends[position:]:
+            current = end if current is None or end > current else current
+            self.max_ends.append(current)
+
+    def add(self, start, end, key):
+        position = bisect.bisect_right(self.starts, start)
+        self.starts.insert(position, start)
+        self.ends.insert(position, end)
+        self.keys.insert(position, key)
+        self._refresh_max_ends(position)
+
+    def remove(self, key):
+        try:
+            position = self.keys.index(key)
+        except ValueError:
+            return False
+        del self.starts[position]
+        del self.ends[position]
+        del self.keys[position]
+        self._refresh_max_ends(position)
+        return True
+
+    def overlaps(self, start, end):
+        """Return True if any interval overlaps [start, end)"""
+        position = bisect.bisect_left(self.starts, end)
+        return position > 0 and self.max_ends[position - 1] > start
+
+    def overlapping(self, start, end):
+        """Return (key, start, end) for the intervals overlapping [start, end)"""
+        found = []
+        position = bisect.bisect_left(self.starts, end) - 1
+        while position >= 0 and self.max_ends[position] > start:
+            if self.ends[position] > start:
+                found.append((self.keys[position], self.starts[position], self.ends[position]))
+            position -= 1
+        found.reverse()
+        return found
+
+    def items(self):
+        return set(zip(self.starts, self.ends, self.keys))
+
+
+class AccommodationIntervals:
+    __slots__ = ('bookings', 'blocks', 'built_at')
+
+    def __init__(self, bookings, blocks):
+        self.bookings = bookings
+        self.blocks = blocks
+        self.built_at = time.monotonic()
+
+
+class AvailabilityIndex:
+    """Per-accommodation interval index kept in process memory."""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.RLock()
+        # Bumped by every change: a load that started before one may miss it
+        self._generation = 0
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'AVAILABILITY_INDEX_ENABLED', False)
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'AVAILABILITY_INDEX_TTL', 60)
+
+    def _load(self, accommodation_id):
+        # Kept for up to AVAILABILITY_INDEX_TTL: always read from the primary
+        with primary():
+            bookings = list(Booking.objects.filter(
+                accommodation_id=accommodation_id,
+                status__in=ACTIVE_BOOKING_STATUSES
+            ).values_list('check_in', 'check_out', 'id'))
+            blocks = list(BlockedPeriod.objects.filter(
+                accommodation_id=accommodation_id
+            ).values_list('start_date', 'end_date', 'id'))
+        return AccommodationIntervals(IntervalSet(bookings), IntervalSet(blocks))
+
+    def _fresh(self, entry):
+        return entry is not None and not (self.ttl and time.monotonic() - entry.built_at > self.ttl)
+
+    def _store(self, accommodation_id, entry, generation):
+        # A load that raced with a change is only used by its caller; the next read loads again
+        with self._lock:
+            if self._generation == generation:
+                self._entries[accommodation_id] = entry
+
+    def _get(self, accommodation_id):
+        entry = self._entries.get(accommodation_id)
+        if not self._fresh(entry):
+            generation = self._generation
+            entry = self._load(accommodation_id)
+            self._store(accommodation_id, entry, generation)
+        return entry
+
+    def _overlapping(self, entry, start, end):
+        start, end = _aware(start), _aware(end)
+        with self._lock:
+            return entry.bookings.overlapping(start, end), entry.blocks.overlapping(start, end)
+
+    def conflicts(self, accommodation_id, start, end):
+        """Return the (id, start, end) of the bookings and blocked periods overlapping [start, end)"""
+        return self._overlapping(self._get(accommodation_id), start, end)
+
+    def loaded_conflicts(self, accommodation_id, start, end):
+        """conflicts() when the accommodation is loaded and fresh, None when that needs the DB"""
+        entry = self._entries.get(accommodation_id)
+        if not self._fresh(entry):
+            return None
+        return self._overlapping(entry, start, end)
+
+    def is_available(self, accommodation_id, start, end):
+        start, end = _aware(start), _aware(end)
+        entry = self._get(accommodation_id)
+        with self._lock:
+            return not entry.bookings.overlaps(start, end) and not entry.blocks.overlaps(start, end)
+
+    def _upsert(self, attr, key, accommodation_id, start, end, active=True):
+        with self._lock:
+            self._generation += 1
+            for entry in self._entries.values():
+                getattr(entry, attr).remove(key)
+            entry = self._entries.get(accommodation_id)
+            if entry is not None and active:
+                getattr(entry, attr).add(_aware(start), _aware(end), key)
+
+    def _discard(self, attr, key):
+        with self._lock:
+            self._generation += 1
+            for entry in self._entries.values():
+                getattr(entry, attr).remove(key)
+
+    def upsert_booking(self, booking_id, accommodation_id, check_in, check_out, booking_status):
+        self._upsert('bookings', booking_id, accommodation_id, check_in, check_out,
+                     active=booking_status in ACTIVE_BOOKING_STATUSES)
+
+    def discard_booking(self, booking_id):
+        self._discard('bookings', booking_id)
+
+    def upsert_blocked_period(self, period_id, accommodation_id, start_date, end_date):
+        self._upsert('blocks', period_id, accommodation_id, start_date, end_date)
+
+    def discard_blocked_period(self, period_id):
+        self._discard('blocks', period_id)
+
+    def invalidate(self, accommodation_ids=None):
+        with self._lock:
+            self._generation += 1
+            if accommodation_ids is None:
+                self._entries.clear()
+            else:
+                for accommodation_id in accommodation_ids:
+                    self._entries.pop(accommodation_id, None)
+
+    def rebuild(self, accommodation_ids=None):
+        """Reload the given accommodations (default: every loaded one) from the DB"""
+        with self._lock:
+            if accommodation_ids is None:
+                accommodation_ids = list(self._entries)
+        for accommodation_id in accommodation_ids:
+            with self._lock:
+                self._entries.pop(accommodation_id, None)
+                generation = self._generation
+            self._store(accommodation_id, self._load(accommodation_id), generation)
+        return len(accommodation_ids)
+
+    def verify(self, accommodation_ids=None):
+        """Compare the loaded intervals against the DB and return the differences"""
+        with self._lock:
+            if accommodation_ids is None:
+                accommodation_ids = list(self._entries)
+            snapshot = {
+                accommodation_id: (self._entries[accommodation_id].bookings.items(),
+                                   self._entries[accommodation_id].blocks.items())
+                for accommodation_id in accommodation_ids if accommodation_id in self._entries
+            }
+
+        mismatches = []
+        for accommodation_id, (bookings, blocks) in snapshot.items():
+            fresh = self._load(accommodation_id)
+            for kind, indexed, expected in (
+                ('bookings', bookings, fresh.bookings.items()),
+                ('blocked_periods', blocks, fresh.blocks.items()),
+            ):
+                missing = sorted(key for _, _, key in expected - indexed)
+                stale = sorted(key for _, _, key in indexed - expected)
+                if missing or stale:
+                    mismatches.append({
+                        'accommodation_id': accommodation_id,
+                        'kind': kind,
+                        'missing': missing,
+                        'stale': stale,
+                    })
+        return mismatches
+
+    def loaded(self):
+        with self._lock:
+            return list(self._entries)
+
+
+availability_index = AvailabilityIndex()
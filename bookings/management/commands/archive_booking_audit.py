@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from bookings import archive
+from bookings.models import BookingAudit
+
+
+class Command(BaseCommand):
+    help = 'Move booking audit rows older than the given age into booking_audit_archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-days', type=int,
+            default=getattr(settings, 'BOOKING_AUDIT_ARCHIVE_AFTER_DAYS', 180),
+            help='Archive the rows created more than this many days ago'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows moved per transaction')
+        parser.add_argument('--limit', type=int, default=None, help='Stop after this many rows')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the rows to archive')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['older_than_days'])
+        if options['dry_run']:
+            count = BookingAudit.objects.filter(created_at__lt=cutoff).count()
+            self.stdout.write(f'{count} audit rows older than {cutoff:%Y-%m-%d %H:%M} would be archived')
+            return
+
+        moved = archive.archive_audit(cutoff, batch_size=options['batch_size'], limit=options['limit'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {moved} audit rows older than {cutoff:%Y-%m-%d %H:%M}'))
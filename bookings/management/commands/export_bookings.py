@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from bookings import export
+from bookings.filters import filter_bookings
+from bookings.models import Booking
+
+
+class Command(BaseCommand):
+    help = 'Export bookings with their guests as CSV or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=export.FORMATS, default=export.FORMAT_CSV)
+        parser.add_argument('--output', help='File to write (default: standard output)')
+        parser.add_argument('--status')
+        parser.add_argument('--accommodation', type=int, help='Accommodation id')
+        parser.add_argument('--start-date', help='Only bookings with check-in on or after this date')
+        parser.add_argument('--end-date', help='Only bookings with check-out on or before this date')
+        parser.add_argument('--chunk-size', type=int, default=export.DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        queryset = filter_bookings(Booking.objects.all(), options)
+        chunks = export.iter_export(queryset, options['format'], options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                output.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
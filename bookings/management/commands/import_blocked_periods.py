@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+
+from bookings import blocked_import
+
+
+class Command(BaseCommand):
+    help = 'Import blocked periods from a CSV, JSON or iCal file, merged with the existing ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to read')
+        parser.add_argument('--format', choices=blocked_import.FORMATS,
+                            help='Default: from the file extension (.csv, .json, .ics)')
+        parser.add_argument('--accommodation', type=int,
+                            help='Accommodation id of the rows without one (required for iCal)')
+        parser.add_argument('--mode', choices=blocked_import.MODES, default=blocked_import.MODE_MERGE,
+                            help='replace: the file lists every blocked period of its accommodations')
+        parser.add_argument('--dry-run', action='store_true', help='Only report the changes')
+
+    def handle(self, *args, **options):
+        import_format = options['format'] or blocked_import.guess_format(options['path'])
+        if import_format is None:
+            raise CommandError('Unknown file extension, use --format')
+        with open(options['path'], encoding='utf-8-sig') as source:
+            content = source.read()
+        try:
+            items = blocked_import.parse(content, import_format)
+        except ValidationError as exc:
+            raise CommandError(exc.detail['content'][0])
+
+        summary = blocked_import.import_blocked_periods(
+            items, accommodation_id=options['accommodation'], mode=options['mode'], dry_run=options['dry_run']
+        )
+        for error in summary['errors']:
+            self.stdout.write(f"item {error['index']}: {error['errors']}")
+        if summary['errors']:
+            raise CommandError(f"{len(summary['errors'])} invalid items, nothing imported")
+        for entry in summary['accommodations']:
+            self.stdout.write(
+                f"accommodation {entry['accommodation']}: {entry['received']} received, {entry['merged']} after "
+                f"merging, {entry['created']} created, {entry['deleted']} deleted, {entry['unchanged']} unchanged"
+            )
+        verb = 'Would import' if options['dry_run'] else 'Imported'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {summary['received']} periods: {summary['created']} created, {summary['deleted']} deleted"
+        ))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from bookings.occupancy import occupancy_store
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored per-day occupancy bitmaps from the bookings and blocked periods'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--accommodation', type=int, action='append', dest='accommodation_ids',
+            help='Only this accommodation id (repeatable; default: all of them)'
+        )
+
+    def handle(self, *args, **options):
+        rebuilt = occupancy_store.rebuild(options['accommodation_ids'])
+        origin, days = occupancy_store.window()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt the occupancy of {rebuilt} accommodations ({days} days from {origin:%Y-%m-%d})'
+        ))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from bookings import statistics
+
+
+class Command(BaseCommand):
+    help = 'Recompute the booking statistics counters from the database and fix any drift'
+
+    def handle(self, *args, **options):
+        values, drift = statistics.reconcile()
+        for key, difference in drift.items():
+            self.stdout.write(f'{key}: counter was off by {difference:+d}, reset to {values[key]}')
+        self.stdout.write(self.style.SUCCESS(
+            'Statistics reconciled' + (f' ({len(drift)} counters corrected)' if drift else ' (no drift)')
+        ))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bookings.occupancy import occupancy_store
+
+
+class Command(BaseCommand):
+    help = 'Check the stored per-day occupancy bitmaps against the bookings and blocked periods'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--accommodation', type=int, action='append', dest='accommodation_ids',
+            help='Only this accommodation id (repeatable; default: all of them)'
+        )
+
+    def handle(self, *args, **options):
+        mismatches = occupancy_store.verify(options['accommodation_ids'])
+        for mismatch in mismatches:
+            days = mismatch['days']
+            detail = f"{mismatch['status']} on {len(days)} days from {days[0]}" if days else mismatch['reason']
+            self.stdout.write(f"accommodation {mismatch['accommodation_id']}: {detail}")
+        if mismatches:
+            raise CommandError(
+                f'{len(mismatches)} differences found, fix them with `python manage.py rebuild_occupancy`'
+            )
+        self.stdout.write(self.style.SUCCESS('Occupancy bitmaps match the database'))
@@ -0,0 +1,71 @@
+"""
+Process-local counters and timings, exposed to admins through /api/metrics/.
+
+Each worker process keeps its own numbers; they reset when the process restarts.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+_lock = threading.Lock()
+_counters = {}
+_timings = {}
+
+# Derived ratios: name -> (counters of hits, counters of misses)
+RATIOS = {
+    'db.connection.reuse_ratio': (('db.connection.reused', 'db.connection.pool_reused'), ('db.connection.opened',)),
+    'cache.accommodation.hit_ratio': (('cache.accommodation.hit',), ('cache.accommodation.miss',)),
+}
+
+
+def incr(name, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name, seconds):
+    with _lock:
+        count, total, maximum = _timings.get(name, (0, 0.0, 0.0))
+        _timings[name] = (count + 1, total + seconds, max(maximum, seconds))
+
+
+@contextmanager
+def timer(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started)
+
+
+def _ratios(counters):
+    ratios = {}
+    for name, (hits, misses) in RATIOS.items():
+        hit = sum(counters.get(counter, 0) for counter in hits)
+        total = hit + sum(counters.get(counter, 0) for counter in misses)
+        if total:
+            ratios[name] = round(hit / total, 4)
+    return ratios
+
+
+def snapshot():
+    with _lock:
+        return {
+            'counters': dict(_counters),
+            'ratios': _ratios(_counters),
+            'timings': {
+                name: {
+                    'count': count,
+                    'total_ms': round(total * 1000, 3),
+                    'avg_ms': round(total * 1000 / count, 3) if count else 0.0,
+                    'max_ms': round(maximum * 1000, 3),
+                }
+                for name, (count, total, maximum) in _timings.items()
+            },
+        }
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _timings.clear()
@@ -0,0 +1,62 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from . import metrics
+from .db_router import ais_pinned, apin_to_primary, is_pinned, pin_to_primary, replica_reads_allowed, replicas
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class ReplicaRoutingMiddleware:
+    """Let safe requests read from the replicas, unless their client wrote within DATABASE_REPLICA_PIN_SECONDS"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not replicas():
+            return self.get_response(request)
+
+        safe = request.method in SAFE_METHODS
+        token = self._allow_replica(safe, safe and not is_pinned(request))
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            replica_reads_allowed.reset(token)
+            raise
+        self._restore(token, response)
+        if not safe:
+            pin_to_primary(request)
+        return response
+
+    async def __acall__(self, request):
+        if not replicas():
+            return await self.get_response(request)
+
+        safe = request.method in SAFE_METHODS
+        token = self._allow_replica(safe, safe and not await ais_pinned(request))
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            replica_reads_allowed.reset(token)
+            raise
+        self._restore(token, response)
+        if not safe:
+            await apin_to_primary(request)
+        return response
+
+    def _allow_replica(self, safe, allowed):
+        if safe:
+            metrics.incr('db.reads.replica' if allowed else 'db.reads.pinned')
+        return replica_reads_allowed.set(allowed)
+
+    def _restore(self, token, response):
+        # Streaming bodies (exports) are read after this returns: keep the flag,
+        # the next request in this thread or task sets its own
+        if not response.streaming:
+            replica_reads_allowed.reset(token)
@@ -40,6 +40,8 @@ class User(AbstractBaseUser, PermissionsMixin):
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
     last_login = models.DateTimeField(null=True, blank=True)
+    # Tokens issued before this time are rejected (set when the password changes)
+    tokens_valid_after = models.DateTimeField(null=True, blank=True)
 
     # Required for admin
     is_active = models.BooleanField(default=True)
@@ -92,6 +94,28 @@ class Accommodation(models.Model):
         return self.title
 
 
+class AccommodationOccupancy(models.Model):
+    """Per-day occupancy counts of an accommodation, maintained by bookings/occupancy.py"""
+    accommodation = models.OneToOneField(
+        Accommodation, on_delete=models.CASCADE, primary_key=True, db_column='accommodation_id',
+        related_name='occupancy'
+    )
+    origin = models.DateField()
+    days = models.IntegerField()
+    # Little-endian unsigned 16-bit counts, one per day from origin
+    booked = models.BinaryField()
+    pending = models.BinaryField()
+    blocked = models.BinaryField()
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'accommodation_occupancy'
+        managed = False
+
+    def __str__(self):
+        return f"Occupancy of accommodation {self.accommodation_id} from {self.origin}"
+
+
 class Booking(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -118,6 +142,8 @@ class Booking(models.Model):
             models.Index(fields=['accommodation', 'check_in', 'check_out'], name='idx_bookings_accom_dates'),
             models.Index(fields=['status'], name='idx_bookings_status'),
             models.Index(fields=['user'], name='idx_bookings_user'),
+            models.Index(fields=['created_at'], name='idx_bookings_created'),
+            models.Index(fields=['user', 'created_at'], name='idx_bookings_user_created'),
         ]
 
     def __str__(self):
@@ -205,7 +231,37 @@ class BookingAudit(models.Model):
         indexes = [
             models.Index(fields=['booking'], name='idx_audit_booking'),
             models.Index(fields=['actor_user'], name='idx_audit_actor'),
+            models.Index(fields=['created_at'], name='idx_audit_created'),
         ]
 
     def __str__(self):
         return f"Audit: {self.action} - Booking {self.booking.id if self.booking else 'N/A'}"
+
+
+class BookingAuditArchive(models.Model):
+    """Audit rows moved out of booking_audit by `archive_booking_audit` (same ids, partitioned by month)"""
+    id = models.BigIntegerField(primary_key=True)
+    # Partitioned tables cannot have foreign keys: the ids are kept as they were
+    booking = models.ForeignKey(
+        Booking, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True,
+        db_column='booking_id', related_name='+'
+    )
+    action = models.CharField(max_length=64)
+    actor_user = models.ForeignKey(
+        User, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True,
+        db_column='actor_user_id', related_name='+'
+    )
+    data_json = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'booking_audit_archive'
+        managed = False
+        indexes = [
+            models.Index(fields=['booking', 'created_at'], name='idx_audit_arch_booking'),
+            models.Index(fields=['actor_user'], name='idx_audit_arch_actor'),
+            models.Index(fields=['created_at'], name='idx_audit_arch_created'),
+        ]
+
+    def __str__(self):
+        return f"Archived audit: {self.action} - Booking {self.booking_id or 'N/A'}"
@@ -0,0 +1,409 @@
+"""
+Per-day occupancy bitmaps of the accommodations.
+
+For every accommodation and calendar status (booked, pending, blocked) we keep
+how many intervals touch each local day of a rolling window, from
+OCCUPANCY_PAST_DAYS before today to OCCUPANCY_HORIZON_DAYS after it, plus a
+bitmask of the days whose count is not zero. A day is touched when any
+instant of it falls inside [start, end), the same rule as the calendar.
+
+Two intervals can only overlap if they touch a common day, so a range whose
+days are all clear in the masks is free without reading any row: availability
+checks and calendars become a few integer AND operations. Ranges touching an
+occupied day still go through the exact check (interval index or DB).
+
+The counts are persisted in accommodation_occupancy
+(add_accommodation_occupancy.sql) and updated by every booking and blocked
+period write, inside the write's transaction and under a row lock (rebuilds
+take the same lock before reading the rows), so they
+survive restarts and are shared by all processes. Each process keeps the
+decoded rows in memory for OCCUPANCY_TTL seconds. Windows that have moved on
+(a new day) are rebuilt from the rows when read. `manage.py rebuild_occupancy`
+and `manage.py verify_occupancy` rebuild the stored counts and check them
+against the rows.
+"""
+import sys
+import threading
+from array import array
+from datetime import datetime, time, timedelta
+from time import monotonic
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from . import metrics
+from .db_router import primary
+from .models import Accommodation, AccommodationOccupancy, Booking, BlockedPeriod
+
+STATUSES = ('booked', 'pending', 'blocked')
+BOOKING_STATUSES = {'confirmed': 'booked', 'pending': 'pending'}
+
+
+def _aware(value):
+    if timezone.is_naive(value):
+        return timezone.make_aware(value)
+    return value
+
+
+def local_days(start, end):
+    """First and last local day touched by [start, end) (last before first when it is empty)"""
+    tz = timezone.get_default_timezone()
+    first = timezone.localtime(_aware(start), tz).date()
+    local_end = timezone.localtime(_aware(end), tz)
+    last = local_end.date() if local_end.time() != time.min else local_end.date() - timedelta(days=1)
+    return first, last
+
+
+def interval_of(instance):
+    """
+    (accommodation_id, status, start, end) of a Booking or BlockedPeriod as
+    counted by the bitmaps, None when it is not counted. The status is None
+    when the instance was loaded without the fields it needs.
+    """
+    if isinstance(instance, Booking):
+        names = ('accommodation_id', 'status', 'check_in', 'check_out')
+    else:
+        names = ('accommodation_id', 'start_date', 'end_date')
+    values = instance.__dict__
+    if any(name not in values for name in names):
+        return (values.get('accommodation_id'), None, None, None)
+    if isinstance(instance, Booking):
+        status = BOOKING_STATUSES.get(instance.status)
+        if status is None:
+            return None
+        return (instance.accommodation_id, status, instance.check_in, instance.check_out)
+    return (instance.accommodation_id, 'blocked', instance.start_date, instance.end_date)
+
+
+def _encode(counts):
+    if sys.byteorder != 'little':
+        counts = array('H', counts)
+        counts.byteswap()
+    return counts.tobytes()
+
+
+def _decode(data):
+    counts = array('H')
+    counts.frombytes(bytes(data))
+    if sys.byteorder != 'little':
+        counts.byteswap()
+    return counts
+
+
+class Occupancy:
+    """Day counts and masks of one accommodation, for `days` days from `origin`"""
+
+    __slots__ = ('origin', 'days', 'counts', 'masks', 'loaded_at')
+
+    def __init__(self, origin, days, counts=None):
+        self.origin = origin
+        self.days = days
+        self.counts = counts or {status: array('H', bytes(2 * days)) for status in STATUSES}
+        self.masks = {
+            status: sum(1 << index for index, count in enumerate(values) if count)
+            for status, values in self.counts.items()
+        }
+        self.loaded_at = monotonic()
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row.origin, row.days, {status: _decode(getattr(row, status)) for status in STATUSES})
+
+    def row_values(self):
+        return {
+            'origin': self.origin, 'days': self.days, 'updated_at': timezone.now(),
+            **{status: _encode(self.counts[status]) for status in STATUSES},
+        }
+
+    def _indexes(self, first, last):
+        return max((first - self.origin).days, 0), min((last - self.origin).days, self.days - 1)
+
+    def covers(self, first, last):
+        return self.origin <= first and (last - self.origin).days < self.days
+
+    def fill(self, intervals):
+        """Count (status, start, end) intervals, with one difference array per status"""
+        deltas = {status: [0] * (self.days + 1) for status in STATUSES}
+        for status, start, end in intervals:
+            first, last = self._indexes(*local_days(start, end))
+            if first <= last:
+                deltas[status][first] += 1
+                deltas[status][last + 1] -= 1
+        for status in STATUSES:
+            running, counts, mask = 0, self.counts[status], 0
+            for index in range(self.days):
+                running += deltas[status][index]
+                counts[index] = min(running, 0xFFFF)
+                if running:
+                    mask |= 1 << index
+            self.masks[status] = mask
+
+    def add(self, status, start, end, delta=1):
+        first, last = self._indexes(*local_days(start, end))
+        counts, mask = self.counts[status], self.masks[status]
+        for index in range(first, last + 1):
+            count = min(max(counts[index] + delta, 0), 0xFFFF)
+            counts[index] = count
+            mask = mask | (1 << index) if count else mask & ~(1 << index)
+        self.masks[status] = mask
+
+    def is_free(self, first, last):
+        """True when no day from first to last (inclusive) is occupied"""
+        if last < first:
+            return True
+        offset = (first - self.origin).days
+        mask = ((1 << ((last - first).days + 1)) - 1) << offset
+        return not (self.masks['booked'] | self.masks['pending'] | self.masks['blocked']) & mask
+
+    def day_statuses(self, start, end):
+        """'blocked', 'booked', 'pending' or 'free' for every day from start to end (inclusive)"""
+        offset = (start - self.origin).days
+        booked, pending, blocked = (self.masks[status] >> offset for status in ('booked', 'pending', 'blocked'))
+        statuses = []
+        for _ in range((end - start).days + 1):
+            if blocked & 1:
+                statuses.append('blocked')
+            elif booked & 1:
+                statuses.append('booked')
+            elif pending & 1:
+                statuses.append('pending')
+            else:
+                statuses.append('free')
+            booked, pending, blocked = booked >> 1, pending >> 1, blocked >> 1
+        return statuses
+
+
+class OccupancyStore:
+    """Persisted per-accommodation occupancy, with an in-process copy of the rows"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.RLock()
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'OCCUPANCY_ENABLED', False)
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'OCCUPANCY_TTL', 60)
+
+    def window(self):
+        """(origin, days) of the current rolling window"""
+        past = getattr(settings, 'OCCUPANCY_PAST_DAYS', 30)
+        horizon = getattr(settings, 'OCCUPANCY_HORIZON_DAYS', 730)
+        today = timezone.localdate(timezone=timezone.get_default_timezone())
+        return today - timedelta(days=past), past + horizon
+
+    def build(self, accommodation_id):
+        """Compute the occupancy of the current window from the Booking and BlockedPeriod rows"""
+        origin, days = self.window()
+        tz = timezone.get_default_timezone()
+        range_start = timezone.make_aware(datetime.combine(origin, time.min), tz)
+        range_end = timezone.make_aware(datetime.combine(origin + timedelta(days=days), time.min), tz)
+        # Persisted and shared: always read from the primary
+        with primary():
+            bookings = list(Booking.objects.filter(
+                accommodation_id=accommodation_id,
+                status__in=list(BOOKING_STATUSES),
+                check_in__lt=range_end,
+                check_out__gt=range_start
+            ).values_list('status', 'check_in', 'check_out'))
+            blocked_periods = list(BlockedPeriod.objects.filter(
+                accommodation_id=accommodation_id,
+                start_date__lt=range_end,
+                end_date__gt=range_start
+            ).values_list('start_date', 'end_date'))
+        occupancy = Occupancy(origin, days)
+        occupancy.fill([
+            *((BOOKING_STATUSES[status], start, end) for status, start, end in bookings),
+            *(('blocked', start, end) for start, end in blocked_periods),
+        ])
+        return occupancy
+
+    def _current(self, occupancy):
+        return (
+            occupancy is not None and (occupancy.origin, occupancy.days) == self.window()
+            and all(len(counts) == occupancy.days for counts in occupancy.counts.values())
+        )
+
+    def _lock_row(self, accommodation_id):
+        """
+        Lock the stored row of an accommodation until the end of the current
+        transaction and return it; None when the accommodation does not exist.
+
+        A missing row is inserted first (with no days, so that it reads as
+        outdated) and then locked: a concurrent first writer makes the insert
+        wait for its commit and fail, after which the lock is taken on its row.
+        """
+        rows = AccommodationOccupancy.objects.select_for_update().filter(accommodation_id=accommodation_id)
+        row = rows.first()
+        if row is None:
+            try:
+                with transaction.atomic():
+                    AccommodationOccupancy.objects.create(
+                        accommodation_id=accommodation_id, **Occupancy(self.window()[0], 0).row_values()
+                    )
+            except IntegrityError:
+                pass
+            row = rows.first()
+        return row
+
+    def _save(self, accommodation_id, occupancy):
+        """Store the counts; the row must be locked by _lock_row"""
+        AccommodationOccupancy.objects.filter(accommodation_id=accommodation_id).update(**occupancy.row_values())
+
+    def _rebuild_one(self, accommodation_id):
+        # The lock is the first statement of the transaction, so the rows read by build()
+        # include every change committed by the previous holder (see lock_accommodations)
+        with transaction.atomic():
+            if self._lock_row(accommodation_id) is None:
+                metrics.incr('occupancy.missing_accommodation')
+                return None
+            occupancy = self.build(accommodation_id)
+            self._save(accommodation_id, occupancy)
+        return occupancy
+
+    def _load(self, accommodation_id):
+        with primary():
+            row = AccommodationOccupancy.objects.filter(accommodation_id=accommodation_id).first()
+        occupancy = Occupancy.from_row(row) if row is not None else None
+        if not self._current(occupancy):
+            # First use, or the window has moved on since the row was written
+            metrics.incr('occupancy.rebuilt')
+            occupancy = self._rebuild_one(accommodation_id) or self.build(accommodation_id)
+        return occupancy
+
+    def get(self, accommodation_id, loaded_only=False):
+        """The occupancy of an accommodation; with `loaded_only`, None unless it is in memory and fresh"""
+        entry = self._entries.get(accommodation_id)
+        if entry is None or (self.ttl and monotonic() - entry.loaded_at > self.ttl) \
+                or not self._current(entry):
+            if loaded_only:
+                return None
+            entry = self._load(accommodation_id)
+            with self._lock:
+                self._entries[accommodation_id] = entry
+        return entry
+
+    def is_free(self, accommodation_id, start, end, loaded_only=False):
+        """
+        True when no booked, pending or blocked day is touched by [start, end);
+        False when some is, or when the bitmaps cannot tell (disabled, outside the window)
+        """
+        if not self.enabled or not start < end:
+            return False
+        occupancy = self.get(accommodation_id, loaded_only)
+        if occupancy is None:
+            return False
+        first, last = local_days(start, end)
+        if not occupancy.covers(first, last):
+            metrics.incr('occupancy.outside_window')
+            return False
+        free = occupancy.is_free(first, last)
+        metrics.incr('occupancy.free' if free else 'occupancy.occupied')
+        return free
+
+    def day_statuses(self, accommodation_id, start, end):
+        """Calendar statuses from start to end (inclusive), None when the bitmaps cannot answer"""
+        if not self.enabled or timezone.get_current_timezone_name() != timezone.get_default_timezone_name():
+            return None
+        occupancy = self.get(accommodation_id)
+        if not occupancy.covers(start, end):
+            return None
+        return occupancy.day_statuses(start, end)
+
+    def apply(self, changes, rebuild=()):
+        """
+        Add the (accommodation_id, status, start, end, delta) changes to the stored
+        counts, in the current transaction and under a lock on each row; the
+        accommodations in `rebuild` are recomputed from their rows instead
+        """
+        rebuild = set(rebuild)
+        accommodation_ids = sorted({change[0] for change in changes} | rebuild)
+        with transaction.atomic():
+            for accommodation_id in accommodation_ids:
+                row = self._lock_row(accommodation_id)
+                if row is None:
+                    metrics.incr('occupancy.missing_accommodation')
+                    continue
+                occupancy = Occupancy.from_row(row) if row is not None else None
+                if accommodation_id in rebuild or not self._current(occupancy):
+                    # Built from the rows, which already include this transaction's write
+                    occupancy = self.build(accommodation_id)
+                else:
+                    for _, status, start, end, delta in (c for c in changes if c[0] == accommodation_id):
+                        occupancy.add(status, start, end, delta)
+                self._save(accommodation_id, occupancy)
+        # Dropped now and again after commit, so no request caches the state in between
+        self.invalidate(accommodation_ids)
+        transaction.on_commit(lambda: self.invalidate(accommodation_ids))
+
+    def record_change(self, old, new):
+        """Move a row from interval `old` to `new` (see interval_of)"""
+        if old == new:
+            return
+        changes, rebuild = [], set()
+        for interval, delta in ((old, -1), (new, 1)):
+            if interval is None:
+                continue
+            accommodation_id, status, start, end = interval
+            if status is None:
+                if accommodation_id is not None:
+                    rebuild.add(accommodation_id)
+            else:
+                changes.append((accommodation_id, status, start, end, delta))
+        self.apply(changes, rebuild)
+
+    def invalidate(self, accommodation_ids=None):
+        with self._lock:
+            if accommodation_ids is None:
+                self._entries.clear()
+            else:
+                for accommodation_id in accommodation_ids:
+                    self._entries.pop(accommodation_id, None)
+
+    def _ids(self, accommodation_ids):
+        if accommodation_ids is None:
+            return list(Accommodation.objects.order_by('id').values_list('id', flat=True))
+        return list(accommodation_ids)
+
+    def rebuild(self, accommodation_ids=None):
+        """Recompute and store the occupancy of the given accommodations (default: all of them)"""
+        accommodation_ids = self._ids(accommodation_ids)
+        for accommodation_id in accommodation_ids:
+            self._rebuild_one(accommodation_id)
+        self.invalidate(accommodation_ids)
+        return len(accommodation_ids)
+
+    def verify(self, accommodation_ids=None):
+        """Compare the stored counts against the rows and return the differences"""
+        accommodation_ids = self._ids(accommodation_ids)
+        with primary():
+            rows = {
+                row.accommodation_id: row
+                for row in AccommodationOccupancy.objects.filter(accommodation_id__in=accommodation_ids)
+            }
+        mismatches = []
+        for accommodation_id in accommodation_ids:
+            row = rows.get(accommodation_id)
+            stored = Occupancy.from_row(row) if row is not None else None
+            if not self._current(stored):
+                mismatches.append({'accommodation_id': accommodation_id, 'status': None, 'days': [],
+                                   'reason': 'missing' if stored is None else 'outdated or truncated'})
+                continue
+            expected = self.build(accommodation_id)
+            for status in STATUSES:
+                days = [
+                    (stored.origin + timedelta(days=index)).isoformat()
+                    for index, (have, want) in enumerate(zip(stored.counts[status], expected.counts[status]))
+                    if have != want
+                ]
+                if days:
+                    mismatches.append({'accommodation_id': accommodation_id, 'status': status, 'days': days,
+                                       'reason': 'counts differ'})
+        return mismatches
+
+
+occupancy_store = OccupancyStore()
@@ -0,0 +1,48 @@
+"""
+Keyset (cursor) pagination on the indexed orderings.
+
+Unlike PageNumberPagination there is no COUNT(*) and no OFFSET scan: each page
+is a range query starting from the position encoded in the cursor, so deep
+pages cost the same as the first one.
+"""
+from rest_framework.pagination import CursorPagination
+
+from .fast_serializers import paginate_rows, row_serializer_for
+
+
+class BaseCursorPagination(CursorPagination):
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class CreatedAtCursorPagination(BaseCursorPagination):
+    ordering = ('-created_at', '-id')
+
+
+class CheckInCursorPagination(BaseCursorPagination):
+    ordering = ('-check_in', '-id')
+
+
+class StartDateCursorPagination(BaseCursorPagination):
+    ordering = ('start_date', 'id')
+
+
+class IdCursorPagination(BaseCursorPagination):
+    ordering = ('id',)
+
+
+def paginated_response(view, queryset, serializer_class, pagination_class, fields=None):
+    """
+    Paginate a custom action's queryset with the given cursor pagination, through
+    the serializer's RowSerializer when it has one (bookings/fast_serializers.py).
+    `fields` restricts the output to a sparse fieldset.
+    """
+    paginator = pagination_class()
+    row_serializer = row_serializer_for(serializer_class, fields)
+    if row_serializer is not None:
+        data, _ = paginate_rows(paginator, row_serializer, queryset, view.request, view)
+        return paginator.get_paginated_response(data)
+    page = paginator.paginate_queryset(queryset, view.request, view=view)
+    kwargs = {} if fields is None else {'fields': fields}
+    serializer = serializer_class(page, many=True, context=view.get_serializer_context(), **kwargs)
+    return paginator.get_paginated_response(serializer.data)
@@ -32,8 +32,19 @@ class IsOwnerOrAdmin(permissions.BasePermission):
             return True
 
         # Check if user is the owner
-        if hasattr(obj, 'user'):
-            return obj.user == request.user
+        if hasattr(obj, 'user_id'):
+            return obj.user_id == request.user.id
 
         return False
 
+
+
+class IsAdmin(permissions.BasePermission):
+    """
+    Custom permission to only allow admins.
+    """
+    def has_permission(self, request, view):
+        if not request.user or not request.user.is_authenticated:
+            return False
+
+        return request.user.is_staff or (hasattr(request.user, 'role') and request.user.role.name == 'admin')
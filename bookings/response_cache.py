@@ -0,0 +1,153 @@
+"""
+Read-through cache for the accommodation read endpoints.
+
+Every accommodation has a generation counter stored in the cache, and every
+cached response key embeds the current generation. A write to a booking,
+blocked period, blocked weekday or to the accommodation itself bumps the
+counter (see bookings/signals.py), so all of its cached responses become
+unreachable at once without scanning keys; they then expire on their own.
+The accommodation list and slug lookups use a separate global generation
+bumped by any accommodation write.
+
+Works with the per-process LocMemCache (each worker then has its own copy and
+only sees the invalidations of its own writes, bounded by the TTL) and with a
+shared backend such as Redis or Memcached, where invalidations are global.
+"""
+import hashlib
+import time
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponseBase
+from rest_framework import status
+from rest_framework.response import Response
+
+from . import metrics
+from .db_router import primary
+
+KEY_PREFIX = 'acc_cache:'
+ALL_ACCOMMODATIONS = 'all'
+
+
+class AccommodationResponseCache:
+    """Cached response data per accommodation, invalidated by generation bumps"""
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'ACCOMMODATION_CACHE_ENABLED', False)
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'ACCOMMODATION_CACHE_TTL', 300)
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'ACCOMMODATION_CACHE_ALIAS', 'default')]
+
+    def _generation_key(self, scope):
+        return f'{KEY_PREFIX}gen:{scope}'
+
+    def generation(self, scope):
+        """Current generation of an accommodation id (or ALL_ACCOMMODATIONS)"""
+        key = self._generation_key(scope)
+        value = self.cache.get(key)
+        if value is None:
+            # Start from the clock rather than 1: if the counter was evicted, the
+            # responses cached under its old values must not become reachable again.
+            # add() keeps a value another process may have set in the meantime.
+            self.cache.add(key, time.time_ns(), timeout=None)
+            value = self.cache.get(key)
+        return value
+
+    def bump(self, scopes):
+        """Invalidate every cached response of the given accommodation ids / scopes"""
+        for scope in set(scopes):
+            key = self._generation_key(scope)
+            try:
+                self.cache.incr(key)
+            except ValueError:
+                # Missing (never read or evicted): a fresh clock-based value is a new generation
+                self.cache.add(key, time.time_ns(), timeout=None)
+            metrics.incr('cache.accommodation.invalidations')
+
+    def _key(self, scope, view, parts):
+        digest = hashlib.sha1(repr(parts).encode()).hexdigest()
+        return f'{KEY_PREFIX}{scope}:{self.generation(scope)}:{view}:{digest}'
+
+    def get_or_set(self, scope, view, parts, compute):
+        """
+        Return the cached value for (scope, view, parts), computing and storing
+        it on a miss. Without ACCOMMODATION_CACHE_ENABLED it only computes.
+        """
+        if not self.enabled:
+            return compute()
+        key, value = self._lookup(scope, view, parts)
+        if value is not None:
+            return value
+        # What is stored must not come from a replica lagging behind the last bump
+        with primary():
+            value = compute()
+        self._store(key, value)
+        return value
+
+    async def aget_or_set(self, scope, view, parts, compute):
+        """get_or_set() for async views: `compute` is a coroutine function"""
+        if not self.enabled:
+            return await compute()
+        key, value = await sync_to_async(self._lookup)(scope, view, parts)
+        if value is not None:
+            return value
+        with primary():
+            value = await compute()
+        await sync_to_async(self._store)(key, value)
+        return value
+
+    def _lookup(self, scope, view, parts):
+        key = self._key(scope, view, parts)
+        value = self.cache.get(key)
+        outcome = 'miss' if value is None else 'hit'
+        metrics.incr(f'cache.accommodation.{outcome}')
+        metrics.incr(f'cache.accommodation.{view}.{outcome}')
+        return key, value
+
+    def _store(self, key, value):
+        # Error responses are returned as they are, never stored
+        if value is not None and not isinstance(value, HttpResponseBase):
+            self.cache.set(key, value, timeout=self.timeout)
+
+    def response(self, scope, view, request, compute, extra=()):
+        """
+        Serve a cached 200 response. The key is the absolute URL (pagination
+        links contain it) plus `extra`; error responses are never stored.
+        """
+        def compute_data():
+            response = compute()
+            return response.data if response.status_code == status.HTTP_200_OK else response
+
+        result = self.get_or_set(scope, view, (request.build_absolute_uri(), *extra), compute_data)
+        if isinstance(result, Response):
+            return result
+        return Response(result)
+
+    def accommodation_id(self, slug, load):
+        """Map a slug to an accommodation id, cached under the global generation"""
+        return self.get_or_set(ALL_ACCOMMODATIONS, 'slug', (slug,), load)
+
+
+response_cache = AccommodationResponseCache()
+
+
+class AccommodationCacheMixin:
+    """ViewSet mixin serving list and retrieve from the cache, under the global generation"""
+
+    def list(self, request, *args, **kwargs):
+        return response_cache.response(
+            ALL_ACCOMMODATIONS, 'list', request, partial(super().list, request, *args, **kwargs)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return response_cache.response(
+            ALL_ACCOMMODATIONS, 'retrieve', request, partial(super().retrieve, request, *args, **kwargs)
+        )
@@ -3,7 +3,32 @@ from .models import (
     User, Role, Accommodation, Booking, BookingGuest,
     BlockedPeriod, BlockedWeekday, BookingAudit
 )
+from . import metrics
+from .availability import find_conflicts, lock_accommodations
+from datetime import date, datetime, time
 from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+
+def raise_for_conflicts(conflicts, counter='bookings.conflicts.validation'):
+    if not conflicts.available:
+        metrics.incr(counter)
+    if conflicts.bookings:
+        raise serializers.ValidationError("This period overlaps with an existing booking")
+    if conflicts.blocked_periods:
+        raise serializers.ValidationError("This period is blocked for bookings")
+    if conflicts.blocked_weekdays:
+        raise serializers.ValidationError("This period falls on a blocked weekday")
+
+
+class SparseFieldsMixin:
+    """Serializer mixin: the `fields` argument keeps only the named fields (see bookings/sparse_fields.py)"""
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
 
 
 class RoleSerializer(serializers.ModelSerializer):
@@ -77,7 +102,7 @@ class BookingGuestSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'booking', 'created_at', 'updated_at']
 
 
-class BookingSerializer(serializers.ModelSerializer):
+class BookingSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     accommodation_title = serializers.CharField(source='accommodation.title', read_only=True)
     user_email = serializers.CharField(source='user.email', read_only=True)
     guests_details = BookingGuestSerializer(source='guests', many=True, read_only=True)
@@ -93,38 +118,30 @@ class BookingSerializer(serializers.ModelSerializer):
         if attrs['check_out'] <= attrs['check_in']:
             raise serializers.ValidationError("Check-out must be after check-in")
 
-        # Check for overlapping bookings
-        accommodation = attrs['accommodation']
-        check_in = attrs['check_in']
-        check_out = attrs['check_out']
-
-        overlapping = Booking.objects.filter(
-            accommodation=accommodation,
-            status__in=['pending', 'confirmed']
-        ).filter(
-            check_in__lt=check_out,
-            check_out__gt=check_in
+        # Check for overlapping bookings and blocked periods, excluding the current booking if updating
+        conflicts = find_conflicts(
+            attrs['accommodation'].id, attrs['check_in'], attrs['check_out'],
+            exclude_booking_id=self.instance.id if self.instance else None
         )
-
-        # Exclude current booking if updating
-        if self.instance:
-            overlapping = overlapping.exclude(id=self.instance.id)
-
-        if overlapping.exists():
-            raise serializers.ValidationError("This period overlaps with an existing booking")
-
-        # Check for blocked periods
-        blocked_periods = BlockedPeriod.objects.filter(
-            accommodation=accommodation,
-            start_date__lt=check_out,
-            end_date__gt=check_in
-        )
-
-        if blocked_periods.exists():
-            raise serializers.ValidationError("This period is blocked for bookings")
+        raise_for_conflicts(conflicts)
 
         return attrs
 
+    def update(self, instance, validated_data):
+        accommodation = validated_data.get('accommodation', instance.accommodation)
+        with transaction.atomic():
+            # Re-check under the accommodation lock so concurrent writers cannot double-book
+            lock_accommodations([instance.accommodation_id, accommodation.id])
+            if validated_data.get('status', instance.status) in ('pending', 'confirmed'):
+                conflicts = find_conflicts(
+                    accommodation.id,
+                    validated_data.get('check_in', instance.check_in),
+                    validated_data.get('check_out', instance.check_out),
+                    exclude_booking_id=instance.id
+                )
+                raise_for_conflicts(conflicts, counter='bookings.conflicts.locked')
+            return super().update(instance, validated_data)
+
 
 class BookingCreateSerializer(serializers.ModelSerializer):
     guests_data = BookingGuestSerializer(many=True, required=False)
@@ -138,53 +155,48 @@ class BookingCreateSerializer(serializers.ModelSerializer):
         if attrs['check_out'] <= attrs['check_in']:
             raise serializers.ValidationError("Check-out must be after check-in")
 
-        # Check for overlapping bookings
-        accommodation = attrs['accommodation']
-        check_in = attrs['check_in']
-        check_out = attrs['check_out']
-
-        overlapping = Booking.objects.filter(
-            accommodation=accommodation,
-            status__in=['pending', 'confirmed']
-        ).filter(
-            check_in__lt=check_out,
-            check_out__gt=check_in
-        )
-
-        if overlapping.exists():
-            raise serializers.ValidationError("This period overlaps with an existing booking")
-
-        # Check for blocked periods
-        blocked_periods = BlockedPeriod.objects.filter(
-            accommodation=accommodation,
-            start_date__lt=check_out,
-            end_date__gt=check_in
-        )
-
-        if blocked_periods.exists():
-            raise serializers.ValidationError("This period is blocked for bookings")
+        # Check for overlapping bookings and blocked periods
+        conflicts = find_conflicts(attrs['accommodation'].id, attrs['check_in'], attrs['check_out'])
+        raise_for_conflicts(conflicts)
 
         return attrs
 
     def create(self, validated_data):
         guests_data = validated_data.pop('guests_data', [])
-        booking = Booking.objects.create(**validated_data)
-
-        # Create audit log
-        BookingAudit.objects.create(
-            booking=booking,
-            action='created',
-            actor_user=self.context.get('request').user if self.context.get('request') else None,
-            data_json={'status': booking.status}
-        )
+        accommodation = validated_data['accommodation']
+
+        with transaction.atomic():
+            # Only writers for the same accommodation wait here; validate() ran without
+            # the lock, so check again before inserting
+            lock_accommodations([accommodation.id])
+            conflicts = find_conflicts(accommodation.id, validated_data['check_in'], validated_data['check_out'])
+            raise_for_conflicts(conflicts, counter='bookings.conflicts.locked')
+
+            booking = Booking.objects.create(**validated_data)
 
-        # Create guests
-        for guest_data in guests_data:
-            BookingGuest.objects.create(booking=booking, **guest_data)
+            # Create guests
+            for guest_data in guests_data:
+                BookingGuest.objects.create(booking=booking, **guest_data)
 
         return booking
 
 
+class BulkBookingItemSerializer(serializers.Serializer):
+    """One booking of a bulk request; relations are resolved in batch by bookings.bulk"""
+    accommodation = serializers.IntegerField()
+    user = serializers.IntegerField(required=False, allow_null=True)
+    check_in = serializers.DateTimeField()
+    check_out = serializers.DateTimeField()
+    num_guests = serializers.IntegerField(required=False, default=1)
+    notes = serializers.CharField(required=False, allow_null=True, allow_blank=True)
+    guests_data = BookingGuestSerializer(many=True, required=False)
+
+    def validate(self, attrs):
+        if attrs['check_out'] <= attrs['check_in']:
+            raise serializers.ValidationError("Check-out must be after check-in")
+        return attrs
+
+
 class BlockedPeriodSerializer(serializers.ModelSerializer):
     accommodation_title = serializers.CharField(source='accommodation.title', read_only=True)
     created_by_email = serializers.CharField(source='created_by.email', read_only=True)
@@ -201,6 +213,31 @@ class BlockedPeriodSerializer(serializers.ModelSerializer):
         return attrs
 
 
+class DayOrDateTimeField(serializers.DateTimeField):
+    """A datetime, or a YYYY-MM-DD date meaning its local midnight"""
+
+    def to_internal_value(self, value):
+        if isinstance(value, str) and len(value.strip()) == 10:
+            try:
+                value = datetime.combine(date.fromisoformat(value.strip()), time.min)
+            except ValueError:
+                pass
+        return super().to_internal_value(value)
+
+
+class BlockedPeriodImportItemSerializer(serializers.Serializer):
+    """One blocked period of an import; the accommodation may come from the request (see bookings.blocked_import)"""
+    accommodation = serializers.IntegerField(required=False)
+    start_date = DayOrDateTimeField()
+    end_date = DayOrDateTimeField()
+    reason = serializers.CharField(max_length=255, required=False, allow_null=True, allow_blank=True)
+
+    def validate(self, attrs):
+        if attrs['end_date'] <= attrs['start_date']:
+            raise serializers.ValidationError("End date must be after start date")
+        return attrs
+
+
 class BlockedWeekdaySerializer(serializers.ModelSerializer):
     accommodation_title = serializers.CharField(source='accommodation.title', read_only=True)
     created_by_email = serializers.CharField(source='created_by.email', read_only=True)
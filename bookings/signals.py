@@ -0,0 +1,180 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+
+from . import statistics
+from .authentication import forget_user_state, revoke_tokens
+from .models import Accommodation, Booking, BookingGuest, BlockedPeriod, BlockedWeekday, User
+from .interval_index import availability_index
+from .occupancy import interval_of, occupancy_store
+from .response_cache import response_cache, ALL_ACCOMMODATIONS
+from .weekday_rules import weekday_rules
+
+# Set inside set_based_write(): the caller rebuilds the occupancy counts once
+_per_row_occupancy_skipped = ContextVar('per_row_occupancy_skipped', default=False)
+
+
+def mark_accommodations_changed(accommodation_ids):
+    """
+    Refresh derived availability data for writes that bypass model signals
+    (bulk_create, update, delete). Call it inside the write's transaction: the
+    occupancy counts are rebuilt there, under their row locks, and the
+    in-process copies are dropped once it commits.
+    """
+    accommodation_ids = set(accommodation_ids)
+    if occupancy_store.enabled:
+        occupancy_store.apply([], rebuild=accommodation_ids)
+    transaction.on_commit(lambda: availability_index.invalidate(accommodation_ids))
+    transaction.on_commit(lambda: weekday_rules.invalidate(accommodation_ids))
+    bump_accommodation_cache(accommodation_ids)
+
+
+@contextmanager
+def set_based_write():
+    """Skip the per-row occupancy updates of the signals; call mark_accommodations_changed afterwards"""
+    token = _per_row_occupancy_skipped.set(True)
+    try:
+        yield
+    finally:
+        _per_row_occupancy_skipped.reset(token)
+
+
+def bump_accommodation_cache(scopes):
+    """Invalidate the cached responses of the given accommodations once the transaction commits"""
+    scopes = set(scopes)
+    transaction.on_commit(lambda: response_cache.bump(scopes))
+
+
+@receiver(post_init, sender=Booking)
+@receiver(post_init, sender=BlockedPeriod)
+@receiver(post_init, sender=BlockedWeekday)
+def remember_accommodation(sender, instance, **kwargs):
+    # Rows moved to another accommodation invalidate the old one as well
+    instance._loaded_accommodation_id = instance.accommodation_id
+
+
+@receiver(post_save, sender=Booking)
+@receiver(post_delete, sender=Booking)
+@receiver(post_save, sender=BlockedPeriod)
+@receiver(post_delete, sender=BlockedPeriod)
+@receiver(post_save, sender=BlockedWeekday)
+@receiver(post_delete, sender=BlockedWeekday)
+def accommodation_data_changed(sender, instance, **kwargs):
+    scopes = {scope for scope in (instance.accommodation_id, instance._loaded_accommodation_id) if scope is not None}
+    bump_accommodation_cache(scopes)
+    if sender is BlockedWeekday:
+        transaction.on_commit(lambda: weekday_rules.invalidate(scopes))
+    instance._loaded_accommodation_id = instance.accommodation_id
+
+
+@receiver(post_save, sender=BookingGuest)
+@receiver(post_delete, sender=BookingGuest)
+def booking_guest_changed(sender, instance, **kwargs):
+    # Guests are part of the cached booking lists
+    if BookingGuest.booking.is_cached(instance):
+        accommodation_id = instance.booking.accommodation_id
+    else:
+        accommodation_id = Booking.objects.filter(id=instance.booking_id).values_list(
+            'accommodation_id', flat=True
+        ).first()
+    if accommodation_id is not None:
+        bump_accommodation_cache([accommodation_id])
+
+
+@receiver(post_save, sender=Accommodation)
+@receiver(post_delete, sender=Accommodation)
+def accommodation_changed(sender, instance, **kwargs):
+    bump_accommodation_cache([instance.id, ALL_ACCOMMODATIONS])
+
+
+@receiver(post_save, sender=Booking)
+def booking_saved(sender, instance, **kwargs):
+    values = (instance.id, instance.accommodation_id, instance.check_in, instance.check_out, instance.status)
+    transaction.on_commit(lambda: availability_index.upsert_booking(*values))
+
+
+@receiver(post_delete, sender=Booking)
+def booking_deleted(sender, instance, **kwargs):
+    booking_id = instance.id
+    transaction.on_commit(lambda: availability_index.discard_booking(booking_id))
+
+
+@receiver(post_save, sender=BlockedPeriod)
+def blocked_period_saved(sender, instance, **kwargs):
+    values = (instance.id, instance.accommodation_id, instance.start_date, instance.end_date)
+    transaction.on_commit(lambda: availability_index.upsert_blocked_period(*values))
+
+
+@receiver(post_delete, sender=BlockedPeriod)
+def blocked_period_deleted(sender, instance, **kwargs):
+    period_id = instance.id
+    transaction.on_commit(lambda: availability_index.discard_blocked_period(period_id))
+
+
+@receiver(post_init, sender=Booking)
+@receiver(post_init, sender=BlockedPeriod)
+def remember_interval(sender, instance, **kwargs):
+    if occupancy_store.enabled:
+        instance._loaded_interval = interval_of(instance)
+
+
+def _loaded_interval(instance):
+    # Loaded while the bitmaps were off: rebuild the accommodation it was loaded with
+    return getattr(instance, '_loaded_interval', (instance._loaded_accommodation_id, None, None, None))
+
+
+@receiver(post_save, sender=Booking)
+@receiver(post_save, sender=BlockedPeriod)
+def occupancy_saved(sender, instance, created, **kwargs):
+    # Inside the write's transaction: the stored day counts commit or roll back with it
+    if occupancy_store.enabled and not _per_row_occupancy_skipped.get():
+        new = interval_of(instance)
+        occupancy_store.record_change(None if created else _loaded_interval(instance), new)
+        instance._loaded_interval = new
+
+
+@receiver(post_delete, sender=Booking)
+@receiver(post_delete, sender=BlockedPeriod)
+def occupancy_deleted(sender, instance, **kwargs):
+    if occupancy_store.enabled and not _per_row_occupancy_skipped.get():
+        occupancy_store.record_change(_loaded_interval(instance), None)
+
+
+@receiver(post_save, sender=Accommodation)
+@receiver(post_save, sender=User)
+def counted_model_saved(sender, instance, created, **kwargs):
+    if created:
+        (statistics.record_accommodations if sender is Accommodation else statistics.record_users)(1)
+
+
+@receiver(post_delete, sender=Accommodation)
+@receiver(post_delete, sender=User)
+def counted_model_deleted(sender, instance, **kwargs):
+    (statistics.record_accommodations if sender is Accommodation else statistics.record_users)(-1)
+
+
+@receiver(post_init, sender=User)
+def remember_password(sender, instance, **kwargs):
+    # Not through the attribute: it would load a deferred column
+    instance._loaded_password_hash = instance.__dict__.get('password_hash')
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    if created:
+        return
+    # Deactivation and role changes reach stateless JWT requests
+    forget_user_state(instance.id)
+    loaded = instance._loaded_password_hash
+    if loaded is not None and instance.__dict__.get('password_hash') not in (None, loaded):
+        # In the same transaction, and on the instance so that a later save() keeps it
+        instance.tokens_valid_after = revoke_tokens(instance.id)
+    instance._loaded_password_hash = instance.__dict__.get('password_hash')
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    forget_user_state(instance.id)
@@ -0,0 +1,101 @@
+"""
+Sparse fieldsets (?fields=) and opt-in expansion (?expand=) of booking responses.
+
+`?fields=id,status,check_in,check_out` keeps only the named fields and
+`?expand=guests,accommodation,user` adds the related data (guests_details,
+accommodation_title, user_email). Once a request uses either parameter the
+related data is opt-in: it is returned when expanded or named in `fields`.
+Without them the full representation is returned, as before.
+
+The queryset joins and prefetches only the expanded relations, and the
+conditional GET version only covers them, so narrow requests run fewer and
+lighter queries.
+"""
+from rest_framework.exceptions import ValidationError
+
+from .conditional import VersionSpec
+
+FIELDS_PARAM = 'fields'
+EXPAND_PARAM = 'expand'
+
+
+class Expansion:
+    """The serializer fields of an expandable relation and what they read from the database"""
+
+    def __init__(self, fields, select_related=(), prefetch_related=(), timestamps=(), counts=()):
+        self.fields = fields
+        self.select_related = select_related
+        self.prefetch_related = prefetch_related
+        self.timestamps = timestamps
+        self.counts = counts
+
+
+BOOKING_EXPANSIONS = {
+    'guests': Expansion(
+        ['guests_details'], prefetch_related=['guests'], timestamps=['guests__updated_at'], counts=['guests']
+    ),
+    'accommodation': Expansion(
+        ['accommodation_title'], select_related=['accommodation'], timestamps=['accommodation__updated_at']
+    ),
+    'user': Expansion(['user_email'], select_related=['user'], timestamps=['user__updated_at']),
+}
+
+
+class FieldSelection:
+    """The fields of a response (None: all of them) and the expansions they need"""
+
+    def __init__(self, fields, expansions):
+        self.fields = fields
+        self.expansions = expansions
+
+    def apply(self, queryset):
+        """Join and prefetch the expanded relations only"""
+        select_related = [name for expansion in self.expansions for name in expansion.select_related]
+        prefetch_related = [name for expansion in self.expansions for name in expansion.prefetch_related]
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        return queryset
+
+    def version_spec(self, full_spec):
+        """The part of `full_spec` covering the selected data"""
+        if self.fields is None:
+            return full_spec
+        return VersionSpec(
+            timestamps=['updated_at', *(path for expansion in self.expansions for path in expansion.timestamps)],
+            counts=['id', *(path for expansion in self.expansions for path in expansion.counts)],
+        )
+
+
+def _names(value):
+    if value is None:
+        return None
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+def select_fields(query_params, serializer_class, expansions):
+    """Read ?fields= and ?expand= into a FieldSelection; unknown names are a 400"""
+    requested = _names(query_params.get(FIELDS_PARAM))
+    expand = _names(query_params.get(EXPAND_PARAM))
+    if requested is None and expand is None:
+        return FieldSelection(None, list(expansions.values()))
+
+    unknown = sorted(set(expand) - set(expansions)) if expand else []
+    if unknown:
+        raise ValidationError({EXPAND_PARAM: f"Unknown expansions: {', '.join(unknown)}. "
+                                             f"Available: {', '.join(expansions)}"})
+    readable = [name for name, field in serializer_class().fields.items() if not field.write_only]
+    unknown = sorted(set(requested) - set(readable)) if requested else []
+    if unknown:
+        raise ValidationError({FIELDS_PARAM: f"Unknown fields: {', '.join(unknown)}"})
+
+    related = {field: name for name, expansion in expansions.items() for field in expansion.fields}
+    if requested is None:
+        requested = [field for field in readable if field not in related]
+    expanded = set(expand or ()) | {related[field] for field in requested if field in related}
+    selected = set(requested) | {field for name in expanded for field in expansions[name].fields}
+    return FieldSelection(
+        tuple(field for field in readable if field in selected),
+        [expansion for name, expansion in expansions.items() if name in expanded],
+    )
@@ -0,0 +1,133 @@
+"""
+Booking statistics for the /api/statistics/ endpoint.
+
+In the default `aggregate` mode the status breakdown is one conditional
+aggregate over `bookings`. In `counters` mode the numbers live in the cache
+(use a shared backend such as Redis or Memcached when running several
+workers) and are adjusted by the BookingViewSet write paths, so reading them
+costs no query at all. `python manage.py reconcile_booking_statistics`
+recomputes them from the DB and corrects any drift.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .db_router import primary
+from .models import Accommodation, Booking, User
+
+BOOKING_STATUSES = [value for value, _ in Booking.STATUS_CHOICES]
+STATISTICS_KEYS = ['total_bookings', *BOOKING_STATUSES, 'total_accommodations', 'total_users']
+CACHE_PREFIX = 'booking_stats:'
+
+
+def _counters_enabled():
+    return getattr(settings, 'BOOKING_STATISTICS_MODE', 'aggregate') == 'counters'
+
+
+def _cache():
+    return caches[getattr(settings, 'BOOKING_STATISTICS_CACHE', 'default')]
+
+
+def compute_statistics():
+    """Read the statistics from the DB: one aggregate for bookings plus two counts"""
+    statistics = Booking.objects.aggregate(**_booking_aggregates())
+    statistics['total_accommodations'] = Accommodation.objects.count()
+    statistics['total_users'] = User.objects.count()
+    return {key: statistics[key] for key in STATISTICS_KEYS}
+
+
+def _booking_aggregates():
+    return {
+        'total_bookings': Count('id'),
+        **{booking_status: Count('id', filter=Q(status=booking_status)) for booking_status in BOOKING_STATUSES},
+    }
+
+
+async def acompute_statistics():
+    """compute_statistics() for async views, with the three queries awaited together"""
+    statistics, total_accommodations, total_users = await asyncio.gather(
+        Booking.objects.aaggregate(**_booking_aggregates()),
+        Accommodation.objects.acount(),
+        User.objects.acount(),
+    )
+    statistics['total_accommodations'] = total_accommodations
+    statistics['total_users'] = total_users
+    return {key: statistics[key] for key in STATISTICS_KEYS}
+
+
+def reconcile():
+    """Overwrite the counters with the DB values and return (statistics, drift)"""
+    statistics = compute_statistics()
+    cache = _cache()
+    current = cache.get_many([CACHE_PREFIX + key for key in STATISTICS_KEYS])
+    drift = {
+        key: current[CACHE_PREFIX + key] - value
+        for key, value in statistics.items()
+        if CACHE_PREFIX + key in current and current[CACHE_PREFIX + key] != value
+    }
+    cache.set_many({CACHE_PREFIX + key: value for key, value in statistics.items()}, timeout=None)
+    return statistics, drift
+
+
+def get_statistics():
+    if not _counters_enabled():
+        return compute_statistics()
+
+    values = _cache().get_many([CACHE_PREFIX + key for key in STATISTICS_KEYS])
+    if len(values) == len(STATISTICS_KEYS):
+        return {key: values[CACHE_PREFIX + key] for key in STATISTICS_KEYS}
+
+    # First read, or the cache was flushed: seed the counters from the DB (not a lagging replica)
+    with primary():
+        statistics, _ = reconcile()
+    return statistics
+
+
+async def aget_statistics():
+    if not _counters_enabled():
+        return await acompute_statistics()
+    return await sync_to_async(get_statistics)()
+
+
+def _adjust(deltas):
+    if not _counters_enabled():
+        return
+
+    def apply():
+        cache = _cache()
+        for key, delta in deltas.items():
+            try:
+                if delta > 0:
+                    cache.incr(CACHE_PREFIX + key, delta)
+                elif delta < 0:
+                    cache.decr(CACHE_PREFIX + key, -delta)
+            except ValueError:
+                # Not seeded yet: the next read loads every counter from the DB
+                pass
+
+    transaction.on_commit(apply)
+
+
+def record_bookings_created(booking_status='pending', count=1):
+    _adjust({'total_bookings': count, booking_status: count})
+
+
+def record_booking_deleted(booking_status):
+    _adjust({'total_bookings': -1, booking_status: -1})
+
+
+def record_status_change(previous_status, new_status):
+    if previous_status != new_status:
+        _adjust({previous_status: -1, new_status: 1})
+
+
+def record_accommodations(delta):
+    _adjust({'total_accommodations': delta})
+
+
+def record_users(delta):
+    _adjust({'total_users': delta})
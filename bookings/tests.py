@@ -1,3 +1,1632 @@
-from django.test import TestCase
+import json
+import tempfile
+import threading
+import time as clock
+import uuid
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from importlib.util import find_spec
+from io import BytesIO, StringIO
+from itertools import count
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.hashers import make_password
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import QuerySet
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework.utils.serializer_helpers import ReturnDict
+
+from booking_backend.mysql_pool.pool import ConnectionPool, PoolTimeout
+
+from . import async_views, metrics, serializers
+from .interval_index import IntervalSet, availability_index
+from .audit import AuditWriter
+from .archive import archive_audit, ensure_partitions, partitions_to_add
+from .statistics import CACHE_PREFIX as STATISTICS_PREFIX, compute_statistics
+from .blocked_import import merge_intervals
+from .availability import find_conflicts_many, lookup_conflicts
+from .occupancy import occupancy_store
+from .weekday_rules import WeekdayRules, overlap_filter, weekday_rules
+from .db_router import ReplicaRouter, primary
+from .middleware import ReplicaRoutingMiddleware
+from .renderers import FastJSONParser, FastJSONRenderer
+from .models import (
+    User, Role, Accommodation, AccommodationOccupancy, Booking, BookingGuest,
+    BlockedPeriod, BlockedWeekday, BookingAudit, BookingAuditArchive
+)
+
+
+class QueryBudgetTestCase(TestCase):
+    """
+    Every endpoint is requested once with a few rows and once with many more:
+    the number of queries must stay the same and within the endpoint's budget.
+    """
+    small = 2
+    large = 12
+
+    def setUp(self):
+        Role.objects.create(id=1, name='user')
+        Role.objects.create(id=2, name='admin')
+        self.sequence = count()
+        self.start = timezone.now()
+        self.admin = User.objects.create(email='admin@example.com', role_id=2, is_staff=True)
+        self.accommodation = Accommodation.objects.create(slug='villa-mare', title='Villa al Mare')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        weekday_rules.invalidate()
+
+    def count_queries(self, url, method='get', **kwargs):
+        # Test transactions never commit, so measure the worst case: index and rules rebuilt from the DB
+        availability_index.invalidate()
+        weekday_rules.invalidate()
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(url, **kwargs)
+        self.assertLess(response.status_code, 400, response.content)
+        return len(context)
+
+    def assertQueryBudget(self, url, add_rows, budget, method='get', **kwargs):
+        add_rows(self.small)
+        small = self.count_queries(url, method, **kwargs)
+        add_rows(self.large - self.small)
+        large = self.count_queries(url, method, **kwargs)
+        self.assertEqual(small, large, f'{url}: query count grows with the number of rows ({small} -> {large})')
+        self.assertLessEqual(large, budget, f'{url}: {large} queries, budget is {budget}')
+
+    def add_bookings(self, n, user=None, accommodation=None):
+        for _ in range(n):
+            i = next(self.sequence)
+            owner = user or User.objects.create(email=f'guest{i}@example.com')
+            booking = Booking.objects.create(
+                accommodation=accommodation or self.accommodation,
+                user=owner,
+                check_in=self.start + timedelta(days=3 * i),
+                check_out=self.start + timedelta(days=3 * i + 2),
+            )
+            BookingGuest.objects.create(booking=booking, full_name=f'Guest {i}')
+            BookingGuest.objects.create(booking=booking, full_name=f'Companion {i}')
+            BookingAudit.objects.create(booking=booking, action='created', actor_user=owner)
+
+    def add_blocked_periods(self, n):
+        for _ in range(n):
+            i = next(self.sequence)
+            BlockedPeriod.objects.create(
+                accommodation=self.accommodation,
+                created_by=User.objects.create(email=f'owner{i}@example.com'),
+                start_date=self.start + timedelta(days=3 * i),
+                end_date=self.start + timedelta(days=3 * i + 1),
+            )
+
+
+class BookingQueryBudgetTests(QueryBudgetTestCase):
+    def test_booking_list(self):
+        # page + guests; the ETag is hashed from the page, no aggregate over the table
+        self.assertQueryBudget('/api/bookings/', self.add_bookings, budget=2)
+
+    def test_booking_detail(self):
+        self.add_bookings(1)
+        booking = Booking.objects.get()
+        self.assertQueryBudget(
+            f'/api/bookings/{booking.id}/',
+            lambda n: [BookingGuest.objects.create(booking=booking, full_name='Extra') for _ in range(n)],
+            budget=2
+        )
+
+    def test_booking_list_next_page(self):
+        self.add_bookings(30)
+        first_page = self.client.get('/api/bookings/').json()
+        self.assertEqual(len(first_page['results']), 20)
+        with CaptureQueriesContext(connection) as context:
+            second_page = self.client.get(first_page['next']).json()
+        self.assertEqual(len(second_page['results']), 10)
+        self.assertLessEqual(len(context), 3)
+
+    def test_booking_guests(self):
+        self.add_bookings(1)
+        booking = Booking.objects.get()
+        self.assertQueryBudget(
+            f'/api/bookings/{booking.id}/guests/',
+            lambda n: [BookingGuest.objects.create(booking=booking, full_name='Extra') for _ in range(n)],
+            budget=3
+        )
+
+    def test_my_bookings(self):
+        self.assertQueryBudget('/api/users/my_bookings/', lambda n: self.add_bookings(n, user=self.admin), budget=2)
+
+    def test_booking_audit_log(self):
+        self.add_bookings(1)
+        booking = Booking.objects.get()
+        self.assertQueryBudget(
+            f'/api/bookings/{booking.id}/audit_log/',
+            lambda n: [
+                BookingAudit.objects.create(
+                    booking=booking, action='note',
+                    actor_user=User.objects.create(email=f'actor{next(self.sequence)}@example.com')
+                )
+                for _ in range(n)
+            ],
+            # booking + page + archive check on the last page
+            budget=4
+        )
+
+    def test_booking_list_not_modified(self):
+        self.add_bookings(3)
+        response = self.client.get('/api/bookings/')
+        etag = response['ETag']
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/bookings/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        # The page queries only: nothing aggregates the whole table
+        self.assertEqual(len(context), 2)
+        self.assertFalse([query['sql'] for query in context if 'MAX(' in query['sql'] or 'COUNT(' in query['sql']])
+
+        booking = Booking.objects.first()
+        BookingGuest.objects.create(booking=booking, full_name='Late arrival')
+        self.assertEqual(self.client.get('/api/bookings/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_booking_detail_not_modified(self):
+        self.add_bookings(1)
+        booking = Booking.objects.get()
+        response = self.client.get(f'/api/bookings/{booking.id}/')
+        response = self.client.get(f'/api/bookings/{booking.id}/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        booking.guests.first().delete()
+        response = self.client.get(f'/api/bookings/{booking.id}/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_booking_audit_list(self):
+        # page + archive check on the last page of the hot table
+        self.assertQueryBudget('/api/booking-audit/', self.add_bookings, budget=2)
+
+
+class AccommodationQueryBudgetTests(QueryBudgetTestCase):
+    def test_accommodation_bookings(self):
+        self.assertQueryBudget('/api/accommodations/villa-mare/bookings/', self.add_bookings, budget=3)
+
+    def test_accommodation_blocked_periods(self):
+        self.assertQueryBudget('/api/accommodations/villa-mare/blocked_periods/', self.add_blocked_periods, budget=2)
+
+    def test_accommodation_availability(self):
+        check_in = (self.start - timedelta(days=1)).isoformat().replace('+00:00', 'Z')
+        check_out = (self.start + timedelta(days=365)).isoformat().replace('+00:00', 'Z')
+        self.assertQueryBudget(
+            f'/api/accommodations/villa-mare/availability/?check_in={check_in}&check_out={check_out}',
+            lambda n: (self.add_bookings(n), self.add_blocked_periods(n)),
+            # accommodation + weekday rules + index (2) + conflicting rows (3)
+            budget=7
+        )
+
+
+class AccommodationSearchTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        # A Wednesday 15:00 to Friday 10:00, local time
+        wednesday = timezone.localdate() + timedelta(days=(2 - timezone.localdate().weekday()) % 7 + 7)
+        self.check_in = timezone.make_aware(datetime.combine(wednesday, time(15)))
+        self.check_out = self.check_in + timedelta(days=1, hours=19)
+
+    def add_accommodation(self, slug):
+        return Accommodation.objects.create(slug=slug, title=slug.title())
+
+    def book(self, accommodation, start, end, booking_status='pending'):
+        return Booking.objects.create(
+            accommodation=accommodation, user=self.admin, check_in=start, check_out=end, status=booking_status
+        )
+
+    def search(self, **params):
+        response = self.client.get('/api/accommodations/search/', {
+            'check_in': self.check_in.isoformat(), 'check_out': self.check_out.isoformat(), **params
+        })
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_conflicts_exclude_and_adjacent_ranges_do_not(self):
+        day = timedelta(days=1)
+        booked = self.add_accommodation('booked')
+        self.book(booked, self.check_in - day, self.check_in + timedelta(hours=1))
+        confirmed = self.add_accommodation('confirmed')
+        self.book(confirmed, self.check_out - timedelta(hours=1), self.check_out + day, 'confirmed')
+        cancelled = self.add_accommodation('cancelled')
+        self.book(cancelled, self.check_in, self.check_out, 'cancelled')
+        blocked = self.add_accommodation('blocked')
+        BlockedPeriod.objects.create(accommodation=blocked, start_date=self.check_in + timedelta(hours=2),
+                                     end_date=self.check_in + timedelta(hours=3))
+        weekday = self.add_accommodation('weekday')
+        BlockedWeekday.objects.create(accommodation=weekday, weekday=4, start_time=time(9), end_time=time(11))
+        other_weekday = self.add_accommodation('other-weekday')
+        BlockedWeekday.objects.create(accommodation=other_weekday, weekday=4, start_time=time(10), end_time=time(11))
+        # Ranges ending at check_in or starting at check_out touch without overlapping
+        adjacent = self.add_accommodation('adjacent')
+        self.book(adjacent, self.check_in - day, self.check_in)
+        self.book(adjacent, self.check_out, self.check_out + day, 'confirmed')
+        BlockedPeriod.objects.create(accommodation=adjacent, start_date=self.check_in - day, end_date=self.check_in)
+
+        slugs = [item['slug'] for item in self.search()['results']]
+        self.assertEqual(slugs, ['villa-mare', 'cancelled', 'other-weekday', 'adjacent'])
+        self.assertEqual([item['slug'] for item in self.search(q='adj')['results']], ['adjacent'])
+        self.assertEqual(
+            [item['slug'] for item in self.search(ids=f'{booked.id},{cancelled.id}')['results']], ['cancelled']
+        )
+        self.assertEqual(self.client.get('/api/accommodations/search/', {
+            'check_in': self.check_out.isoformat(), 'check_out': self.check_in.isoformat()
+        }).status_code, 400)
+
+    def test_pagination(self):
+        for i in range(24):
+            self.add_accommodation(f'casa-{i}')
+        first = self.search()
+        self.assertEqual((first['count'], len(first['results'])), (25, 20))
+        second = self.client.get(first['next']).json()
+        self.assertEqual(len(second['results']), 5)
+        ids = [item['id'] for item in first['results'] + second['results']]
+        self.assertEqual(ids, sorted(set(ids)))
+
+    def test_queries_do_not_grow_with_the_accommodations(self):
+        def add_accommodations(n):
+            for _ in range(n):
+                i = next(self.sequence)
+                accommodation = self.add_accommodation(f'casa-{i}')
+                if i % 2:
+                    self.book(accommodation, self.check_in, self.check_out)
+
+        self.assertQueryBudget(
+            '/api/accommodations/search/', add_accommodations, budget=2,
+            data={'check_in': self.check_in.isoformat(), 'check_out': self.check_out.isoformat()}
+        )
+
+
+class BlockedQueryBudgetTests(QueryBudgetTestCase):
+    def test_blocked_period_list(self):
+        self.assertQueryBudget('/api/blocked-periods/', self.add_blocked_periods, budget=1)
+
+    def test_blocked_weekday_list(self):
+        self.assertQueryBudget(
+            '/api/blocked-weekdays/',
+            lambda n: [
+                BlockedWeekday.objects.create(
+                    accommodation=self.accommodation, weekday=i % 7,
+                    created_by=User.objects.create(email=f'weekday{next(self.sequence)}@example.com')
+                )
+                for i in range(n)
+            ],
+            budget=2
+        )
+
+
+class UserQueryBudgetTests(QueryBudgetTestCase):
+    def test_user_list(self):
+        self.assertQueryBudget(
+            '/api/users/',
+            lambda n: [User.objects.create(email=f'user{next(self.sequence)}@example.com') for _ in range(n)],
+            budget=2
+        )
+
+
+@override_settings(ACCOMMODATION_CACHE_ENABLED=True)
+class AccommodationCacheTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        caches['default'].clear()
+        self.client.logout()
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json(), len(context)
+
+    def test_hit_costs_no_query(self):
+        self.add_bookings(3)
+        for url in ('/api/accommodations/', '/api/accommodations/villa-mare/',
+                    '/api/accommodations/villa-mare/bookings/', '/api/accommodations/villa-mare/calendar/'):
+            first, _ = self.get(url)
+            second, queries = self.get(url)
+            self.assertEqual(first, second)
+            self.assertEqual(queries, 0, url)
+
+    def test_write_invalidates_only_its_accommodation(self):
+        other = Accommodation.objects.create(slug='baita', title='Baita')
+        self.get('/api/accommodations/villa-mare/bookings/')
+        self.get('/api/accommodations/baita/bookings/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_bookings(1)
+        data, queries = self.get('/api/accommodations/villa-mare/bookings/')
+        self.assertEqual(len(data['results']), 1)
+        self.assertGreater(queries, 0)
+        _, queries = self.get('/api/accommodations/baita/bookings/')
+        self.assertEqual(queries, 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_bookings(1, accommodation=other)
+        data, _ = self.get('/api/accommodations/baita/bookings/')
+        self.assertEqual(len(data['results']), 1)
+
+    @override_settings(ACCOMMODATION_CACHE_ENABLED=False)
+    def test_disabled_cache_takes_the_version_from_the_object(self):
+        url = '/api/accommodations/villa-mare/'
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.json()['slug'], 'villa-mare')
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+
+@override_settings(BOOKING_AUDIT_MODE='sync')
+class BookingAuditTests(QueryBudgetTestCase):
+    def test_one_audit_row_per_event(self):
+        response = self.client.post('/api/bookings/', {
+            'accommodation': self.accommodation.id,
+            'check_in': self.start.isoformat(),
+            'check_out': (self.start + timedelta(days=2)).isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        booking = Booking.objects.get()
+        self.client.post(f'/api/bookings/{booking.id}/confirm/')
+        self.client.post(f'/api/bookings/{booking.id}/cancel/')
+        self.assertEqual(
+            list(BookingAudit.objects.order_by('id').values_list('action', 'actor_user_id')),
+            [('created', self.admin.id), ('confirmed', self.admin.id), ('cancelled', self.admin.id)]
+        )
+
+
+@override_settings(BOOKING_AUDIT_MODE='sync')
+class BookingLockTests(QueryBudgetTestCase):
+    def competing_writer(self, check_in):
+        """lock_accommodations, with a booking committed by another writer while this one waited"""
+        lock = serializers.lock_accommodations
+
+        def lock_after_competitor(accommodation_ids):
+            Booking.objects.create(
+                accommodation=self.accommodation, user=self.admin,
+                check_in=check_in, check_out=check_in + timedelta(days=2)
+            )
+            return lock(accommodation_ids)
+
+        return mock.patch.object(serializers, 'lock_accommodations', side_effect=lock_after_competitor)
+
+    def locked_conflicts(self):
+        return metrics.snapshot()['counters'].get('bookings.conflicts.locked', 0)
+
+    def test_create_checks_again_under_the_lock(self):
+        check_in = self.start + timedelta(days=10)
+        before = self.locked_conflicts()
+        with self.competing_writer(check_in):
+            response = self.client.post('/api/bookings/', {
+                'accommodation': self.accommodation.id,
+                'check_in': check_in.isoformat(),
+                'check_out': (check_in + timedelta(days=1)).isoformat(),
+            }, format='json')
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertIn('overlaps with an existing booking', response.content.decode())
+        self.assertEqual(self.locked_conflicts(), before + 1)
+
+    def test_update_checks_again_under_the_lock(self):
+        self.add_bookings(1)
+        booking = Booking.objects.get()
+        moved_to = self.start + timedelta(days=20)
+        with self.competing_writer(moved_to):
+            response = self.client.put(f'/api/bookings/{booking.id}/', {
+                'accommodation': self.accommodation.id,
+                'check_in': moved_to.isoformat(),
+                'check_out': (moved_to + timedelta(days=1)).isoformat(),
+            }, format='json')
+        self.assertEqual(response.status_code, 400, response.content)
+        booking.refresh_from_db()
+        self.assertEqual(booking.check_in, self.start)
+
+
+@override_settings(BOOKING_AUDIT_MODE='sync', OCCUPANCY_ENABLED=True)
+class BulkBookingTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        occupancy_store.invalidate()
+
+    def items(self):
+        day = self.start + timedelta(days=30)
+        return [
+            {'accommodation': self.accommodation.id, 'check_in': (day + timedelta(days=4 * i)).isoformat(),
+             'check_out': (day + timedelta(days=4 * i + 2)).isoformat(), 'guests_data': [{'full_name': f'Guest {i}'}]}
+            for i in range(3)
+        ]
+
+    def post(self, items, mode='atomic'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/bookings/bulk/', {'mode': mode, 'bookings': items}, format='json')
+
+    def assertCreated(self, response, count):
+        self.assertEqual(response.status_code, 201, response.content)
+        ids = [result['id'] for result in response.json()['results'] if result['status'] == 'created']
+        self.assertEqual(len(ids), count)
+        for booking in Booking.objects.filter(id__in=ids).prefetch_related('guests'):
+            self.assertEqual(len(booking.guests.all()), 1)
+            self.assertEqual(BookingAudit.objects.get(booking_id=booking.id).action, 'created')
+        self.assertEqual(availability_index.verify(), [])
+        self.assertEqual(occupancy_store.verify(), [])
+
+    def test_bulk_create_modes(self):
+        self.add_bookings(1)
+        items = self.items()
+        clashing = {
+            **items[0], 'check_in': self.start.isoformat(), 'check_out': (self.start + timedelta(days=1)).isoformat()
+        }
+        response = self.post([*items, clashing])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([result['status'] for result in response.json()['results']],
+                         ['skipped', 'skipped', 'skipped', 'error'])
+        self.assertEqual(Booking.objects.count(), 1)
+
+        self.assertCreated(self.post([*items, clashing], mode='best_effort'), 3)
+
+    def test_ids_read_back_without_returned_ids(self):
+        # As on MySQL: bulk_create cannot fill in the primary keys
+        queries = []
+        occupancy_store.rebuild([self.accommodation.id])
+        with mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+            for count in (2, 6):
+                Booking.objects.all().delete()
+                items = [
+                    {**item, 'check_in': (self.start + timedelta(days=50 + 4 * i)).isoformat(),
+                     'check_out': (self.start + timedelta(days=51 + 4 * i)).isoformat()}
+                    for i, item in enumerate(self.items() * 2)
+                ][:count]
+                with CaptureQueriesContext(connection) as context:
+                    response = self.post(items)
+                queries.append(len(context))
+                self.assertCreated(response, count)
+                self.assertEqual(
+                    [result['id'] for result in response.json()['results']],
+                    list(Booking.objects.order_by('check_in').values_list('id', flat=True))
+                )
+        self.assertEqual(queries[0], queries[1])
+
+
+@override_settings(BOOKING_AUDIT_MODE='deferred', BOOKING_AUDIT_BATCH_SIZE=3, BOOKING_AUDIT_FLUSH_INTERVAL=60)
+class AuditWriterTests(TestCase):
+    def setUp(self):
+        self.writer = AuditWriter()
+        self.batches = []
+        self.threads = set()
+        patcher = mock.patch.object(BookingAudit.objects, 'bulk_create', side_effect=self.bulk_create)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        exit_hooks = mock.patch('bookings.audit.atexit.register')
+        self.exit_hooks = exit_hooks.start()
+        self.addCleanup(exit_hooks.stop)
+
+    def bulk_create(self, entries, batch_size=None):
+        self.threads.add(threading.current_thread())
+        self.batches.append([entry.action for entry in entries])
+
+    def entries(self, n):
+        return [BookingAudit(booking_id=1, action=f'event{i}') for i in range(n)]
+
+    def record_many(self, entries):
+        # Queued only once the transaction commits
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.writer.record_many(entries)
+        self.assertEqual(len(callbacks), 1)
+
+    def wait_for_batches(self, n):
+        deadline = clock.monotonic() + 5
+        while len(self.batches) < n and clock.monotonic() < deadline:
+            clock.sleep(0.01)
+
+    def test_full_batches_are_written_by_the_background_thread(self):
+        self.record_many(self.entries(7))
+        self.wait_for_batches(2)
+        self.assertEqual(self.batches, [['event0', 'event1', 'event2'], ['event3', 'event4', 'event5']])
+        self.assertEqual(self.threads, {self.writer._thread})
+
+        self.assertTrue(self.writer.flush(5))
+        self.assertEqual(self.batches[2:], [['event6']])
+        self.assertTrue(self.writer.flush(5))
+        self.assertEqual(len(self.batches), 3)
+
+    @override_settings(BOOKING_AUDIT_FLUSH_INTERVAL=0.05)
+    def test_partial_batches_are_written_after_the_interval(self):
+        self.record_many([BookingAudit(booking_id=1, action='created')])
+        self.wait_for_batches(1)
+        self.assertEqual(self.batches, [['created']])
+
+    def test_queue_is_drained_at_exit(self):
+        self.record_many(self.entries(2))
+        self.exit_hooks.assert_called_once_with(self.writer.flush, 10)
+        flush, timeout = self.exit_hooks.call_args.args
+        self.assertTrue(flush(timeout))
+        self.assertEqual(self.batches, [['event0', 'event1']])
+
+    def test_background_write_errors_are_logged(self):
+        BookingAudit.objects.bulk_create.side_effect = RuntimeError('database gone')
+        with self.assertLogs('bookings.audit', 'ERROR'):
+            self.record_many(self.entries(1))
+            self.assertTrue(self.writer.flush(5))
+        # The thread survives and keeps writing
+        BookingAudit.objects.bulk_create.side_effect = self.bulk_create
+        self.record_many(self.entries(1))
+        self.assertTrue(self.writer.flush(5))
+        self.assertEqual(self.batches, [['event0']])
+
+    def test_background_thread_releases_its_connection_after_each_batch(self):
+        calls = []
+        BookingAudit.objects.bulk_create.side_effect = lambda entries, batch_size=None: calls.append('write')
+        with mock.patch('bookings.audit.close_old_connections', side_effect=lambda: calls.append('release')):
+            self.record_many(self.entries(1))
+            self.assertTrue(self.writer.flush(5))
+        self.assertEqual(calls, ['release', 'write', 'release'])
+
+    @override_settings(BOOKING_AUDIT_MODE='sync')
+    def test_sync_mode_writes_in_the_caller(self):
+        self.writer.record(1, 'created')
+        self.assertEqual(self.batches, [['created']])
+        self.assertEqual(self.threads, {threading.current_thread()})
+        self.assertIsNone(self.writer._thread)
+
+
+class BookingAuditArchiveTests(QueryBudgetTestCase):
+    def test_archived_entries_stay_readable(self):
+        self.add_bookings(3)
+        old = list(BookingAudit.objects.order_by('id')[:2])
+        BookingAudit.objects.filter(id__in=[entry.id for entry in old]).update(
+            created_at=self.start - timedelta(days=400)
+        )
+        self.assertEqual(archive_audit(self.start - timedelta(days=180), batch_size=1), 2)
+        self.assertEqual(BookingAudit.objects.count(), 1)
+        self.assertEqual(BookingAuditArchive.objects.count(), 2)
+
+        page = self.client.get('/api/booking-audit/?page_size=1').json()
+        ids = [entry['id'] for entry in page['results']]
+        while page['next']:
+            page = self.client.get(page['next']).json()
+            ids += [entry['id'] for entry in page['results']]
+        self.assertEqual(sorted(ids), sorted([*BookingAudit.objects.values_list('id', flat=True), *(e.id for e in old)]))
+
+        response = self.client.get(f'/api/booking-audit/{old[0].id}/')
+        self.assertEqual(response.json()['action'], 'created')
+        log = self.client.get(f'/api/bookings/{old[0].booking_id}/audit_log/').json()
+        self.assertEqual(log['results'], [])
+        self.assertEqual(self.client.get(log['next']).json()['results'][0]['id'], old[0].id)
+
+    def test_partitions_to_add(self):
+        existing = ['p2024_05', 'p2024_06', 'pmax']
+        cutoff = datetime(2024, 8, 31, 23, 30, tzinfo=dt_timezone(timedelta(hours=2)))
+        self.assertEqual(partitions_to_add(existing, cutoff), [
+            ('p2024_07', '2024-08-01'), ('p2024_08', '2024-09-01'), ('p2024_09', '2024-10-01'),
+        ])
+        self.assertEqual(partitions_to_add(existing, datetime(2024, 5, 3, tzinfo=dt_timezone.utc)), [])
+        self.assertEqual(partitions_to_add(['pmax'], datetime(2024, 12, 3, tzinfo=dt_timezone.utc)), [
+            ('p2024_12', '2025-01-01'), ('p2025_01', '2025-02-01'),
+        ])
+        # Nothing to split outside MySQL
+        self.assertEqual(ensure_partitions(self.start), [])
+
+
+class BookingExportTests(QueryBudgetTestCase):
+    def test_csv_has_one_line_per_guest(self):
+        self.add_bookings(3)
+        response = self.client.get('/api/bookings/export/?format=csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 1 + 3 * 2)
+
+    def test_ndjson_applies_the_list_filters(self):
+        self.add_bookings(3)
+        Booking.objects.filter(id=Booking.objects.order_by('id').first().id).update(status='confirmed')
+        response = self.client.get('/api/bookings/export/?format=ndjson&status=confirmed')
+        records = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([record['status'] for record in records], ['confirmed'])
+        self.assertEqual(len(records[0]['guests']), 2)
+
+
+class ICalendarFeedTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        caches['default'].clear()
+        self.client.logout()
+
+    @override_settings(ACCOMMODATION_CACHE_ENABLED=True)
+    def test_feed_is_cached_until_the_accommodation_changes(self):
+        self.add_bookings(2)
+        url = '/api/accommodations/villa-mare/ical.ics'
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'text/calendar; charset=utf-8')
+        self.assertEqual(response.content.decode().count('BEGIN:VEVENT'), 2)
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(context), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_blocked_periods(1)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content.decode().count('BEGIN:VEVENT'), 3)
+
+    def test_feed_is_not_cached_with_the_cache_disabled(self):
+        self.add_bookings(2)
+        url = '/api/accommodations/villa-mare/ical.ics'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # Another process wrote: no invalidation reaches this one
+        Booking.objects.filter(id=Booking.objects.order_by('id').first().id).update(status='cancelled')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content.decode().count('BEGIN:VEVENT'), 1)
+
+
+@override_settings(BOOKING_AUDIT_MODE='sync')
+class StatisticsTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        caches['default'].clear()
+
+    def statistics(self, queries):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/statistics/')
+        self.assertEqual(len(context), queries)
+        return response.json()
+
+    def test_aggregate(self):
+        self.add_bookings(3)
+        Booking.objects.filter(id=Booking.objects.order_by('id').first().id).update(status='confirmed')
+        statistics = self.statistics(queries=3)
+        self.assertEqual(statistics, {
+            'total_bookings': 3, 'pending': 2, 'confirmed': 1, 'cancelled': 0, 'rejected': 0,
+            'total_accommodations': 1, 'total_users': 4,
+        })
+
+    @override_settings(BOOKING_STATISTICS_MODE='counters')
+    def test_counters_follow_the_writes(self):
+        self.add_bookings(2)
+        # The first read seeds the counters from the DB
+        self.assertEqual(self.statistics(queries=3), compute_statistics())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/bookings/', {
+                'accommodation': self.accommodation.id,
+                'check_in': (self.start + timedelta(days=40)).isoformat(),
+                'check_out': (self.start + timedelta(days=42)).isoformat(),
+            }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/bookings/{Booking.objects.order_by("id").last().id}/confirm/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/bookings/{Booking.objects.order_by("id").first().id}/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Accommodation.objects.create(slug='baita', title='Baita')
+            User.objects.create(email='new@example.com')
+
+        statistics = self.statistics(queries=0)
+        self.assertEqual(statistics, compute_statistics())
+        self.assertEqual((statistics['total_bookings'], statistics['confirmed']), (2, 1))
+
+    @override_settings(BOOKING_STATISTICS_MODE='counters')
+    def test_reconcile_command_fixes_drift(self):
+        self.add_bookings(2)
+        self.statistics(queries=3)
+        caches['default'].set(STATISTICS_PREFIX + 'pending', 7, timeout=None)
+        output = StringIO()
+        call_command('reconcile_booking_statistics', stdout=output)
+        self.assertIn('pending: counter was off by +5, reset to 2', output.getvalue())
+        self.assertEqual(self.statistics(queries=0)['pending'], 2)
+
+        output = StringIO()
+        call_command('reconcile_booking_statistics', stdout=output)
+        self.assertIn('no drift', output.getvalue())
+
+
+@override_settings(JWT_STATELESS_AUTH=True)
+class StatelessJWTTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        caches['default'].clear()
+        self.admin.password_hash = make_password('secret')
+        self.admin.save()
+        self.client.force_authenticate(None)
+
+    def login(self, email='admin@example.com'):
+        response = self.client.post('/api/auth/login/', {'email': email, 'password': 'secret'})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def get_bookings(self, access):
+        return self.client.get('/api/bookings/', HTTP_AUTHORIZATION=f'Bearer {access}')
+
+    def count_bookings_queries(self, access):
+        with CaptureQueriesContext(connection) as context:
+            response = self.get_bookings(access)
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def test_requests_do_not_load_the_user(self):
+        guest = User.objects.create(email='guest@example.com', password_hash=make_password('secret'))
+        self.add_bookings(2, user=guest)
+        access = self.login('guest@example.com')['access']
+        self.get_bookings(access)
+        stateless = self.count_bookings_queries(access)
+        with override_settings(JWT_STATELESS_AUTH=False):
+            stateful = self.count_bookings_queries(access)
+        # The users row and the lazily loaded roles row
+        self.assertEqual(stateful - stateless, 2)
+        self.assertEqual(len(self.get_bookings(access).json()['results']), 2)
+
+    def test_deactivation_and_password_change_reject_the_token(self):
+        access = self.login()['access']
+        self.assertEqual(self.get_bookings(access).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.admin.is_active = False
+            self.admin.save()
+        self.assertEqual(self.get_bookings(access).status_code, 401)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.admin.is_active = True
+            self.admin.save()
+        self.assertEqual(self.get_bookings(access).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.admin.password_hash = make_password('changed')
+            self.admin.save()
+        self.assertEqual(self.get_bookings(access).status_code, 401)
+
+    def test_revocation_survives_the_cache(self):
+        access = self.login()['access']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.admin.password_hash = make_password('changed')
+            self.admin.save()
+        # Evicted, or never seen by this worker's cache
+        caches['default'].clear()
+        self.assertEqual(self.get_bookings(access).status_code, 401)
+        self.admin.display_name = 'Admin'
+        self.admin.save()
+        caches['default'].clear()
+        self.assertEqual(self.get_bookings(access).status_code, 401)
+        self.assertIsNotNone(User.objects.get(id=self.admin.id).tokens_valid_after)
+
+    def test_login_in_the_second_of_the_password_change(self):
+        stale = self.login()
+        # Revocation and re-login within the same whole second
+        with mock.patch('time.time', return_value=1_900_000_000.25):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.admin.password_hash = make_password('secret')
+                self.admin.save()
+        with mock.patch('time.time', return_value=1_900_000_000.75):
+            fresh = self.login()
+        self.assertEqual(self.get_bookings(stale['access']).status_code, 401)
+        self.assertEqual(self.get_bookings(fresh['access']).status_code, 200)
+        response = self.client.post('/api/auth/refresh/', {'refresh': fresh['refresh']})
+        self.assertEqual(response.status_code, 200, response.content)
+
+    def test_role_change_requires_a_refresh(self):
+        tokens = self.login()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.admin.is_staff = False
+            self.admin.role_id = 1
+            self.admin.save()
+        response = self.get_bookings(tokens['access'])
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()['code'], 'token_outdated')
+
+        access = self.client.post('/api/auth/refresh/', {'refresh': tokens['refresh']}).json()['access']
+        self.assertEqual(self.get_bookings(access).status_code, 200)
+        response = self.client.get('/api/users/me/', HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertEqual(response.json()['email'], 'admin@example.com')
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.alive = True
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def test_connections_are_reused_and_bounded(self):
+        pool = ConnectionPool(size=2, timeout=0.01, ping_after=0)
+        opened = []
+
+        def connect():
+            opened.append(FakeConnection())
+            return opened[-1]
+
+        def ping(connection):
+            return connection.alive
+
+        first = pool.acquire(connect, ping)
+        second = pool.acquire(connect, ping)
+        with self.assertRaises(PoolTimeout):
+            pool.acquire(connect, ping)
+
+        pool.release(first)
+        self.assertIs(pool.acquire(connect, ping), first)
+        self.assertEqual(len(opened), 2)
+
+        # Broken idle connections and discarded ones are closed and replaced
+        pool.release(first)
+        first.alive = False
+        self.assertIsNot(pool.acquire(connect, ping), first)
+        self.assertTrue(first.closed)
+        pool.release(second, discard=True)
+        self.assertTrue(second.closed)
+        self.assertIsNot(pool.acquire(connect, ping), second)
+        self.assertEqual(len(opened), 4)
+
+    def connect(self):
+        return FakeConnection()
+
+    def ping(self, connection):
+        return connection.alive
+
+    def test_exhausted_pool_waits_for_a_release(self):
+        pool = ConnectionPool(size=1, timeout=5)
+        first = pool.acquire(self.connect, self.ping)
+        release = threading.Timer(0.05, pool.release, [first])
+        started = clock.monotonic()
+        release.start()
+        self.assertIs(pool.acquire(self.connect, self.ping), first)
+        self.assertGreaterEqual(clock.monotonic() - started, 0.04)
+        release.join()
+
+    def test_exhausted_pool_times_out(self):
+        pool = ConnectionPool(size=1, timeout=0.05)
+        first = pool.acquire(self.connect, self.ping)
+        started = clock.monotonic()
+        with self.assertRaises(PoolTimeout):
+            pool.acquire(self.connect, self.ping)
+        self.assertGreaterEqual(clock.monotonic() - started, 0.04)
+        pool.release(first)
+        self.assertIs(pool.acquire(self.connect, self.ping), first)
+
+    def test_failed_connect_frees_its_slot(self):
+        pool = ConnectionPool(size=1, timeout=0.01)
+
+        def refuse():
+            raise OSError('connection refused')
+
+        with self.assertRaises(OSError):
+            pool.acquire(refuse, self.ping)
+        self.assertIsInstance(pool.acquire(self.connect, self.ping), FakeConnection)
+
+    def test_old_connections_are_recycled_and_recent_ones_not_pinged(self):
+        pool = ConnectionPool(size=1, timeout=0.01, ping_after=60)
+        ping = mock.Mock(return_value=False)
+        first = pool.acquire(self.connect, ping)
+        pool.release(first)
+        self.assertIs(pool.acquire(self.connect, ping), first)
+        ping.assert_not_called()
+
+        pool.release(first)
+        pool.recycle = 0
+        self.assertIsNot(pool.acquire(self.connect, ping), first)
+        self.assertTrue(first.closed)
+        ping.assert_not_called()
+
+    def test_released_twice_or_unknown_connections_are_closed(self):
+        pool = ConnectionPool(size=1, timeout=0.01)
+        first = pool.acquire(self.connect, self.ping)
+        pool.release(first)
+        pool.release(first)
+        self.assertTrue(first.closed)
+        stranger = FakeConnection()
+        pool.release(stranger)
+        self.assertTrue(stranger.closed)
+
+    @skipUnless(find_spec('MySQLdb'), 'mysqlclient is not installed')
+    def test_request_boundary_returns_the_connection(self):
+        from booking_backend.mysql_pool.base import DatabaseWrapper
+
+        wrapper = DatabaseWrapper({
+            'ENGINE': 'booking_backend.mysql_pool', 'NAME': 'booking', 'USER': '', 'PASSWORD': '', 'HOST': '',
+            'PORT': '', 'OPTIONS': {}, 'TIME_ZONE': None, 'AUTOCOMMIT': True, 'ATOMIC_REQUESTS': False,
+            'CONN_MAX_AGE': 600, 'CONN_HEALTH_CHECKS': False, 'POOL': {'SIZE': 1, 'TIMEOUT': 0.01},
+        }, alias=f'pool-test-{uuid.uuid4().hex}')
+        first = wrapper.pool.acquire(self.connect, self.ping)
+        wrapper.connection, wrapper.autocommit = first, True
+        # What close_old_connections() does on request_started / request_finished
+        wrapper.close_if_unusable_or_obsolete()
+        self.assertIsNone(wrapper.connection)
+        self.assertFalse(first.closed)
+        self.assertIs(wrapper.pool.acquire(self.connect, self.ping), first)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.router = ReplicaRouter()
+        self.middleware = ReplicaRoutingMiddleware(
+            lambda request: HttpResponse(self.router.db_for_read(Booking))
+        )
+
+    def read_db(self, method='get', token='a'):
+        request = getattr(RequestFactory(), method)('/api/bookings/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        return self.middleware(request).content.decode()
+
+    def test_reads_go_to_replicas_until_the_client_writes(self):
+        self.assertEqual(self.read_db(), 'replica')
+        self.assertEqual(self.read_db('post'), 'default')
+        # Pinned to the primary after its write; other clients are not
+        self.assertEqual(self.read_db(), 'default')
+        self.assertEqual(self.read_db(token='b'), 'replica')
+        # Outside requests and in cache fills everything reads from the primary
+        self.assertEqual(self.router.db_for_read(Booking), 'default')
+        with primary():
+            self.assertEqual(self.router.db_for_read(Booking), 'default')
+        self.assertEqual(self.router.db_for_write(Booking), 'default')
+
+
+class AsyncViewTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_bookings(2)
+        self.add_blocked_periods(2)
+        self.factory = RequestFactory()
+
+    def assertSameResponse(self, sync_response, async_view, request, **kwargs):
+        async_response = async_to_sync(async_view)(request, **kwargs)
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        self.assertEqual(async_response.content, sync_response.content)
+
+    def test_availability(self):
+        check_in = (self.start - timedelta(days=1)).isoformat().replace('+00:00', 'Z')
+        check_out = (self.start + timedelta(days=30)).isoformat().replace('+00:00', 'Z')
+        url = f'/api/accommodations/villa-mare/availability/?check_in={check_in}&check_out={check_out}'
+        self.assertSameResponse(
+            self.client.get(url), async_views.accommodation_availability, self.factory.get(url), slug='villa-mare'
+        )
+        url = '/api/accommodations/villa-mare/availability/'
+        self.assertSameResponse(
+            self.client.get(url), async_views.accommodation_availability, self.factory.get(url), slug='villa-mare'
+        )
+
+    def test_check_availability_and_statistics(self):
+        data = {
+            'accommodation_id': self.accommodation.id,
+            'check_in': self.start.isoformat(),
+            'check_out': (self.start + timedelta(days=1)).isoformat(),
+        }
+        self.assertSameResponse(
+            self.client.post('/api/check-availability/', data, format='json'),
+            async_views.check_availability,
+            self.factory.post('/api/check-availability/', data, content_type='application/json'),
+        )
+        self.assertSameResponse(
+            self.client.get('/api/statistics/'), async_views.booking_statistics, self.factory.get('/api/statistics/')
+        )
+
+
+class FastListSerializerTests(QueryBudgetTestCase):
+    def test_same_bytes_as_model_serializers(self):
+        self.add_bookings(3)
+        self.add_bookings(2, user=self.admin)
+        self.add_blocked_periods(2)
+        booking = Booking.objects.create(
+            accommodation=self.accommodation, user=None, status='confirmed', notes='Late arrival',
+            check_in=self.start - timedelta(days=10), check_out=self.start - timedelta(days=8),
+        )
+        BookingGuest.objects.create(booking=booking, full_name='Ospite', birth_date=date(1990, 5, 17))
+        BookingAudit.objects.create(booking=booking, action='imported', data_json={'source': 'ical', 'nights': [1, 2]})
+        BlockedPeriod.objects.create(
+            accommodation=self.accommodation, start_date=self.start, end_date=self.start + timedelta(days=1)
+        )
+        Accommodation.objects.create(slug='baita', title='Baita', description='In montagna')
+
+        for url in (
+            '/api/bookings/', '/api/bookings/?page_size=2', '/api/accommodations/', '/api/blocked-periods/',
+            '/api/booking-audit/', '/api/users/my_bookings/', '/api/accommodations/villa-mare/bookings/',
+            '/api/accommodations/villa-mare/blocked_periods/', f'/api/bookings/{booking.id}/audit_log/',
+        ):
+            fast = self.client.get(url)
+            with override_settings(FAST_LIST_SERIALIZERS=False):
+                stock = self.client.get(url)
+            self.assertEqual(fast.status_code, 200, fast.content)
+            self.assertEqual(fast.content, stock.content, url)
+
+
+class SparseFieldsTests(QueryBudgetTestCase):
+    def test_narrow_list_skips_joins_and_prefetch(self):
+        self.add_bookings(3, user=self.admin)
+        for fast in (True, False):
+            for url in (
+                '/api/bookings/?fields=id,status,check_in,check_out',
+                '/api/users/my_bookings/?fields=id,status,check_in,check_out',
+                '/api/accommodations/villa-mare/bookings/?fields=id,status,check_in,check_out',
+            ):
+                with override_settings(FAST_LIST_SERIALIZERS=fast), CaptureQueriesContext(connection) as context:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200, response.content)
+                for booking in response.json()['results']:
+                    self.assertEqual(list(booking), ['id', 'check_in', 'check_out', 'status'])
+                queries = [query['sql'] for query in context if 'bookings' in query['sql']]
+                self.assertFalse([sql for sql in queries if 'JOIN' in sql or 'booking_guests' in sql], url)
+
+    def test_expand(self):
+        self.add_bookings(2)
+        booking = self.client.get('/api/bookings/?expand=guests').json()['results'][0]
+        self.assertNotIn('user_email', booking)
+        self.assertNotIn('accommodation_title', booking)
+        self.assertEqual(len(booking['guests_details']), 2)
+        self.assertIn('notes', booking)
+
+        booking = self.client.get('/api/bookings/?fields=id,user_email&expand=accommodation').json()['results'][0]
+        self.assertEqual(list(booking), ['id', 'accommodation_title', 'user_email'])
+        detail = self.client.get(f"/api/bookings/{booking['id']}/?fields=id,status").json()
+        self.assertEqual(list(detail), ['id', 'status'])
+
+    def test_fields_with_ordering(self):
+        self.add_bookings(3)
+        first = self.client.get('/api/bookings/?fields=id&ordering=check_in&page_size=1')
+        self.assertEqual(first.status_code, 200, first.content)
+        second = self.client.get(first.json()['next']).json()
+        earliest = list(Booking.objects.order_by('check_in').values_list('id', flat=True)[:2])
+        self.assertEqual([first.json()['results'][0]['id'], second['results'][0]['id']], earliest)
+        self.assertEqual(list(second['results'][0]), ['id'])
+
+    def test_unknown_names(self):
+        self.assertEqual(self.client.get('/api/bookings/?fields=id,secret').status_code, 400)
+        self.assertEqual(self.client.get('/api/bookings/?expand=payments').status_code, 400)
+
+    def test_narrow_etag_changes_with_the_booking_only(self):
+        self.add_bookings(1)
+        url = '/api/bookings/?fields=id,status'
+        etag = self.client.get(url)['ETag']
+        BookingGuest.objects.create(booking=Booking.objects.get(), full_name='Late arrival')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Booking.objects.update(status='confirmed', updated_at=timezone.now() + timedelta(seconds=1))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class FindConflictsTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = Accommodation.objects.create(slug='casa-lago', title='Casa sul Lago')
+        monday = timezone.localdate() + timedelta(days=7 - timezone.localdate().weekday())
+        self.monday = timezone.make_aware(datetime.combine(monday, time(12)))
+
+    def at(self, days, hours=0):
+        return self.monday + timedelta(days=days, hours=hours)
+
+    def book(self, accommodation, start, end, booking_status='pending'):
+        return Booking.objects.create(
+            accommodation=accommodation, user=self.admin, check_in=start, check_out=end, status=booking_status
+        )
+
+    def test_many_ranges_in_one_query(self):
+        later = self.book(self.accommodation, self.at(1), self.at(3), 'confirmed')
+        earlier = self.book(self.accommodation, self.at(0), self.at(1))
+        self.book(self.accommodation, self.at(3), self.at(4))
+        period = BlockedPeriod.objects.create(accommodation=self.accommodation, start_date=self.at(2),
+                                              end_date=self.at(2, 1))
+        self.book(self.other, self.at(0), self.at(3), 'cancelled')
+        tuesday = BlockedWeekday.objects.create(accommodation=self.other, weekday=1)
+        BlockedWeekday.objects.create(accommodation=self.other, weekday=1, start_time=time(8), end_time=time(9))
+        BlockedWeekday.objects.create(accommodation=self.accommodation, weekday=5)
+
+        ranges = [
+            (self.accommodation.id, self.at(0), self.at(3)),
+            (self.accommodation.id, self.at(0), self.at(3), later.id),
+            (self.other.id, self.at(1, -2), self.at(1, 1)),
+            (self.other.id, self.at(2), self.at(3)),
+            (self.accommodation.id, self.at(4), self.at(4, 6)),
+        ]
+        with self.assertNumQueries(1):
+            results = find_conflicts_many(ranges)
+
+        self.assertEqual([r.booking_ids for r in results], [[earlier.id, later.id], [earlier.id], [], [], []])
+        self.assertEqual([r.blocked_period_ids for r in results], [[period.id], [period.id], [], [], []])
+        self.assertEqual([r.blocked_weekdays for r in results], [[], [], [tuesday.id], [], []])
+        self.assertEqual([r.available for r in results], [False, False, False, True, True])
+        self.assertEqual(results[0].bookings[0], (earlier.id, earlier.check_in, earlier.check_out))
+
+    def test_no_ranges_no_query(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(find_conflicts_many(iter([])), [])
+
+
+class AvailabilityIndexTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        # Entries loaded by other tests point at rows rolled back since
+        availability_index.invalidate()
+
+    def test_interval_set(self):
+        intervals = IntervalSet([(0, 10, 'a'), (2, 4, 'b'), (20, 30, 'c')])
+        self.assertTrue(intervals.overlaps(5, 6))
+        self.assertFalse(intervals.overlaps(10, 20))
+        self.assertEqual(intervals.overlapping(3, 21), [('a', 0, 10), ('b', 2, 4), ('c', 20, 30)])
+        self.assertTrue(intervals.remove('a'))
+        self.assertFalse(intervals.remove('a'))
+        self.assertFalse(intervals.overlaps(5, 6))
+        intervals.add(12, 14, 'd')
+        self.assertEqual(intervals.overlapping(5, 13), [('d', 12, 14)])
+
+    def test_writes_update_loaded_entries(self):
+        self.add_bookings(1)
+        booking = Booking.objects.get()
+        self.assertFalse(availability_index.is_available(self.accommodation.id, booking.check_in, booking.check_out))
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.status = 'cancelled'
+            booking.save()
+        self.assertTrue(availability_index.is_available(self.accommodation.id, booking.check_in, booking.check_out))
+        with self.captureOnCommitCallbacks(execute=True):
+            period = BlockedPeriod.objects.create(
+                accommodation=self.accommodation, start_date=booking.check_in, end_date=booking.check_out
+            )
+        self.assertEqual(
+            availability_index.conflicts(self.accommodation.id, booking.check_in, booking.check_out),
+            ([], [(period.id, period.start_date, period.end_date)])
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            period.delete()
+        self.assertEqual(availability_index.verify(), [])
+
+    @override_settings(AVAILABILITY_INDEX_ENABLED=True)
+    def test_lookup_uses_the_index_when_enabled(self):
+        self.add_bookings(1)
+        weekday_rules.get(self.accommodation.id)
+        availability_index.conflicts(self.accommodation.id, self.start, self.start)
+        with CaptureQueriesContext(connection) as context:
+            conflicts = lookup_conflicts(self.accommodation.id, self.start, self.start + timedelta(days=1))
+        self.assertEqual(len(context), 0)
+        self.assertEqual(conflicts.bookings_count, 1)
+        with override_settings(AVAILABILITY_INDEX_ENABLED=False), CaptureQueriesContext(connection) as context:
+            self.assertEqual(lookup_conflicts(self.accommodation.id, self.start, self.start).bookings_count, 0)
+        self.assertEqual(len(context), 1)
+
+    def test_load_racing_a_change_is_not_kept(self):
+        availability_index.invalidate()
+        load = availability_index._load
+        check_in = self.start + timedelta(days=5)
+
+        def load_then_commit(accommodation_id):
+            entry = load(accommodation_id)
+            # A booking committed after the rows were read
+            availability_index.upsert_booking(999, accommodation_id, check_in, check_in + timedelta(days=1), 'pending')
+            return entry
+
+        with mock.patch.object(availability_index, '_load', load_then_commit):
+            self.assertTrue(availability_index.is_available(self.accommodation.id, check_in, check_in))
+        self.assertNotIn(self.accommodation.id, availability_index.loaded())
+
+    def test_status_rejects_a_bad_accommodation(self):
+        response = self.client.get('/api/availability-index/?accommodation=abc')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(f'/api/availability-index/?accommodation={self.accommodation.id}')
+        self.assertTrue(response.json()['consistent'])
+
+
+@override_settings(OCCUPANCY_ENABLED=False, TIME_ZONE='Europe/Rome')
+class CalendarTests(QueryBudgetTestCase):
+    """Day statuses computed from the intervals, in local time"""
+
+    def local(self, *args):
+        return timezone.make_aware(datetime(*args))
+
+    def book(self, check_in, check_out, booking_status='pending'):
+        Booking.objects.create(
+            accommodation=self.accommodation, user=self.admin,
+            check_in=check_in, check_out=check_out, status=booking_status
+        )
+
+    def block(self, start_date, end_date):
+        BlockedPeriod.objects.create(accommodation=self.accommodation, start_date=start_date, end_date=end_date)
+
+    def calendar(self, start, end):
+        response = self.client.get('/api/accommodations/villa-mare/calendar/', {'start': start, 'end': end})
+        self.assertEqual(response.status_code, 200, response.content)
+        return {day['date']: day['status'] for day in response.json()['days']}
+
+    def test_spring_forward(self):
+        # 2026-03-29 has 23 hours; the check-out at local midnight leaves the 30th free
+        self.book(self.local(2026, 3, 28, 22), self.local(2026, 3, 30))
+        # 22:30 UTC on the 31st is already April 1st in Rome
+        self.book(datetime(2026, 3, 31, 22, 30, tzinfo=dt_timezone.utc),
+                  datetime(2026, 4, 1, 22, tzinfo=dt_timezone.utc), 'confirmed')
+        self.assertEqual(self.calendar('2026-03-27', '2026-04-02'), {
+            '2026-03-27': 'free',
+            '2026-03-28': 'pending',
+            '2026-03-29': 'pending',
+            '2026-03-30': 'free',
+            '2026-03-31': 'free',
+            '2026-04-01': 'booked',
+            '2026-04-02': 'free',
+        })
+
+    def test_fall_back(self):
+        # 2026-10-25 has 25 hours
+        self.book(self.local(2026, 10, 24, 23, 30), self.local(2026, 10, 25, 23, 30), 'confirmed')
+        self.block(self.local(2026, 10, 26), self.local(2026, 10, 27))
+        self.book(self.local(2026, 10, 27), self.local(2026, 10, 28, 0, 1))
+        self.assertEqual(self.calendar('2026-10-24', '2026-10-29'), {
+            '2026-10-24': 'booked',
+            '2026-10-25': 'booked',
+            '2026-10-26': 'blocked',
+            '2026-10-27': 'pending',
+            '2026-10-28': 'pending',
+            '2026-10-29': 'free',
+        })
+
+    def test_mixed_days(self):
+        self.book(self.local(2026, 5, 1, 15), self.local(2026, 5, 4, 10), 'confirmed')
+        self.book(self.local(2026, 5, 4, 15), self.local(2026, 5, 6, 10))
+        self.block(self.local(2026, 5, 3, 12), self.local(2026, 5, 5, 12))
+        self.book(self.local(2026, 5, 7), self.local(2026, 5, 8), 'cancelled')
+        self.assertEqual(self.calendar('2026-04-30', '2026-05-07'), {
+            '2026-04-30': 'free',
+            '2026-05-01': 'booked',
+            '2026-05-02': 'booked',
+            '2026-05-03': 'blocked',
+            '2026-05-04': 'blocked',
+            '2026-05-05': 'blocked',
+            '2026-05-06': 'pending',
+            '2026-05-07': 'free',
+        })
+        # Intervals that start before or end after the requested range are clipped to it
+        self.assertEqual(self.calendar('2026-05-02', '2026-05-02'), {'2026-05-02': 'booked'})
+
+
+@override_settings(OCCUPANCY_ENABLED=True)
+class OccupancyTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        occupancy_store.invalidate()
+
+    def calendar(self):
+        url = f'/api/accommodations/villa-mare/calendar/?start={timezone.localdate()}'
+        with_bitmaps = self.client.get(url).json()
+        with override_settings(OCCUPANCY_ENABLED=False):
+            self.assertEqual(self.client.get(url).json(), with_bitmaps)
+        return [day['status'] for day in with_bitmaps['days']]
+
+    def test_writes_keep_bitmaps_in_sync(self):
+        self.add_bookings(3)
+        self.add_blocked_periods(1)
+        BlockedWeekday.objects.create(accommodation=self.accommodation, weekday=2)
+        self.assertEqual(occupancy_store.verify(), [])
+        self.assertIn('pending', self.calendar())
+
+        booking = Booking.objects.order_by('id').first()
+        booking.status = 'confirmed'
+        booking.save()
+        moved = Booking.objects.order_by('id')[1]
+        moved.check_in += timedelta(days=20)
+        moved.check_out += timedelta(days=21)
+        moved.save()
+        Booking.objects.order_by('id').last().delete()
+        BlockedPeriod.objects.get().delete()
+        self.assertEqual(occupancy_store.verify(), [])
+        self.assertIn('booked', self.calendar())
+
+        row = AccommodationOccupancy.objects.get()
+        AccommodationOccupancy.objects.update(booked=bytes(len(row.booked)))
+        self.assertEqual(occupancy_store.verify()[0]['status'], 'booked')
+        with self.assertRaises(CommandError):
+            call_command('verify_occupancy', stdout=StringIO())
+        call_command('rebuild_occupancy', stdout=StringIO())
+        call_command('verify_occupancy', stdout=StringIO())
+
+    def test_first_writers_racing_keep_both_changes(self):
+        self.add_bookings(1)
+        AccommodationOccupancy.objects.all().delete()
+        check_in = self.start + timedelta(days=40)
+        # Another writer inserted and committed its row after this writer looked for it
+        create = AccommodationOccupancy.objects.create
+        create(accommodation_id=self.accommodation.id, **occupancy_store.build(self.accommodation.id).row_values())
+        first = QuerySet.first
+        missed = []
+
+        def first_missing_once(queryset):
+            if queryset.model is AccommodationOccupancy and not missed:
+                missed.append(queryset)
+                return None
+            return first(queryset)
+
+        with mock.patch.object(QuerySet, 'first', first_missing_once):
+            Booking.objects.create(
+                accommodation=self.accommodation, user=self.admin,
+                check_in=check_in, check_out=check_in + timedelta(days=2)
+            )
+        self.assertEqual(len(missed), 1)
+        self.assertEqual(occupancy_store.verify(), [])
+        self.assertFalse(occupancy_store.is_free(self.accommodation.id, check_in, check_in + timedelta(days=1)))
+
+    def test_rebuild_after_missing_row(self):
+        self.add_bookings(2)
+        AccommodationOccupancy.objects.all().delete()
+        self.assertEqual(occupancy_store.rebuild([self.accommodation.id]), 1)
+        self.assertEqual(occupancy_store.verify(), [])
+
+    @override_settings(OCCUPANCY_ENABLED=False)
+    def test_disabled_store_skips_the_instance_hooks(self):
+        self.add_bookings(1)
+        self.assertFalse(hasattr(Booking.objects.get(), '_loaded_interval'))
+        self.assertFalse(AccommodationOccupancy.objects.exists())
+
+    def test_free_range_needs_no_rows(self):
+        self.add_bookings(2)
+        occupancy_store.get(self.accommodation.id)
+        weekday_rules.get(self.accommodation.id)
+        free_from = self.start + timedelta(days=30)
+        with CaptureQueriesContext(connection) as context:
+            conflicts = lookup_conflicts(self.accommodation.id, free_from, free_from + timedelta(days=3))
+        self.assertTrue(conflicts.available)
+        self.assertEqual(len(context), 0)
+        conflicts = lookup_conflicts(self.accommodation.id, self.start, self.start + timedelta(days=1))
+        self.assertEqual(conflicts.bookings_count, 1)
+
+
+class WeekdayRuleTests(QueryBudgetTestCase):
+    def add_rule(self, weekday, start_time=None, end_time=None, accommodation=None):
+        return BlockedWeekday.objects.create(
+            accommodation=accommodation or self.accommodation, weekday=weekday,
+            start_time=start_time, end_time=end_time
+        )
+
+    def at(self, day, hour=0, minute=0):
+        return timezone.make_aware(datetime.combine(day, time(hour, minute)))
+
+    def test_rules_match_the_sql_filter(self):
+        self.add_rule(0)
+        self.add_rule(2, time(9), time(12))
+        self.add_rule(4, time(20))
+        self.add_rule(5, None, time(6))
+        self.add_rule(6, time(22), time(2))
+        monday = date(2026, 3, 2)
+        rules = weekday_rules.get(self.accommodation.id)
+        for start_hour in range(0, 24 * 8, 5):
+            for hours in (1, 3, 7, 20, 50, 24 * 7, 24 * 40):
+                start = self.at(monday) + timedelta(hours=start_hour)
+                end = start + timedelta(hours=hours)
+                expected = sorted(BlockedWeekday.objects.filter(
+                    overlap_filter(start, end), accommodation=self.accommodation
+                ).values_list('id', flat=True))
+                self.assertEqual(rules.conflicts(start, end), expected, (start, end))
+
+    def test_long_ranges_cost_the_same(self):
+        rules = WeekdayRules([(1, 3, time(10), time(11))])
+        start = self.at(date(2026, 3, 2))
+        self.assertEqual(rules.conflicts(start, start + timedelta(days=3)), [])
+        self.assertEqual(rules.conflicts(start, start + timedelta(days=3, hours=10, minutes=30)), [1])
+        self.assertEqual(rules.conflicts(start + timedelta(days=3, hours=11), start + timedelta(days=10)), [])
+        self.assertEqual(rules.conflicts(start, start + timedelta(days=3650)), [1])
+
+    def test_availability_and_validation_honor_rules(self):
+        wednesday = timezone.localdate() + timedelta(days=(2 - timezone.localdate().weekday()) % 7 + 7)
+        rule = self.add_rule(2, time(10), time(12))
+        check_in, check_out = self.at(wednesday, 11), self.at(wednesday, 15)
+
+        response = self.client.post('/api/check-availability/', {
+            'accommodation_id': self.accommodation.id, 'check_in': check_in, 'check_out': check_out
+        }, format='json').json()
+        self.assertFalse(response['available'])
+        self.assertEqual(response['blocked_weekdays_count'], 1)
+        response = self.client.get(
+            '/api/accommodations/villa-mare/availability/',
+            {'check_in': check_in.isoformat(), 'check_out': check_out.isoformat()}
+        ).json()
+        self.assertEqual([item['id'] for item in response['blocked_weekdays']], [rule.id])
+
+        response = self.client.get(
+            '/api/accommodations/search/',
+            {'check_in': check_in.isoformat(), 'check_out': check_out.isoformat()}
+        ).json()
+        self.assertEqual(response['results'], [])
+        response = self.client.get(
+            '/api/accommodations/search/',
+            {'check_in': self.at(wednesday, 12).isoformat(), 'check_out': check_out.isoformat()}
+        ).json()
+        self.assertEqual([item['slug'] for item in response['results']], ['villa-mare'])
+
+        response = self.client.post('/api/bookings/', {
+            'accommodation': self.accommodation.id, 'user': self.admin.id,
+            'check_in': check_in, 'check_out': check_out,
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('blocked weekday', str(response.json()))
+        response = self.client.post('/api/bookings/', {
+            'accommodation': self.accommodation.id, 'user': self.admin.id,
+            'check_in': self.at(wednesday, 12), 'check_out': check_out,
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+
+    @override_settings(AVAILABILITY_INDEX_ENABLED=False)
+    def test_db_path_counts_each_conflict_once(self):
+        self.add_bookings(1)
+        booking = Booking.objects.get()
+        conflicts = lookup_conflicts(self.accommodation.id, booking.check_in, booking.check_out)
+        self.assertEqual(conflicts.bookings_count, 1)
+        self.assertEqual(conflicts.booking_ids, [booking.id])
+        response = self.client.post('/api/check-availability/', {
+            'accommodation_id': self.accommodation.id, 'check_in': booking.check_in, 'check_out': booking.check_out
+        }, format='json').json()
+        self.assertEqual(response['conflicting_bookings_count'], 1)
+
+    def test_rule_changes_invalidate_compiled_rules(self):
+        start = self.at(date(2026, 3, 2))
+        self.assertTrue(lookup_conflicts(self.accommodation.id, start, start + timedelta(days=1)).available)
+        with self.captureOnCommitCallbacks(execute=True):
+            rule = self.add_rule(0)
+        conflicts = lookup_conflicts(self.accommodation.id, start, start + timedelta(days=1))
+        self.assertEqual(conflicts.blocked_weekdays, [rule.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            rule.delete()
+        self.assertTrue(lookup_conflicts(self.accommodation.id, start, start + timedelta(days=1)).available)
+
+
+class BlockedPeriodImportTests(QueryBudgetTestCase):
+    def day(self, day, hour=0):
+        return timezone.make_aware(datetime.combine(date(2026, 3, day), time(hour)))
+
+    def periods(self):
+        return list(BlockedPeriod.objects.order_by('start_date').values_list('start_date', 'end_date'))
+
+    def test_merge_intervals(self):
+        self.assertEqual(
+            merge_intervals([(5, 6, None), (1, 3, 'a'), (3, 4, 'b'), (2, 3, None), (8, 9, 'c')]),
+            [(1, 4, 'a'), (5, 6, None), (8, 9, 'c')]
+        )
+
+    def test_json_import_merges_with_existing_rows(self):
+        kept = BlockedPeriod.objects.create(
+            accommodation=self.accommodation, start_date=self.day(20), end_date=self.day(22)
+        )
+        BlockedPeriod.objects.create(accommodation=self.accommodation, start_date=self.day(1), end_date=self.day(3))
+        data = {'accommodation': self.accommodation.id, 'blocked_periods': [
+            {'start_date': '2026-03-02', 'end_date': '2026-03-05', 'reason': 'Lavori'},
+            {'start_date': '2026-03-05', 'end_date': '2026-03-06'},
+            {'start_date': '2026-03-10', 'end_date': '2026-03-11'},
+        ]}
+        response = self.client.post('/api/blocked-periods/import/', data, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['accommodations'][0], {
+            'accommodation': self.accommodation.id, 'received': 3, 'merged': 3,
+            'created': 2, 'deleted': 1, 'unchanged': 1,
+        })
+        self.assertEqual(self.periods(), [
+            (self.day(1), self.day(6)), (self.day(10), self.day(11)), (self.day(20), self.day(22))
+        ])
+        self.assertTrue(BlockedPeriod.objects.filter(id=kept.id).exists())
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post('/api/blocked-periods/import/', data, format='json').json()
+        self.assertEqual((response['created'], response['deleted']), (0, 0))
+        # accommodations + lock + existing rows
+        statements = [query['sql'] for query in context.captured_queries if 'SAVEPOINT' not in query['sql']]
+        self.assertEqual(len(statements), 3)
+
+    def test_csv_replace_and_errors(self):
+        BlockedPeriod.objects.create(accommodation=self.accommodation, start_date=self.day(1), end_date=self.day(3))
+        content = (
+            'accommodation,start_date,end_date,reason\n'
+            f'{self.accommodation.id},2026-03-10T10:00:00Z,2026-03-10T12:00:00Z,Manutenzione\n'
+        )
+        response = self.client.post('/api/blocked-periods/import/', {
+            'format': 'csv', 'content': content + f'{self.accommodation.id},2026-03-12,2026-03-11,\n',
+            'mode': 'replace',
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'][0]['index'], 1)
+        self.assertEqual(len(self.periods()), 1)
+
+        response = self.client.post('/api/blocked-periods/import/', {
+            'format': 'csv', 'content': content, 'mode': 'replace'
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        period = BlockedPeriod.objects.get()
+        self.assertEqual(period.reason, 'Manutenzione')
+        self.assertEqual(period.created_by, self.admin)
+
+    def test_ical_upload_and_command(self):
+        feed = '\r\n'.join([
+            'BEGIN:VCALENDAR', 'VERSION:2.0',
+            'BEGIN:VEVENT', 'DTSTART;VALUE=DATE:20260302', 'DTEND;VALUE=DATE:20260304', 'SUMMARY:Chiuso', 'END:VEVENT',
+            'BEGIN:VEVENT', 'DTSTART;TZID=Europe/Rome:20260304T000000', 'DURATION:PT12H', 'END:VEVENT',
+            'BEGIN:VEVENT', 'DTSTART:20260310T090000Z', 'DTEND:20260310T100000Z', 'STATUS:CANCELLED', 'END:VEVENT',
+            'BEGIN:VEVENT', 'DTSTART;VALUE=DATE:20260315', 'END:VEVENT',
+            'END:VCALENDAR', '',
+        ])
+        response = self.client.post('/api/blocked-periods/import/', {
+            'file': SimpleUploadedFile('airbnb.ics', feed.encode()), 'accommodation': self.accommodation.id,
+        }, format='multipart')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.periods(), [(self.day(2), self.day(4, 12)), (self.day(15), self.day(16))])
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = f'{directory.name}/blocked.json'
+        with open(path, 'w') as target:
+            json.dump([{'accommodation': self.accommodation.id, 'start_date': '2026-03-16', 'end_date': '2026-03-17'}],
+                      target)
+        output = StringIO()
+        call_command('import_blocked_periods', path, '--dry-run', stdout=output)
+        self.assertIn('1 created, 1 deleted', output.getvalue())
+        self.assertEqual(len(self.periods()), 2)
+        call_command('import_blocked_periods', path, stdout=StringIO())
+        self.assertEqual(self.periods()[-1], (self.day(15), self.day(17)))
+        with self.assertRaises(CommandError):
+            call_command('import_blocked_periods', path, '--format', 'ical', stdout=StringIO())
+
+    @override_settings(OCCUPANCY_ENABLED=True)
+    def test_import_updates_the_bitmaps_before_commit(self):
+        occupancy_store.invalidate()
+        base = timezone.localdate() + timedelta(days=10)
+
+        def day(offset):
+            return timezone.make_aware(datetime.combine(base + timedelta(days=offset), time.min))
+
+        for offset in (0, 2, 4):
+            BlockedPeriod.objects.create(
+                accommodation=self.accommodation, start_date=day(offset), end_date=day(offset + 1)
+            )
+        occupancy_store.get(self.accommodation.id)
+        self.assertTrue(occupancy_store.is_free(self.accommodation.id, day(10), day(12)))
+
+        with CaptureQueriesContext(connection) as context, self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post('/api/blocked-periods/import/', {
+                'accommodation': self.accommodation.id, 'mode': 'replace',
+                'blocked_periods': [{'start_date': day(10).isoformat(), 'end_date': day(12).isoformat()}],
+            }, format='json')
+        self.assertEqual(response.json()['deleted'], 3)
+        # Rebuilt inside the import's transaction, once for the three deleted rows
+        self.assertFalse(occupancy_store.is_free(self.accommodation.id, day(10), day(12)))
+        self.assertTrue(occupancy_store.is_free(self.accommodation.id, day(0), day(5)))
+        self.assertEqual(occupancy_store.verify(), [])
+        updates = [query for query in context.captured_queries if 'UPDATE "accommodation_occupancy"' in query['sql']]
+        self.assertEqual(len(updates), 1)
+
+        for callback in callbacks:
+            callback()
+        self.assertFalse(lookup_conflicts(self.accommodation.id, day(11), day(13)).available)
+
+    def test_content_type_and_permission(self):
+        url = '/api/blocked-periods/import/'
+        for data in (
+            {'format': 'csv', 'content': [{'start_date': '2026-03-02', 'end_date': '2026-03-03'}]},
+            {'format': 'ical', 'content': {'events': []}},
+            {'format': 'json', 'content': {'start_date': '2026-03-02'}},
+            {'format': 'json', 'blocked_periods': 5},
+        ):
+            response = self.client.post(url, data, format='json')
+            self.assertEqual(response.status_code, 400, data)
+            self.assertIn('content', response.json())
+
+        self.client.force_authenticate(User.objects.create(email='guest@example.com', role_id=1))
+        response = self.client.post(url, {'accommodation': self.accommodation.id, 'blocked_periods': [
+            {'start_date': '2026-03-02', 'end_date': '2026-03-03'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(BlockedPeriod.objects.exists())
+
+
+class FastJSONTests(SimpleTestCase):
+    def test_same_output_as_drf(self):
+        data = {
+            'utc': datetime(2026, 3, 1, 14, 0, 5, 120, tzinfo=dt_timezone.utc),
+            'rome': timezone.make_aware(datetime(2026, 3, 1, 14, 0)),
+            'naive': datetime(2026, 3, 1, 14, 0),
+            'date': date(2026, 3, 1),
+            'time': time(9, 30),
+            'decimal': Decimal('12.50'),
+            'uuid': uuid.UUID(int=1),
+            'lazy': gettext_lazy('Not found.'),
+            'text': 'Villa è bella\u2028',
+            1: [None, True, 1.5, ReturnDict({'a': 1}, serializer=None)],
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+
+    def test_parser(self):
+        self.assertEqual(FastJSONParser().parse(BytesIO('{"a": [1, "è"]}'.encode())), {'a': [1, 'è']})
+        with self.assertRaises(ParseError):
+            FastJSONParser().parse(BytesIO(b'{"a": NaN}'))
@@ -1,11 +1,14 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
     UserViewSet, RoleViewSet, AccommodationViewSet,
     BookingViewSet, BookingGuestViewSet, BlockedPeriodViewSet,
     BlockedWeekdayViewSet, BookingAuditViewSet,
-    check_availability, booking_statistics
+    check_availability, booking_statistics, availability_index_status,
+    metrics_snapshot
 )
+from . import async_views
 
 router = DefaultRouter()
 router.register(r'users', UserViewSet, basename='user')
@@ -17,9 +20,23 @@ router.register(r'blocked-periods', BlockedPeriodViewSet, basename='blocked-peri
 router.register(r'blocked-weekdays', BlockedWeekdayViewSet, basename='blocked-weekday')
 router.register(r'booking-audit', BookingAuditViewSet, basename='booking-audit')
 
+if getattr(settings, 'ASYNC_VIEWS_ENABLED', False):
+    # Same URLs and responses, served without a thread per request under ASGI
+    check_availability = async_views.check_availability
+    booking_statistics = async_views.booking_statistics
+    async_urlpatterns = [
+        path('accommodations/<slug:slug>/availability/', async_views.accommodation_availability,
+             name='accommodation-availability'),
+    ]
+else:
+    async_urlpatterns = []
+
 urlpatterns = [
+    *async_urlpatterns,
     path('', include(router.urls)),
     path('check-availability/', check_availability, name='check-availability'),
     path('statistics/', booking_statistics, name='statistics'),
+    path('availability-index/', availability_index_status, name='availability-index'),
+    path('metrics/', metrics_snapshot, name='metrics'),
 ]
 
@@ -2,7 +2,12 @@ from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
-from datetime import datetime
+from django.db.models import Exists, OuterRef
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils import timezone
+from datetime import datetime, date, time, timedelta
+from functools import cached_property, partial
 from .models import (
     User, Role, Accommodation, Booking, BookingGuest,
     BlockedPeriod, BlockedWeekday, BookingAudit
@@ -13,7 +18,136 @@ from .serializers import (
     BlockedWeekdaySerializer, BookingAuditSerializer, UserRegistrationSerializer,
     BookingCreateSerializer, AvailabilityCheckSerializer
 )
-from .permissions import IsAdminOrReadOnly, IsOwnerOrAdmin
+from .permissions import IsAdminOrReadOnly, IsOwnerOrAdmin, IsAdmin
+from .pagination import (
+    CreatedAtCursorPagination, CheckInCursorPagination, StartDateCursorPagination,
+    IdCursorPagination, paginated_response
+)
+from .interval_index import availability_index
+from .occupancy import occupancy_store
+from .weekday_rules import overlap_filter, weekday_rules
+from .fast_serializers import FastListMixin, row_serializer_for
+from .filters import filter_bookings
+from .sparse_fields import BOOKING_EXPANSIONS, select_fields
+from .ical import CONTENT_TYPE as ICAL_CONTENT_TYPE, ICalendarRenderer, cached_feed
+from .export import CSVRenderer, NDJSONRenderer, EXPORT_CONTENT_TYPES, iter_export
+from .availability import lookup_conflicts
+from .response_cache import response_cache, AccommodationCacheMixin, ALL_ACCOMMODATIONS
+from .conditional import (
+    ConditionalGetMixin, ACCOMMODATION_VERSION, BOOKING_VERSION, USER_VERSION,
+    instance_version, not_modified, set_validators
+)
+from . import archive, audit, blocked_import, bulk, metrics, statistics
+
+
+CALENDAR_DEFAULT_DAYS = 90
+CALENDAR_MAX_DAYS = 366
+CALENDAR_STATUSES = ('blocked', 'booked', 'pending')
+
+
+def build_calendar(accommodation_id, start, end):
+    """Compute the status of every local day between start and end (inclusive)"""
+    statuses = occupancy_store.day_statuses(accommodation_id, start, end)
+    if statuses is None:
+        statuses = _interval_statuses(accommodation_id, start, end)
+
+    # A day with a weekday rule is shown as blocked, even when the rule covers part of it
+    blocked_weekdays = weekday_rules.get(accommodation_id).weekdays
+
+    days = []
+    for index, day_status in enumerate(statuses):
+        day = start + timedelta(days=index)
+        if day.weekday() in blocked_weekdays:
+            day_status = 'blocked'
+        days.append({'date': day, 'status': day_status})
+    return days
+
+
+def _interval_statuses(accommodation_id, start, end):
+    """Status of every local day between start and end, from the bookings and blocked periods"""
+    num_days = (end - start).days + 1
+    range_start = timezone.make_aware(datetime.combine(start, time.min))
+    range_end = timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min))
+
+    # One difference array per status: +1 on the first day an interval touches,
+    # -1 on the day after the last one, then a single running sum over the range
+    deltas = {key: [0] * (num_days + 1) for key in CALENDAR_STATUSES}
+
+    def mark(key, interval_start, interval_end):
+        first = timezone.localtime(interval_start).date()
+        local_end = timezone.localtime(interval_end)
+        last = local_end.date() if local_end.time() != time.min else local_end.date() - timedelta(days=1)
+        first_index = max((first - start).days, 0)
+        last_index = min((last - start).days, num_days - 1)
+        if first_index <= last_index:
+            deltas[key][first_index] += 1
+            deltas[key][last_index + 1] -= 1
+
+    bookings = Booking.objects.filter(
+        accommodation_id=accommodation_id,
+        status__in=['pending', 'confirmed'],
+        check_in__lt=range_end,
+        check_out__gt=range_start
+    ).values_list('check_in', 'check_out', 'status')
+    for check_in, check_out, booking_status in bookings:
+        mark('booked' if booking_status == 'confirmed' else 'pending', check_in, check_out)
+
+    blocked_periods = BlockedPeriod.objects.filter(
+        accommodation_id=accommodation_id,
+        start_date__lt=range_end,
+        end_date__gt=range_start
+    ).values_list('start_date', 'end_date')
+    for start_date, end_date in blocked_periods:
+        mark('blocked', start_date, end_date)
+
+    statuses = []
+    running = dict.fromkeys(CALENDAR_STATUSES, 0)
+    for index in range(num_days):
+        for key in CALENDAR_STATUSES:
+            running[key] += deltas[key][index]
+
+        if running['blocked']:
+            day_status = 'blocked'
+        elif running['booked']:
+            day_status = 'booked'
+        elif running['pending']:
+            day_status = 'pending'
+        else:
+            day_status = 'free'
+        statuses.append(day_status)
+    return statuses
+
+
+def parse_range(params):
+    """Read check_in/check_out ISO datetimes, returning (check_in, check_out, error_message)"""
+    check_in = params.get('check_in')
+    check_out = params.get('check_out')
+
+    if not check_in or not check_out:
+        return None, None, 'check_in and check_out parameters are required'
+
+    try:
+        check_in_dt = datetime.fromisoformat(check_in.replace('Z', '+00:00'))
+        check_out_dt = datetime.fromisoformat(check_out.replace('Z', '+00:00'))
+    except ValueError:
+        return None, None, 'Invalid date format. Use ISO format'
+
+    return check_in_dt, check_out_dt, None
+
+
+def booking_queryset(selection=None):
+    """
+    Bookings with everything BookingSerializer reads (or only the relations of the
+    `selection` of its fields), loaded in a constant number of queries
+    """
+    if selection is not None:
+        return selection.apply(Booking.objects.all())
+    return Booking.objects.select_related('accommodation', 'user').prefetch_related('guests')
+
+
+def booking_selection(request):
+    """The ?fields= / ?expand= selection of a booking list or detail"""
+    return select_fields(request.query_params, BookingSerializer, BOOKING_EXPANSIONS)
 
 
 class RoleViewSet(viewsets.ReadOnlyModelViewSet):
@@ -23,7 +157,7 @@ class RoleViewSet(viewsets.ReadOnlyModelViewSet):
 
 
 class UserViewSet(viewsets.ModelViewSet):
-    queryset = User.objects.all()
+    queryset = User.objects.select_related('role').order_by('id')
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated]
 
@@ -37,16 +171,27 @@ class UserViewSet(viewsets.ModelViewSet):
             return UserRegistrationSerializer
         return UserSerializer
 
+    def current_user(self):
+        """The User row of the request (stateless JWT requests only carry a ClaimsUser)"""
+        if isinstance(self.request.user, User):
+            return self.request.user
+        return self.get_queryset().get(id=self.request.user.id)
+
     @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
     def me(self, request):
         """Get current user profile"""
-        serializer = self.get_serializer(request.user)
-        return Response(serializer.data)
+        user = self.current_user()
+        version = instance_version(user, USER_VERSION)
+        response = not_modified(request, version)
+        if response is not None:
+            return response
+        serializer = self.get_serializer(user)
+        return set_validators(Response(serializer.data), request, version)
 
     @action(detail=False, methods=['put', 'patch'], permission_classes=[IsAuthenticated])
     def update_profile(self, request):
         """Update current user profile"""
-        serializer = self.get_serializer(request.user, data=request.data, partial=True)
+        serializer = self.get_serializer(self.current_user(), data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
         serializer.save()
         return Response(serializer.data)
@@ -54,136 +199,324 @@ class UserViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
     def my_bookings(self, request):
         """Get all bookings for the current user"""
-        bookings = Booking.objects.filter(user=request.user).order_by('-created_at')
-        serializer = BookingSerializer(bookings, many=True)
-        return Response(serializer.data)
+        selection = booking_selection(request)
+        bookings = booking_queryset(selection).filter(user_id=request.user.id)
+        return paginated_response(
+            self, bookings, BookingSerializer, CreatedAtCursorPagination, fields=selection.fields
+        )
 
 
-class AccommodationViewSet(viewsets.ModelViewSet):
+class AccommodationViewSet(ConditionalGetMixin, AccommodationCacheMixin, FastListMixin, viewsets.ModelViewSet):
     queryset = Accommodation.objects.all()
     serializer_class = AccommodationSerializer
     permission_classes = [IsAdminOrReadOnly]
     lookup_field = 'slug'
+    version_spec = ACCOMMODATION_VERSION
 
-    @action(detail=True, methods=['get'])
-    def availability(self, request, slug=None):
-        """Check availability for a specific accommodation"""
-        accommodation = self.get_object()
-        check_in = request.query_params.get('check_in')
-        check_out = request.query_params.get('check_out')
+    @property
+    def version_from_object(self):
+        # Cache hits do not load the object; without the cache retrieve loads it anyway
+        return not response_cache.enabled
 
-        if not check_in or not check_out:
-            return Response(
-                {'error': 'check_in and check_out parameters are required'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+    def object_version(self):
+        return response_cache.get_or_set(
+            ALL_ACCOMMODATIONS, 'object_version', (self.kwargs[self.lookup_field],), super().object_version
+        )
 
-        try:
-            check_in_dt = datetime.fromisoformat(check_in.replace('Z', '+00:00'))
-            check_out_dt = datetime.fromisoformat(check_out.replace('Z', '+00:00'))
-        except ValueError:
+    def _cached_response(self, view, request, compute, extra=()):
+        """Serve a detail action from the cache of its accommodation"""
+        if not response_cache.enabled:
+            return compute()
+        slug = self.kwargs[self.lookup_field]
+        accommodation_id = response_cache.accommodation_id(
+            slug, lambda: Accommodation.objects.filter(slug=slug).values_list('id', flat=True).first()
+        )
+        if accommodation_id is None:
+            return compute()
+        return response_cache.response(accommodation_id, view, request, compute, extra)
+
+    def _parse_range(self, request):
+        """Read check_in/check_out query params, returning (check_in, check_out, error_response)"""
+        check_in, check_out, error = parse_range(request.query_params)
+        if error:
+            return None, None, Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+        return check_in, check_out, None
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """List the accommodations that are free for the whole check_in/check_out range"""
+        check_in, check_out, error = self._parse_range(request)
+        if error:
+            return error
+        if check_out <= check_in:
             return Response(
-                {'error': 'Invalid date format. Use ISO format'},
+                {'error': 'Check-out must be after check-in'},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Check for overlapping bookings
+        # Anti-joins on idx_bookings_accom_dates / idx_blocked_accom_dates / idx_blocked_weekdays_accom:
+        # the number of queries stays the same (count + page) however many accommodations there are
         overlapping_bookings = Booking.objects.filter(
-            accommodation=accommodation,
+            accommodation=OuterRef('pk'),
             status__in=['pending', 'confirmed'],
-            check_in__lt=check_out_dt,
-            check_out__gt=check_in_dt
+            check_in__lt=check_out,
+            check_out__gt=check_in
         )
-
-        # Check for blocked periods
         blocked_periods = BlockedPeriod.objects.filter(
-            accommodation=accommodation,
-            start_date__lt=check_out_dt,
-            end_date__gt=check_in_dt
+            accommodation=OuterRef('pk'),
+            start_date__lt=check_out,
+            end_date__gt=check_in
+        )
+        blocked_weekdays = BlockedWeekday.objects.filter(
+            overlap_filter(check_in, check_out),
+            accommodation=OuterRef('pk')
         )
+        queryset = Accommodation.objects.filter(
+            ~Exists(overlapping_bookings),
+            ~Exists(blocked_periods),
+            ~Exists(blocked_weekdays)
+        ).order_by('id')
+
+        # Optional filters
+        search_term = request.query_params.get('q')
+        if search_term:
+            queryset = queryset.filter(title__icontains=search_term)
+        ids = request.query_params.get('ids')
+        if ids:
+            try:
+                queryset = queryset.filter(id__in=[int(value) for value in ids.split(',') if value])
+            except ValueError:
+                return Response(
+                    {'error': 'ids must be a comma separated list of integers'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['get'])
+    def availability(self, request, slug=None):
+        """Check availability for a specific accommodation"""
+        return self._cached_response('availability', request, partial(self._availability, request))
+
+    def _availability(self, request):
+        accommodation = self.get_object()
+        check_in_dt, check_out_dt, error = self._parse_range(request)
+        if error:
+            return error
 
-        is_available = not overlapping_bookings.exists() and not blocked_periods.exists()
+        conflicts = lookup_conflicts(accommodation.id, check_in_dt, check_out_dt)
 
         return Response({
-            'available': is_available,
+            'available': conflicts.available,
             'accommodation': AccommodationSerializer(accommodation).data,
-            'conflicting_bookings': BookingSerializer(overlapping_bookings, many=True).data,
-            'blocked_periods': BlockedPeriodSerializer(blocked_periods, many=True).data
+            'conflicting_bookings': BookingSerializer(
+                conflicts.booking_queryset().select_related('accommodation', 'user').prefetch_related('guests'),
+                many=True
+            ).data,
+            'blocked_periods': BlockedPeriodSerializer(
+                conflicts.blocked_period_queryset().select_related('accommodation', 'created_by'),
+                many=True
+            ).data,
+            'blocked_weekdays': BlockedWeekdaySerializer(
+                conflicts.blocked_weekday_queryset().select_related('accommodation', 'created_by').order_by('id'),
+                many=True
+            ).data
+        })
+
+    @action(detail=True, methods=['get'])
+    def calendar(self, request, slug=None):
+        """Get the per-day status (free/pending/booked/blocked) for a date range"""
+        # Without `start` the range begins today: keep the day in the key
+        return self._cached_response(
+            'calendar', request, partial(self._calendar, request), extra=(timezone.localdate(),)
+        )
+
+    def _calendar(self, request):
+        accommodation = self.get_object()
+
+        try:
+            start = date.fromisoformat(request.query_params['start']) if 'start' in request.query_params \
+                else timezone.localdate()
+            end = date.fromisoformat(request.query_params['end']) if 'end' in request.query_params \
+                else start + timedelta(days=CALENDAR_DEFAULT_DAYS - 1)
+        except ValueError:
+            return Response(
+                {'error': 'Invalid date format. Use YYYY-MM-DD'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if end < start:
+            return Response(
+                {'error': 'end must not be before start'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if (end - start).days >= CALENDAR_MAX_DAYS:
+            return Response(
+                {'error': f'The range cannot exceed {CALENDAR_MAX_DAYS} days'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response({
+            'accommodation': accommodation.slug,
+            'start': start,
+            'end': end,
+            'timezone': timezone.get_current_timezone_name(),
+            'days': build_calendar(accommodation.id, start, end),
         })
 
+    @action(detail=True, methods=['get'], renderer_classes=[ICalendarRenderer])
+    def ical(self, request, slug=None, format=None):
+        """iCalendar feed of bookings and blocked days, for OTA calendar sync"""
+        slug = self.kwargs[self.lookup_field]
+        accommodation_id = response_cache.accommodation_id(
+            slug, lambda: Accommodation.objects.filter(slug=slug).values_list('id', flat=True).first()
+        )
+        if accommodation_id is None:
+            raise Http404
+
+        etag, body = cached_feed(accommodation_id, request.get_host())
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(body, content_type=ICAL_CONTENT_TYPE)
+            response['Content-Disposition'] = f'inline; filename="{slug}.ics"'
+        response['ETag'] = etag
+        return response
+
     @action(detail=True, methods=['get'])
     def bookings(self, request, slug=None):
         """Get all bookings for this accommodation"""
+        return self._cached_response('bookings', request, partial(self._bookings, request))
+
+    def _bookings(self, request):
         accommodation = self.get_object()
-        bookings = Booking.objects.filter(accommodation=accommodation).order_by('-check_in')
+        selection = booking_selection(request)
+        bookings = booking_queryset(selection).filter(accommodation=accommodation)
 
         # Filter by status if provided
         booking_status = request.query_params.get('status')
         if booking_status:
             bookings = bookings.filter(status=booking_status)
 
-        serializer = BookingSerializer(bookings, many=True)
-        return Response(serializer.data)
+        return paginated_response(
+            self, bookings, BookingSerializer, CheckInCursorPagination, fields=selection.fields
+        )
 
     @action(detail=True, methods=['get'])
     def blocked_periods(self, request, slug=None):
         """Get all blocked periods for this accommodation"""
+        return self._cached_response('blocked_periods', request, partial(self._blocked_periods, request))
+
+    def _blocked_periods(self, request):
         accommodation = self.get_object()
-        blocked = BlockedPeriod.objects.filter(accommodation=accommodation).order_by('start_date')
-        serializer = BlockedPeriodSerializer(blocked, many=True)
-        return Response(serializer.data)
+        blocked = BlockedPeriod.objects.filter(accommodation=accommodation).select_related(
+            'accommodation', 'created_by'
+        )
+        return paginated_response(self, blocked, BlockedPeriodSerializer, StartDateCursorPagination)
 
 
-class BookingViewSet(viewsets.ModelViewSet):
+class BookingViewSet(ConditionalGetMixin, FastListMixin, viewsets.ModelViewSet):
     queryset = Booking.objects.all()
     serializer_class = BookingSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
+    version_spec = BOOKING_VERSION
 
     def get_serializer_class(self):
         if self.action == 'create':
             return BookingCreateSerializer
         return BookingSerializer
 
-    def get_queryset(self):
-        queryset = Booking.objects.all().order_by('-created_at')
+    @cached_property
+    def field_selection(self):
+        """?fields= / ?expand= of list and retrieve; the other actions use the full representation"""
+        if self.action in ('list', 'retrieve'):
+            return booking_selection(self.request)
+        return select_fields({}, BookingSerializer, BOOKING_EXPANSIONS)
 
-        # Filter by user if not admin
-        user = self.request.user
-        if not user.is_staff and hasattr(user, 'role'):
-            if user.role.name != 'admin':
-                queryset = queryset.filter(user=user)
+    def get_queryset(self):
+        return filter_bookings(
+            booking_queryset(self.field_selection).order_by('-created_at'), self.request.query_params, self.request.user
+        )
 
-        # Filter by status
-        booking_status = self.request.query_params.get('status')
-        if booking_status:
-            queryset = queryset.filter(status=booking_status)
+    def get_serializer(self, *args, **kwargs):
+        if self.get_serializer_class() is BookingSerializer:
+            kwargs.setdefault('fields', self.field_selection.fields)
+        return super().get_serializer(*args, **kwargs)
 
-        # Filter by accommodation
-        accommodation_id = self.request.query_params.get('accommodation')
-        if accommodation_id:
-            queryset = queryset.filter(accommodation_id=accommodation_id)
+    def get_row_serializer(self):
+        return row_serializer_for(self.get_serializer_class(), self.field_selection.fields)
 
-        # Filter by date range
-        start_date = self.request.query_params.get('start_date')
-        end_date = self.request.query_params.get('end_date')
-        if start_date:
-            queryset = queryset.filter(check_in__gte=start_date)
-        if end_date:
-            queryset = queryset.filter(check_out__lte=end_date)
-
-        return queryset
+    def get_version_spec(self):
+        return self.field_selection.version_spec(self.version_spec)
 
     def perform_create(self, serializer):
         booking = serializer.save()
+        statistics.record_bookings_created(booking.status)
 
         # Create audit log
-        BookingAudit.objects.create(
-            booking=booking,
-            action='created',
-            actor_user=self.request.user,
-            data_json={'status': booking.status, 'accommodation_id': booking.accommodation.id}
+        audit.record(
+            booking.id, 'created', self.request.user.id,
+            {'status': booking.status, 'accommodation_id': booking.accommodation_id}
+        )
+
+    def perform_update(self, serializer):
+        previous_status = serializer.instance.status
+        booking = serializer.save()
+        statistics.record_status_change(previous_status, booking.status)
+
+    def perform_destroy(self, instance):
+        booking_status = instance.status
+        instance.delete()
+        statistics.record_booking_deleted(booking_status)
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """Create many bookings at once (mode: atomic or best_effort)"""
+        items = request.data.get('bookings')
+        mode = request.data.get('mode', bulk.MODE_ATOMIC)
+
+        if not isinstance(items, list) or not items:
+            return Response(
+                {'error': 'bookings must be a non-empty list'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(items) > bulk.MAX_ITEMS:
+            return Response(
+                {'error': f'At most {bulk.MAX_ITEMS} bookings per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if mode not in bulk.MODES:
+            return Response(
+                {'error': f"mode must be one of: {', '.join(bulk.MODES)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        created, results = bulk.create_bookings(items, actor_id=request.user.id, mode=mode)
+        if created:
+            statistics.record_bookings_created('pending', created)
+        return Response(
+            {'mode': mode, 'created': created, 'errors': len(items) - created, 'results': results},
+            status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST
         )
 
+    @action(detail=False, methods=['get'], renderer_classes=[CSVRenderer, NDJSONRenderer])
+    def export(self, request):
+        """Stream the filtered bookings with their guests as CSV or NDJSON (?format=csv|ndjson)"""
+        export_format = request.accepted_renderer.format
+        queryset = filter_bookings(Booking.objects.all(), request.query_params, request.user)
+        response = StreamingHttpResponse(
+            iter_export(queryset, export_format), content_type=EXPORT_CONTENT_TYPES[export_format]
+        )
+        timestamp = timezone.now().strftime('%Y%m%d-%H%M%S')
+        response['Content-Disposition'] = f'attachment; filename="bookings-{timestamp}.{export_format}"'
+        return response
+
     @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
     def confirm(self, request, pk=None):
         """Confirm a pending booking"""
@@ -197,14 +530,10 @@ class BookingViewSet(viewsets.ModelViewSet):
 
         booking.status = 'confirmed'
         booking.save()
+        statistics.record_status_change('pending', 'confirmed')
 
         # Create audit log
-        BookingAudit.objects.create(
-            booking=booking,
-            action='confirmed',
-            actor_user=request.user,
-            data_json={'previous_status': 'pending', 'new_status': 'confirmed'}
-        )
+        audit.record(booking.id, 'confirmed', request.user.id, {'previous_status': 'pending', 'new_status': 'confirmed'})
 
         serializer = self.get_serializer(booking)
         return Response(serializer.data)
@@ -223,13 +552,12 @@ class BookingViewSet(viewsets.ModelViewSet):
         previous_status = booking.status
         booking.status = 'cancelled'
         booking.save()
+        statistics.record_status_change(previous_status, 'cancelled')
 
         # Create audit log
-        BookingAudit.objects.create(
-            booking=booking,
-            action='cancelled',
-            actor_user=request.user,
-            data_json={'previous_status': previous_status, 'new_status': 'cancelled'}
+        audit.record(
+            booking.id, 'cancelled', request.user.id,
+            {'previous_status': previous_status, 'new_status': 'cancelled'}
         )
 
         serializer = self.get_serializer(booking)
@@ -248,14 +576,10 @@ class BookingViewSet(viewsets.ModelViewSet):
 
         booking.status = 'rejected'
         booking.save()
+        statistics.record_status_change('pending', 'rejected')
 
         # Create audit log
-        BookingAudit.objects.create(
-            booking=booking,
-            action='rejected',
-            actor_user=request.user,
-            data_json={'previous_status': 'pending', 'new_status': 'rejected'}
-        )
+        audit.record(booking.id, 'rejected', request.user.id, {'previous_status': 'pending', 'new_status': 'rejected'})
 
         serializer = self.get_serializer(booking)
         return Response(serializer.data)
@@ -265,8 +589,7 @@ class BookingViewSet(viewsets.ModelViewSet):
         """Get all guests for this booking"""
         booking = self.get_object()
         guests = BookingGuest.objects.filter(booking=booking)
-        serializer = BookingGuestSerializer(guests, many=True)
-        return Response(serializer.data)
+        return paginated_response(self, guests, BookingGuestSerializer, IdCursorPagination)
 
     @action(detail=True, methods=['post'])
     def add_guest(self, request, pk=None):
@@ -285,9 +608,7 @@ class BookingViewSet(viewsets.ModelViewSet):
     def audit_log(self, request, pk=None):
         """Get audit log for this booking"""
         booking = self.get_object()
-        audit_entries = BookingAudit.objects.filter(booking=booking).order_by('-created_at')
-        serializer = BookingAuditSerializer(audit_entries, many=True)
-        return Response(serializer.data)
+        return archive.paginated_audit_response(self, BookingAuditSerializer, booking_id=booking.id)
 
 
 class BookingGuestViewSet(viewsets.ModelViewSet):
@@ -303,20 +624,72 @@ class BookingGuestViewSet(viewsets.ModelViewSet):
         return queryset
 
 
-class BlockedPeriodViewSet(viewsets.ModelViewSet):
+class BlockedPeriodViewSet(FastListMixin, viewsets.ModelViewSet):
     queryset = BlockedPeriod.objects.all()
     serializer_class = BlockedPeriodSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = StartDateCursorPagination
 
     def get_queryset(self):
-        queryset = BlockedPeriod.objects.all().order_by('start_date')
+        queryset = BlockedPeriod.objects.select_related('accommodation', 'created_by').order_by('start_date')
         accommodation_id = self.request.query_params.get('accommodation')
         if accommodation_id:
             queryset = queryset.filter(accommodation_id=accommodation_id)
         return queryset
 
     def perform_create(self, serializer):
-        serializer.save(created_by=self.request.user)
+        serializer.save(created_by_id=self.request.user.id)
+
+    @action(detail=False, methods=['post'], url_path='import', permission_classes=[IsAdmin])
+    def import_periods(self, request):
+        """Import many blocked periods (CSV, JSON or iCal), merged with the existing ones"""
+        import_format = request.data.get('format')
+        upload = request.FILES.get('file')
+        if upload is not None:
+            try:
+                content = upload.read().decode('utf-8-sig')
+            except UnicodeDecodeError:
+                return Response({'error': 'The file must be UTF-8 text'}, status=status.HTTP_400_BAD_REQUEST)
+            import_format = import_format or blocked_import.guess_format(upload.name)
+        elif 'blocked_periods' in request.data:
+            content = request.data['blocked_periods']
+            import_format = import_format or blocked_import.FORMAT_JSON
+        else:
+            content = request.data.get('content')
+        mode = request.data.get('mode', blocked_import.MODE_MERGE)
+        accommodation_id = request.data.get('accommodation')
+
+        if content is None:
+            return Response(
+                {'error': 'Send a file, content or a blocked_periods list'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if import_format not in blocked_import.FORMATS:
+            return Response(
+                {'error': f"format must be one of: {', '.join(blocked_import.FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if mode not in blocked_import.MODES:
+            return Response(
+                {'error': f"mode must be one of: {', '.join(blocked_import.MODES)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            accommodation_id = int(accommodation_id) if accommodation_id not in (None, '') else None
+        except (TypeError, ValueError):
+            return Response({'error': 'accommodation must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+        items = blocked_import.parse(content, import_format)
+        if len(items) > blocked_import.MAX_ITEMS:
+            return Response(
+                {'error': f'At most {blocked_import.MAX_ITEMS} blocked periods per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        summary = blocked_import.import_blocked_periods(
+            items, accommodation_id=accommodation_id, mode=mode, actor_id=request.user.id,
+            dry_run=str(request.data.get('dry_run', '')).lower() in ('1', 'true', 'yes')
+        )
+        return Response(summary, status=status.HTTP_400_BAD_REQUEST if summary['errors'] else status.HTTP_200_OK)
 
 
 class BlockedWeekdayViewSet(viewsets.ModelViewSet):
@@ -325,27 +698,37 @@ class BlockedWeekdayViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        queryset = BlockedWeekday.objects.all()
+        queryset = BlockedWeekday.objects.select_related('accommodation', 'created_by').order_by('id')
         accommodation_id = self.request.query_params.get('accommodation')
         if accommodation_id:
             queryset = queryset.filter(accommodation_id=accommodation_id)
         return queryset
 
     def perform_create(self, serializer):
-        serializer.save(created_by=self.request.user)
+        serializer.save(created_by_id=self.request.user.id)
 
 
 class BookingAuditViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = BookingAudit.objects.all()
     serializer_class = BookingAuditSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
 
     def get_queryset(self):
-        queryset = BookingAudit.objects.all().order_by('-created_at')
+        return BookingAudit.objects.select_related('actor_user').filter(**self.audit_filters()).order_by('-created_at')
+
+    def audit_filters(self):
         booking_id = self.request.query_params.get('booking')
-        if booking_id:
-            queryset = queryset.filter(booking_id=booking_id)
-        return queryset
+        return {'booking_id': booking_id} if booking_id else {}
+
+    def list(self, request, *args, **kwargs):
+        # Falls through to the archive after the last page of the hot table
+        return archive.paginated_audit_response(self, self.get_serializer_class(), **self.audit_filters())
+
+    def get_object(self):
+        entry = archive.get_audit_entry(self.kwargs['pk'], **self.audit_filters())
+        self.check_object_permissions(self.request, entry)
+        return entry
 
 
 @api_view(['POST'])
@@ -359,6 +742,14 @@ def check_availability(request):
     check_in = serializer.validated_data['check_in']
     check_out = serializer.validated_data['check_out']
 
+    return response_cache.response(
+        accommodation_id, 'check_availability', request,
+        partial(_check_availability, accommodation_id, check_in, check_out),
+        extra=(check_in, check_out)
+    )
+
+
+def _check_availability(accommodation_id, check_in, check_out):
     try:
         accommodation = Accommodation.objects.get(id=accommodation_id)
     except Accommodation.DoesNotExist:
@@ -367,30 +758,38 @@ def check_availability(request):
             status=status.HTTP_404_NOT_FOUND
         )
 
-    # Check for overlapping bookings
-    overlapping_bookings = Booking.objects.filter(
-        accommodation_id=accommodation_id,
-        status__in=['pending', 'confirmed'],
-        check_in__lt=check_out,
-        check_out__gt=check_in
-    )
-
-    # Check for blocked periods
-    blocked_periods = BlockedPeriod.objects.filter(
-        accommodation_id=accommodation_id,
-        start_date__lt=check_out,
-        end_date__gt=check_in
-    )
-
-    is_available = not overlapping_bookings.exists() and not blocked_periods.exists()
+    conflicts = lookup_conflicts(accommodation_id, check_in, check_out)
 
     return Response({
-        'available': is_available,
+        'available': conflicts.available,
         'accommodation': AccommodationSerializer(accommodation).data,
         'check_in': check_in,
         'check_out': check_out,
-        'conflicting_bookings_count': overlapping_bookings.count(),
-        'blocked_periods_count': blocked_periods.count()
+        'conflicting_bookings_count': conflicts.bookings_count,
+        'blocked_periods_count': conflicts.blocked_periods_count,
+        'blocked_weekdays_count': conflicts.blocked_weekdays_count
+    })
+
+
+@api_view(['GET', 'POST'])
+@permission_classes([IsAdmin])
+def availability_index_status(request):
+    """Verify (GET) or rebuild (POST) the in-memory availability index"""
+    accommodation_id = request.query_params.get('accommodation')
+    try:
+        accommodation_ids = [int(accommodation_id)] if accommodation_id else None
+    except ValueError:
+        return Response({'error': 'accommodation must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+    if request.method == 'POST':
+        rebuilt = availability_index.rebuild(accommodation_ids)
+        return Response({'rebuilt': rebuilt})
+
+    mismatches = availability_index.verify(accommodation_ids)
+    return Response({
+        'loaded_accommodations': len(availability_index.loaded()),
+        'consistent': not mismatches,
+        'mismatches': mismatches
     })
 
 
@@ -398,19 +797,11 @@ def check_availability(request):
 @permission_classes([AllowAny])
 def booking_statistics(request):
     """Get booking statistics"""
-    total_bookings = Booking.objects.count()
-    pending_bookings = Booking.objects.filter(status='pending').count()
-    confirmed_bookings = Booking.objects.filter(status='confirmed').count()
-    cancelled_bookings = Booking.objects.filter(status='cancelled').count()
-    rejected_bookings = Booking.objects.filter(status='rejected').count()
+    return Response(statistics.get_statistics())
 
-    return Response({
-        'total_bookings': total_bookings,
-        'pending': pending_bookings,
-        'confirmed': confirmed_bookings,
-        'cancelled': cancelled_bookings,
-        'rejected': rejected_bookings,
-        'total_accommodations': Accommodation.objects.count(),
-        'total_users': User.objects.count()
-    })
 
+@api_view(['GET'])
+@permission_classes([IsAdmin])
+def metrics_snapshot(request):
+    """Get the counters and timings collected by this worker process"""
+    return Response(metrics.snapshot())
@@ -0,0 +1,158 @@
+"""
+Recurring blocks from BlockedWeekday rules.
+
+A rule blocks every week, on its weekday (0=Monday, 6=Sunday), from
+start_time to end_time in the local timezone. Without times it blocks the
+whole day; without end time, or with an end time not after the start time, it
+lasts until midnight; without start time it begins at midnight (the same
+reading as the iCalendar feed).
+
+The rules of an accommodation are compiled once into one list per weekday and
+kept in process memory for WEEKDAY_RULES_TTL seconds. A range never needs
+more than its first eight local days to be checked: after the first (partial)
+day the next seven cover every weekday, so whatever its length the cost
+depends on the number of rules only. `overlap_filter` expresses the same test
+as a Q on BlockedWeekday, for anti-joins and the write-path conflict query.
+"""
+import threading
+from datetime import time, timedelta
+from time import monotonic
+
+from django.conf import settings
+from django.db.models import F, Q, TimeField, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .db_router import primary
+from .models import BlockedWeekday
+
+
+def _local(value):
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return timezone.localtime(value)
+
+
+def day_windows(start, end):
+    """
+    The local days touched by [start, end) as (day, from, until) tuples, where
+    `until` None means midnight. Stops after the first eight days: by then
+    every weekday has been covered by a whole day.
+    """
+    local_start, local_end = _local(start), _local(end)
+    first, last = local_start.date(), local_end.date()
+    windows = []
+    for offset in range(min((last - first).days, 7) + 1):
+        day = first + timedelta(days=offset)
+        window_from = local_start.time() if day == first else time.min
+        window_until = local_end.time() if day == last else None
+        if window_until is not None and window_until <= window_from:
+            continue
+        windows.append((day, window_from, window_until))
+    return windows
+
+
+class WeekdayRules:
+    """The rules of one accommodation as (id, start, end) per weekday, end None meaning midnight"""
+
+    __slots__ = ('by_weekday', 'loaded_at')
+
+    def __init__(self, rows=()):
+        self.by_weekday = [[] for _ in range(7)]
+        for rule_id, weekday, start_time, end_time in rows:
+            start = start_time or time.min
+            end = end_time if end_time is not None and end_time > start else None
+            self.by_weekday[weekday].append((rule_id, start, end))
+        self.loaded_at = monotonic()
+
+    def __bool__(self):
+        return any(self.by_weekday)
+
+    @property
+    def weekdays(self):
+        """The weekdays with at least one rule"""
+        return {weekday for weekday, rules in enumerate(self.by_weekday) if rules}
+
+    def conflicts(self, start, end):
+        """Sorted ids of the rules blocking part of [start, end)"""
+        if not self:
+            return []
+        found = set()
+        for day, window_from, window_until in day_windows(start, end):
+            for rule_id, rule_start, rule_end in self.by_weekday[day.weekday()]:
+                if ((window_until is None or rule_start < window_until)
+                        and (rule_end is None or rule_end > window_from)):
+                    found.add(rule_id)
+        return sorted(found)
+
+
+def overlap_filter(start, end):
+    """Q selecting the BlockedWeekday rows that block part of [start, end)"""
+    midnight = Value(time.min, output_field=TimeField())
+    condition = Q(pk__in=[])
+    for day, window_from, window_until in day_windows(start, end):
+        day_condition = Q(weekday=day.weekday())
+        if window_until is not None:
+            day_condition &= Q(start_time__isnull=True) | Q(start_time__lt=window_until)
+        if window_from != time.min:
+            day_condition &= (
+                Q(end_time__isnull=True) | Q(end_time__gt=window_from)
+                | Q(end_time__lte=Coalesce(F('start_time'), midnight))
+            )
+        condition |= day_condition
+    return condition
+
+
+class WeekdayRuleCache:
+    """Compiled weekday rules per accommodation, kept in process memory."""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'WEEKDAY_RULES_TTL', 60)
+
+    def _fresh(self, entry):
+        return entry is not None and not (self.ttl and monotonic() - entry.loaded_at > self.ttl)
+
+    def load(self, accommodation_ids):
+        """Compile the rules of the given accommodations with one query and keep them"""
+        accommodation_ids = set(accommodation_ids)
+        rows = {accommodation_id: [] for accommodation_id in accommodation_ids}
+        # Kept for up to WEEKDAY_RULES_TTL: always read from the primary
+        with primary():
+            for accommodation_id, *row in BlockedWeekday.objects.filter(
+                accommodation_id__in=accommodation_ids
+            ).values_list('accommodation_id', 'id', 'weekday', 'start_time', 'end_time'):
+                rows[accommodation_id].append(row)
+        entries = {accommodation_id: WeekdayRules(rules) for accommodation_id, rules in rows.items()}
+        with self._lock:
+            self._entries.update(entries)
+        return entries
+
+    def get(self, accommodation_id):
+        entry = self._entries.get(accommodation_id)
+        if not self._fresh(entry):
+            entry = self.load([accommodation_id])[accommodation_id]
+        return entry
+
+    def loaded(self, accommodation_id):
+        """The rules when loaded and fresh, None when that needs the DB"""
+        entry = self._entries.get(accommodation_id)
+        return entry if self._fresh(entry) else None
+
+    def conflicts(self, accommodation_id, start, end):
+        return self.get(accommodation_id).conflicts(start, end)
+
+    def invalidate(self, accommodation_ids=None):
+        with self._lock:
+            if accommodation_ids is None:
+                self._entries.clear()
+            else:
+                for accommodation_id in accommodation_ids:
+                    self._entries.pop(accommodation_id, None)
+
+
+weekday_rules = WeekdayRuleCache()
@@ -0,0 +1,99 @@
+"""
+Benchmark of the JSON renderers and parsers on a page of 1000 bookings.
+
+Builds the bookings with their accommodation, user and two guests in memory
+(no database needed), serializes them once with BookingSerializer and then
+times DRF's JSONRenderer/JSONParser against bookings.renderers.
+
+    python tools/bench_json.py [--rows 1000] [--repeat 20]
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import timedelta
+from io import BytesIO
+from pathlib import Path
+
+# Ensure project root is on sys.path so `booking_backend` can be imported
+_PROJECT_ROOT = Path(__file__).resolve().parent.parent
+if str(_PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(_PROJECT_ROOT))
+
+import django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'booking_backend.settings')
+django.setup()
+
+from django.utils import timezone
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from bookings.models import Accommodation, Booking, BookingGuest, User
+from bookings.renderers import FastJSONParser, FastJSONRenderer, orjson
+from bookings.serializers import BookingSerializer
+
+
+def build_bookings(rows):
+    now = timezone.now()
+    accommodation = Accommodation(id=1, slug='villa-mare', title='Villa al Mare', created_at=now, updated_at=now)
+    bookings = []
+    for i in range(1, rows + 1):
+        booking = Booking(
+            id=i, accommodation=accommodation, user=User(id=i, email=f'guest{i}@example.com'),
+            check_in=now + timedelta(days=3 * i), check_out=now + timedelta(days=3 * i + 2),
+            num_guests=2, status='confirmed', notes='Arrivo in tarda serata, chiavi in portineria',
+            created_at=now, updated_at=now,
+        )
+        # Read by BookingSerializer through booking.guests.all(), as after prefetch_related
+        booking._prefetched_objects_cache = {'guests': [
+            BookingGuest(
+                id=2 * i + n, booking=booking, full_name=f'Ospite {i}-{n}', email=f'ospite{i}{n}@example.com',
+                phone='+39 333 1234567', document_type='id_card', document_number=f'CA{i:05d}{n}',
+                created_at=now, updated_at=now,
+            )
+            for n in range(2)
+        ]}
+        bookings.append(booking)
+    return bookings
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the JSON renderers and parsers')
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    data = BookingSerializer(build_bookings(args.rows), many=True).data
+    serialize_ms = (time.perf_counter() - started) * 1000
+    payload = JSONRenderer().render(data)
+    if FastJSONRenderer().render(data) != payload:
+        sys.exit('FastJSONRenderer output differs from JSONRenderer')
+
+    results = {
+        'render': (
+            best_of(args.repeat, lambda: JSONRenderer().render(data)),
+            best_of(args.repeat, lambda: FastJSONRenderer().render(data)),
+        ),
+        'parse': (
+            best_of(args.repeat, lambda: JSONParser().parse(BytesIO(payload))),
+            best_of(args.repeat, lambda: FastJSONParser().parse(BytesIO(payload))),
+        ),
+    }
+    print(f'{args.rows} bookings, {len(payload) / 1024:.0f} KiB, orjson {"installed" if orjson else "missing"}')
+    print(f'BookingSerializer: {serialize_ms:.1f} ms (the same with every renderer)')
+    for step, (stock, fast) in results.items():
+        print(f'{step:6}  DRF {stock:7.2f} ms  fast {fast:7.2f} ms  saved {stock - fast:7.2f} ms ({stock / fast:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
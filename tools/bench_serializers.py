@@ -0,0 +1,81 @@
+"""
+Benchmark of the list serializers against the configured database.
+
+For the querysets of the hot list endpoints (bookings with their guests,
+accommodations, blocked periods, audit entries), reads the first --rows rows
+and serializes them with the ModelSerializer (instances, select_related and
+prefetch_related as the views do) and with its RowSerializer (values() rows,
+see bookings/fast_serializers.py). Both timings include the queries. The
+rendered JSON of the two must be identical.
+
+    python tools/bench_serializers.py [--rows 1000] [--repeat 10]
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+# Ensure project root is on sys.path so `booking_backend` can be imported
+_PROJECT_ROOT = Path(__file__).resolve().parent.parent
+if str(_PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(_PROJECT_ROOT))
+
+import django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'booking_backend.settings')
+django.setup()
+
+from bookings.fast_serializers import ROW_SERIALIZERS
+from bookings.models import Accommodation, BlockedPeriod, BookingAudit
+from bookings.renderers import FastJSONRenderer
+from bookings.serializers import (
+    AccommodationSerializer, BookingSerializer, BlockedPeriodSerializer, BookingAuditSerializer
+)
+from bookings.views import booking_queryset
+
+QUERYSETS = [
+    ('bookings', BookingSerializer, lambda: booking_queryset().order_by('-created_at', '-id')),
+    ('accommodations', AccommodationSerializer, lambda: Accommodation.objects.order_by('id')),
+    ('blocked periods', BlockedPeriodSerializer, lambda: BlockedPeriod.objects.select_related(
+        'accommodation', 'created_by').order_by('start_date', 'id')),
+    ('audit entries', BookingAuditSerializer, lambda: BookingAudit.objects.select_related(
+        'actor_user').order_by('-created_at', '-id')),
+]
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the ModelSerializers against the RowSerializers')
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    renderer = FastJSONRenderer()
+    for name, serializer_class, queryset in QUERYSETS:
+        row_serializer = ROW_SERIALIZERS[serializer_class]
+
+        def model_data():
+            return serializer_class(queryset()[:args.rows], many=True).data
+
+        def row_data():
+            return row_serializer.to_representation(row_serializer.values(queryset())[:args.rows])
+
+        rows = len(row_data())
+        if renderer.render(model_data()) != renderer.render(row_data()):
+            sys.exit(f'{name}: RowSerializer output differs from {serializer_class.__name__}')
+        stock = best_of(args.repeat, model_data)
+        fast = best_of(args.repeat, row_data)
+        print(f'{name:16} {rows:6} rows  ModelSerializer {stock:8.2f} ms  RowSerializer {fast:8.2f} ms  '
+              f'({stock / fast:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()